@@ -0,0 +1,411 @@
+import email.utils
+import hashlib
+import json
+import logging
+import math
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional
+
+from market_data import TTLCache
+
+
+MAX_BATCH_SCENARIOS = 1000
+
+
+def _json_default(value):
+    # NumPy scalars and similar expose their Python value through item()
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class AnalysisSnapshot:
+    """One published analysis for a timeframe; read-only once built
+
+    `payload` is the full analysis, for rendering pages. The JSON API view of
+    it (the whole payload unless a `view` is given) is serialized when the
+    snapshot is published, so handlers send `body` (or `response_body(...)`)
+    without touching the analysis again. `version` increases with every
+    snapshot the refresher publishes. `etag` is a digest of `body`, so it
+    only changes with the published data; `modified_at` is when it last did.
+    The ETag is weak because responses add per-request fields (timestamp,
+    snapshot age) around the same data.
+    """
+
+    __slots__ = ('timeframe', 'version', 'created_at', 'payload', 'body', 'etag', 'modified_at')
+
+    def __init__(self, timeframe, version, payload: dict, view: Optional[Callable[[dict], dict]] = None,
+                 previous: Optional['AnalysisSnapshot'] = None):
+        set_slot = object.__setattr__
+        body = json.dumps(view(payload) if view else payload, default=_json_default)
+        etag = 'W/"' + hashlib.sha1(body.encode()).hexdigest()[:20] + '"'
+        set_slot(self, 'timeframe', timeframe)
+        set_slot(self, 'version', version)
+        set_slot(self, 'created_at', time.time())
+        set_slot(self, 'payload', payload)
+        set_slot(self, 'body', body)
+        set_slot(self, 'etag', etag)
+        unchanged = previous is not None and previous.etag == etag
+        set_slot(self, 'modified_at', previous.modified_at if unchanged else self.created_at)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("analysis snapshots are read-only")
+
+    @property
+    def age(self) -> float:
+        """Seconds since the analysis was computed"""
+        return time.time() - self.created_at
+
+    def matches(self, if_none_match=None, if_modified_since=None) -> bool:
+        """True when a conditional GET's validators show the client already has this data
+
+        If-None-Match takes precedence and uses weak comparison; If-Modified-Since
+        is only consulted without it, as RFC 9110 asks.
+        """
+        if if_none_match:
+            opaque = self.etag[2:]  # weak comparison: W/ prefixes on either side are ignored
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or any((tag[2:] if tag.startswith('W/') else tag) == opaque for tag in tags)
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(self.modified_at) <= since
+        return False
+
+    def response_body(self, **fields) -> str:
+        """JSON object with `fields` followed by the payload's keys, without serializing the payload again"""
+        if not fields:
+            return self.body
+        head = json.dumps(fields, default=_json_default)[:-1]
+        return head + (', ' + self.body[1:] if self.body != '{}' else '}')
+
+
+class SnapshotRefresher:
+    """Recomputes an analysis per timeframe on a background thread and publishes snapshots
+
+    `compute(timeframe)` returns the payload for one timeframe and the
+    optional `view(payload)` picks what the JSON API publishes of it. Every
+    `interval` seconds each timeframe is recomputed and its snapshot
+    replaced in one assignment, so readers get a complete snapshot with a
+    dictionary lookup. A failed refresh keeps the previous snapshot.
+    A timeframe asked for before its first snapshot is computed right away
+    for that caller instead of waiting for its turn in the background pass;
+    after a failed computation it is left to the background pass until one
+    interval has gone by, so requests do not each retry it.
+    `on_publish` listeners are called with each new snapshot. The thread
+    starts with the first `get()` (or `start()`), so an app can create the
+    refresher at import time.
+    """
+
+    def __init__(self, compute: Callable[[str], dict], timeframes: Iterable[str], interval=60.0,
+                 view: Optional[Callable[[dict], dict]] = None):
+        self.compute = compute
+        self.view = view
+        self.timeframes = tuple(timeframes)
+        self.interval = interval
+        self.snapshots: Dict[str, AnalysisSnapshot] = {}
+        # One computation per timeframe at a time, whether background or on demand
+        self.computing = {timeframe: threading.Lock() for timeframe in self.timeframes}
+        self.version = 0
+        self.failures = 0
+        self.last_failure = {}  # timeframe -> (monotonic time, error) of its latest failed computation
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, daemon=True, name="analysis-refresher")
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def on_publish(self, listener: Callable[[AnalysisSnapshot], None]):
+        self.listeners.append(listener)
+
+    def refresh(self, timeframe) -> Optional[AnalysisSnapshot]:
+        """Recompute one timeframe now and publish it; None if the computation failed"""
+        with self.computing[timeframe]:
+            return self._publish(timeframe)
+
+    def _publish(self, timeframe) -> Optional[AnalysisSnapshot]:
+        """Compute and publish one timeframe; the caller holds its computing lock"""
+        started = time.perf_counter()
+        try:
+            payload = self.compute(timeframe)
+        except Exception as e:
+            self.failures += 1
+            self.last_failure[timeframe] = (time.monotonic(), str(e))
+            logging.warning(f"Analysis refresh for {timeframe} failed - serving the previous snapshot: {e}")
+            return None
+        self.last_failure.pop(timeframe, None)
+        with self.lock:
+            self.version += 1
+            snapshot = AnalysisSnapshot(timeframe, self.version, payload, self.view, self.snapshots.get(timeframe))
+            self.snapshots[timeframe] = snapshot
+        logging.info(f"Published {timeframe} analysis v{snapshot.version} "
+                     f"in {time.perf_counter() - started:.2f}s")
+        for listener in self.listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logging.warning(f"Snapshot listener failed for {timeframe}: {e}")
+        return snapshot
+
+    def _run(self):
+        while not self.stopped.is_set():
+            for timeframe in self.timeframes:
+                if self.stopped.is_set():
+                    return
+                with self.computing[timeframe]:
+                    snapshot = self.snapshots.get(timeframe)
+                    if snapshot is not None and snapshot.age < self.interval / 2:
+                        continue  # computed on demand moments ago
+                    self._publish(timeframe)
+            self.stopped.wait(self.interval)
+
+    def latest(self, timeframe) -> Optional[AnalysisSnapshot]:
+        return self.snapshots.get(timeframe)
+
+    def supports(self, timeframe) -> bool:
+        return timeframe in self.computing
+
+    def _recently_failed(self, timeframe) -> bool:
+        failure = self.last_failure.get(timeframe)
+        return failure is not None and time.monotonic() - failure[0] < self.interval
+
+    def unavailable_reason(self, timeframe) -> str:
+        """Why `get(timeframe)` returned None, for the error response"""
+        failure = self.last_failure.get(timeframe)
+        if failure is None:
+            return f"Analysis for time frame {timeframe} is still being computed, please retry shortly"
+        failed_ago = time.monotonic() - failure[0]
+        retry_in = max(0.0, self.interval - failed_ago)
+        return (f"Analysis for time frame {timeframe} failed {failed_ago:.0f}s ago ({failure[1]}); "
+                f"it is retried within {retry_in:.0f}s")
+
+    def get(self, timeframe, timeout=30.0) -> Optional[AnalysisSnapshot]:
+        """Latest snapshot for `timeframe`; the first one is computed on demand
+
+        `timeout` bounds only the wait for a computation of the same
+        timeframe that is already running elsewhere. None means there is no
+        snapshot yet; `unavailable_reason` tells the caller why.
+        """
+        if not self.supports(timeframe):
+            raise KeyError(f"unsupported timeframe: {timeframe}")
+        self.start()
+        snapshot = self.snapshots.get(timeframe)
+        if snapshot is not None or self._recently_failed(timeframe):
+            return snapshot
+        lock = self.computing[timeframe]
+        if not lock.acquire(timeout=timeout):
+            return None
+        try:
+            # Another request or the background pass may have published (or failed) it meanwhile
+            snapshot = self.snapshots.get(timeframe)
+            if snapshot is None and not self._recently_failed(timeframe):
+                snapshot = self._publish(timeframe)
+            return snapshot
+        finally:
+            lock.release()
+
+    def cache_headers(self, snapshot: AnalysisSnapshot) -> dict:
+        """Validators and freshness for a response built from `snapshot`
+
+        A snapshot stays current for one refresh interval; Age tells caches
+        how much of that has already passed.
+        """
+        return {
+            'ETag': snapshot.etag,
+            'Last-Modified': email.utils.formatdate(snapshot.modified_at, usegmt=True),
+            'Cache-Control': f"public, max-age={int(self.interval)}",
+            'Age': str(int(snapshot.age))
+        }
+
+    def batch_body(self, snapshots: Dict[str, AnalysisSnapshot], results: list, **fields) -> str:
+        """JSON with `fields`, each timeframe's published analysis (as already serialized) and the per-scenario results"""
+        markets = ', '.join(json.dumps(timeframe) + ': ' + snapshot.response_body(**self.describe(snapshot))
+                            for timeframe, snapshot in snapshots.items())
+        head = json.dumps(fields, default=_json_default)[:-1] + (', ' if fields else '')
+        return f'{head}"markets": {{{markets}}}, "results": {json.dumps(results, default=_json_default)}}}'
+
+    @staticmethod
+    def describe(snapshot: AnalysisSnapshot) -> dict:
+        """Fields telling API clients which snapshot they got and how old it is"""
+        return {
+            'snapshot_version': snapshot.version,
+            'snapshot_time': datetime.fromtimestamp(snapshot.created_at).isoformat(),
+            'snapshot_age_seconds': round(snapshot.age, 1)
+        }
+
+
+class EventBroadcaster:
+    """Fans one producer's server-sent events out to any number of subscribers
+
+    Each event is encoded into SSE wire format once, when it is published,
+    and kept in a short history. A subscriber only waits on the shared
+    condition and sends the encoded bytes, so an open connection costs no
+    computation of its own. A client reconnecting with Last-Event-ID gets
+    the events it missed while they are still in the history; new or
+    lagging clients get the latest event of every topic instead.
+    """
+
+    def __init__(self, history=256, heartbeat=15.0, retry_ms=5000):
+        self.history = deque(maxlen=history)  # (event id, topic, encoded event)
+        self.latest = {}  # topic -> (event id, encoded event)
+        self.last_id = 0
+        self.heartbeat = heartbeat  # seconds of silence before a keep-alive comment
+        self.retry_ms = retry_ms
+        self.subscribers = 0
+        self.condition = threading.Condition()
+
+    def publish(self, topic, event, data: dict) -> int:
+        payload = json.dumps(data, separators=(',', ':'), default=_json_default)
+        with self.condition:
+            self.last_id += 1
+            encoded = f"id: {self.last_id}\nevent: {event}\ndata: {payload}\n\n".encode()
+            self.history.append((self.last_id, topic, encoded))
+            self.latest[topic] = (self.last_id, encoded)
+            self.condition.notify_all()
+            return self.last_id
+
+    def _after(self, seen, topics) -> list:
+        """Encoded events newer than `seen`; the caller holds the condition"""
+        if seen is not None and self.history and self.history[0][0] <= seen + 1:
+            return [encoded for event_id, topic, encoded in self.history
+                    if event_id > seen and (topics is None or topic in topics)]
+        # Nothing seen yet, or the history no longer reaches back that far
+        return [encoded for event_id, encoded in sorted(
+            value for topic, value in self.latest.items() if topics is None or topic in topics)
+            if seen is None or event_id > seen]
+
+    def subscribe(self, topics: Optional[Iterable[str]] = None, last_event_id=None):
+        """Generator of encoded events and keep-alive comments for one connection"""
+        topics = set(topics) if topics else None
+        try:
+            seen = int(last_event_id) if last_event_id is not None else None
+        except ValueError:
+            seen = None
+        with self.condition:
+            self.subscribers += 1
+            pending = self._after(seen, topics)
+            seen = self.last_id
+        try:
+            yield f"retry: {self.retry_ms}\n\n".encode()
+            while True:
+                if pending:
+                    yield b''.join(pending)
+                else:
+                    yield b': keep-alive\n\n'
+                with self.condition:
+                    if self.last_id == seen:
+                        self.condition.wait(self.heartbeat)
+                    pending = self._after(seen, topics)
+                    seen = self.last_id
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+
+class SignalPublisher:
+    """Snapshot listener that broadcasts a compact 'signal' event when a timeframe's signal changes
+
+    `fields(payload)` picks the values dashboards follow (recommendation,
+    confidence, RSI, price). A refresh that leaves them all unchanged sends
+    nothing.
+    """
+
+    def __init__(self, broadcaster: EventBroadcaster, fields: Callable[[dict], dict]):
+        self.broadcaster = broadcaster
+        self.fields = fields
+        self.last = {}  # timeframe -> fields of the last event sent
+
+    def __call__(self, snapshot: AnalysisSnapshot):
+        fields = self.fields(snapshot.payload)
+        if self.last.get(snapshot.timeframe) == fields:
+            return
+        self.last[snapshot.timeframe] = fields
+        self.broadcaster.publish(snapshot.timeframe, 'signal', {
+            'time_frame': snapshot.timeframe,
+            **fields,
+            'version': snapshot.version,
+            'time': datetime.fromtimestamp(snapshot.created_at).isoformat(timespec='seconds')
+        })
+
+
+def parse_scenarios(data, timeframes, default_analysis_type, limit=MAX_BATCH_SCENARIOS) -> list:
+    """Validated batch scenarios from a JSON body {"scenarios": [{...}, ...]} or a bare list
+
+    A scenario takes time_frame, account_balance, risk_per_trade and
+    analysis_type, defaulting like the /analyze form. Raises ValueError
+    naming the first invalid scenario.
+    """
+    scenarios = data.get('scenarios') if isinstance(data, dict) else data
+    if not isinstance(scenarios, list) or not scenarios:
+        raise ValueError('expected a JSON body with a non-empty "scenarios" list')
+    if len(scenarios) > limit:
+        raise ValueError(f"at most {limit} scenarios per batch")
+
+    parsed = []
+    for index, scenario in enumerate(scenarios):
+        if not isinstance(scenario, dict):
+            raise ValueError(f"scenario {index}: expected an object")
+        time_frame = str(scenario.get('time_frame', '30'))
+        if time_frame not in timeframes:
+            raise ValueError(f"scenario {index}: time_frame must be one of {', '.join(timeframes)}")
+        try:
+            account_balance = float(scenario.get('account_balance', 1000))
+            risk_per_trade = float(scenario.get('risk_per_trade', 2))
+        except (TypeError, ValueError):
+            raise ValueError(f"scenario {index}: account_balance and risk_per_trade must be numbers")
+        if not (math.isfinite(account_balance) and account_balance > 0 and 0 < risk_per_trade <= 100):
+            raise ValueError(f"scenario {index}: account_balance must be positive and risk_per_trade in (0, 100]")
+        parsed.append({
+            'time_frame': time_frame,
+            'analysis_type': str(scenario.get('analysis_type', default_analysis_type)),
+            'account_balance': account_balance,
+            'risk_per_trade': risk_per_trade
+        })
+    return parsed
+
+
+class FragmentPage:
+    """A results template compiled once, with everything but one per-request block cached per key
+
+    The template marks its per-request part with `{% block <name> %}`. The
+    rest of the page depends only on market state: it is rendered once per
+    cache key (e.g. timeframe and snapshot version) and kept as the text
+    before and after the block, so a request renders just the block and
+    joins three strings. `template` is the whole page, for error pages.
+    """
+
+    MARKER = '<!--per-request-fragment-->'
+
+    def __init__(self, environment, source, block, max_entries=64):
+        match = re.search(r'{%-?\s*block\s+' + block + r'\s*-?%}(.*?){%-?\s*endblock(?:\s+' + block + r')?\s*-?%}',
+                          source, re.S)
+        if match is None:
+            raise ValueError(f"template has no {block} block")
+        self.template = environment.from_string(source)
+        self.shell = environment.from_string(source[:match.start()] + self.MARKER + source[match.end():])
+        self.fragment = environment.from_string(match.group(1))
+        self.cache = TTLCache(ttl=float('inf'), max_entries=max_entries)
+
+    def _split(self, page_context):
+        head, tail = self.shell.render(**page_context()).split(self.MARKER, 1)
+        return head, tail
+
+    def render(self, key, page_context: Callable[[], dict], block_context: dict) -> str:
+        """The page for `key` (rendered once from `page_context()`) with the block rendered from `block_context`"""
+        head, tail = self.cache.get(key, lambda: self._split(page_context))
+        return head + self.fragment.render(**block_context) + tail
@@ -0,0 +1,201 @@
+"""Download years of Binance klines into the on-disk OHLCV store
+
+    python backfill.py --interval 1h --start 2020-01-01 --end 2024-01-01
+    python backfill.py --interval 1m --start 2023-01-01 --base-url http://127.0.0.1:8000/api/v3/klines
+
+The range is split into provider-sized pages that are fetched by a small
+worker pool within the shared request budget. Pages are committed to the
+store strictly in order, and the next page start is checkpointed after
+each commit, so an interrupted run picks up where it stopped.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from market_data import RateLimited, http_client, request_scheduler, BINANCE_KLINES
+from ohlcv_store import DEFAULT_DIRECTORY, OHLCVStore, kline_rows
+
+KLINE_INTERVAL_MS = {
+    '1m': 60 * 1000, '5m': 300 * 1000, '15m': 900 * 1000,
+    '1h': 3600 * 1000, '4h': 14400 * 1000, '1d': 86400 * 1000
+}
+PAGE_LIMIT = 1000  # most klines Binance returns per request
+
+
+class KlineBackfill:
+    """Fetches a kline range page by page with a worker pool and appends it to an OHLCVStore
+
+    `fetch(start_ms, end_ms)` returns one page of klines (raw JSON bytes or
+    decoded rows); by default it
+    calls `base_url` through the shared http_client, so the provider's token
+    bucket applies. Out-of-budget and 429 answers wait for the bucket in the
+    worker and retry; other errors are retried `retries` times before the
+    run stops with its progress checkpointed.
+    """
+
+    def __init__(self, store: OHLCVStore, interval, symbol='BTCUSDT', base_url=BINANCE_KLINES,
+                 workers=4, page_limit=PAGE_LIMIT, retries=3,
+                 fetch: Optional[Callable[[int, int], bytes]] = None):
+        self.store = store
+        self.interval = interval
+        self.step = KLINE_INTERVAL_MS[interval]
+        self.symbol = symbol
+        self.base_url = base_url
+        self.workers = workers
+        self.page_limit = page_limit
+        self.retries = retries
+        self.fetch = fetch or self.fetch_page
+        self.checkpoint_path = os.path.join(store.path, 'backfill.json')
+        self.pages_fetched = 0
+
+    def fetch_page(self, start_ms, end_ms) -> bytes:
+        url = (f"{self.base_url}?symbol={self.symbol}&interval={self.interval}"
+               f"&startTime={start_ms}&endTime={end_ms - 1}&limit={self.page_limit}")
+        # Raw body: kline_rows decodes it straight into arrays
+        return http_client.get(url, timeout=30)
+
+    def pages(self, start_ms, end_ms) -> list:
+        """(start, end) bounds of the pages covering [start_ms, end_ms)"""
+        span = self.step * self.page_limit
+        return [(page_start, min(page_start + span, end_ms)) for page_start in range(start_ms, end_ms, span)]
+
+    def _fetch_with_retry(self, start_ms, end_ms) -> Dict[str, np.ndarray]:
+        provider = request_scheduler.provider(urlsplit(self.base_url).hostname)
+        failures = 0
+        while True:
+            try:
+                rows = kline_rows(self.fetch(start_ms, end_ms))
+                keep = (rows['timestamp'] >= start_ms) & (rows['timestamp'] < end_ms)
+                return {column: values[keep] for column, values in rows.items()}
+            except (RateLimited, urllib.error.HTTPError) as e:
+                if isinstance(e, urllib.error.HTTPError) and e.code not in (418, 429):
+                    failures += 1
+                    if failures > self.retries:
+                        raise
+                # Workers may wait; the scheduler already knows when the provider reopens
+                time.sleep(max(request_scheduler.wait_time(provider) if provider else 1.0, 0.1))
+            except Exception:
+                failures += 1
+                if failures > self.retries:
+                    raise
+                time.sleep(2 ** failures)
+
+    def _load_checkpoint(self, start_ms, end_ms) -> int:
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return start_ms
+        if checkpoint.get('interval') != self.interval or checkpoint.get('symbol') != self.symbol:
+            return start_ms
+        return max(start_ms, min(int(checkpoint.get('next_start', start_ms)), end_ms))
+
+    def _save_checkpoint(self, next_start, end_ms):
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'symbol': self.symbol, 'interval': self.interval,
+                       'next_start': next_start, 'end': end_ms}, f)
+        os.replace(temporary, self.checkpoint_path)
+
+    def _download(self, start_ms, end_ms) -> int:
+        """Append [start_ms, end_ms) to the store, resuming from the checkpoint or the last stored row"""
+        last = self.store.last_timestamp()
+        if last is not None and last >= start_ms:
+            start_ms = int(last) + self.step
+        start_ms = self._load_checkpoint(start_ms, end_ms)
+        pages = self.pages(start_ms, end_ms)
+        if not pages:
+            return 0
+
+        added = 0
+        done = {}
+        next_page = 0
+        queued = iter(pages)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="backfill") as executor:
+            def top_up():
+                # A bounded window keeps finished-but-unwritten pages few behind a slow page
+                while len(pending) < self.workers * 2 and len(pending) + len(done) < self.workers * 4:
+                    page = next(queued, None)
+                    if page is None:
+                        return
+                    pending[executor.submit(self._fetch_with_retry, *page)] = page
+
+            top_up()
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    page = pending.pop(future)
+                    done[page] = future.result()
+                    self.pages_fetched += 1
+                # Commit the contiguous run of finished pages in order, then checkpoint
+                committed = next_page
+                while next_page < len(pages) and pages[next_page] in done:
+                    page = pages[next_page]
+                    added += self.store.merge(done.pop(page))
+                    next_page += 1
+                    self._save_checkpoint(page[1], end_ms)
+                if next_page > committed:
+                    logging.info(f"Backfill {self.symbol} {self.interval}: {next_page}/{len(pages)} pages, "
+                                 f"{len(self.store)} rows stored")
+                top_up()
+        return added
+
+    def run(self, start_ms, end_ms) -> int:
+        """Backfill [start_ms, end_ms) and return the number of rows added to the store"""
+        first = self.store.first_timestamp()
+        added = 0
+        if first is not None and start_ms < first:
+            # Older rows go to a staging store first so they can be prepended in one rewrite
+            staging = OHLCVStore(os.path.dirname(self.store.path), os.path.basename(self.store.path) + '_staging')
+            staged = KlineBackfill(staging, self.interval, self.symbol, self.base_url,
+                                   self.workers, self.page_limit, self.retries, self.fetch)
+            staged._download(start_ms, int(first))
+            added += self.store.merge(staging.read())
+            self.pages_fetched += staged.pages_fetched
+            shutil.rmtree(staging.path)
+        return added + self._download(start_ms, end_ms)
+
+
+def parse_date(value) -> int:
+    """YYYY-MM-DD (UTC) as epoch milliseconds"""
+    return int(datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill Binance klines into the local OHLCV store")
+    parser.add_argument('--interval', default='1h', choices=sorted(KLINE_INTERVAL_MS))
+    parser.add_argument('--start', required=True, type=parse_date, help="first day, YYYY-MM-DD (UTC)")
+    parser.add_argument('--end', type=parse_date, help="day to stop before, YYYY-MM-DD (default: now)")
+    parser.add_argument('--symbol', default='BTCUSDT')
+    parser.add_argument('--base-url', default=BINANCE_KLINES, help="klines endpoint, e.g. a local stand-in")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--directory', default=DEFAULT_DIRECTORY)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    end = args.end if args.end is not None else int(time.time() * 1000)
+    # Only closed klines are stored, so stop at the start of the current interval
+    step = KLINE_INTERVAL_MS[args.interval]
+    end = min(end, int(time.time() * 1000) // step * step)
+
+    store = OHLCVStore(args.directory, f"{args.symbol.lower()}_{args.interval}")
+    backfill = KlineBackfill(store, args.interval, args.symbol, args.base_url, workers=args.workers)
+    started = time.perf_counter()
+    added = backfill.run(args.start, end)
+    logging.info(f"Added {added} {args.interval} rows in {backfill.pages_fetched} pages "
+                 f"({time.perf_counter() - started:.1f}s); {len(store)} rows in {store.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Parse time per 10k rows: json.loads + per-row lists vs direct-to-NumPy decoding
+
+    python bench_payload_decoding.py [rows]
+
+"Before" is the path the Flask engines used: json.loads, list comprehensions
+and one datetime.fromtimestamp call per row before building the DataFrame.
+"After" decodes the raw body straight into float64 columns and converts the
+timestamps in one vectorized pass. Peak traced memory shows the per-row
+Python objects the old path allocates.
+"""
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from ohlcv_store import kline_rows, local_datetime_index, market_chart_rows
+
+
+def market_chart_payload(rows) -> bytes:
+    start = 1_600_000_000_000
+    prices = [[start + i * 3_600_000, 30000 + 5000 * np.sin(i / 50)] for i in range(rows)]
+    volumes = [[start + i * 3_600_000, 2.5e10 + i] for i in range(rows)]
+    payload = {'prices': prices, 'market_caps': prices, 'total_volumes': volumes}
+    return json.dumps(payload, separators=(',', ':')).encode()  # compact, as the API sends it
+
+
+def klines_payload(rows) -> bytes:
+    start = 1_600_000_000_000
+    klines = [[start + i * 60_000, "30000.10", "30010.00", "29990.00", f"{30000 + i % 97:.2f}", "12.3456",
+               start + i * 60_000 + 59_999, "370000.0", 420, "6.1", "183000.0", "0"] for i in range(rows)]
+    return json.dumps(klines, separators=(',', ':')).encode()
+
+
+def market_chart_before(raw):
+    data = json.loads(raw)
+    prices = [price[1] for price in data['prices']]
+    dates = [datetime.fromtimestamp(price[0] / 1000) for price in data['prices']]
+    return pd.DataFrame({'date': dates, 'price': prices}).set_index('date')
+
+
+def market_chart_after(raw):
+    rows = market_chart_rows(raw)
+    return pd.DataFrame({'date': local_datetime_index(rows['timestamp']), 'price': rows['close']}).set_index('date')
+
+
+def klines_before(raw):
+    data = json.loads(raw)
+    prices = [float(candle[4]) for candle in data]
+    dates = [datetime.fromtimestamp(candle[6] / 1000) for candle in data]
+    return pd.DataFrame({'date': dates, 'price': prices}).set_index('date')
+
+
+def klines_after(raw):
+    rows = kline_rows(raw)
+    return pd.DataFrame({'date': local_datetime_index(rows['timestamp'] + 59_999), 'price': rows['close']}).set_index('date')
+
+
+def per_10k(function, raw, rows, repeats=7):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(raw)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000 * 10_000 / rows
+
+
+def peak_kib(function, raw):
+    tracemalloc.start()
+    function(raw)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    cases = [
+        ('market_chart', market_chart_payload(rows), market_chart_before, market_chart_after),
+        ('klines', klines_payload(rows), klines_before, klines_after),
+    ]
+    print(f"{'payload':<14}{'before ms/10k':>15}{'after ms/10k':>15}{'speedup':>10}"
+          f"{'before peak KiB':>17}{'after peak KiB':>16}")
+    for name, raw, before, after in cases:
+        expected, actual = before(raw), after(raw)
+        assert np.allclose(expected['price'].to_numpy(), actual['price'].to_numpy())
+        assert (expected.index == actual.index).all()
+        old, new = per_10k(before, raw, rows), per_10k(after, raw, rows)
+        print(f"{name:<14}{old:>15.2f}{new:>15.2f}{old / new:>9.1f}x"
+              f"{peak_kib(before, raw):>17.0f}{peak_kib(after, raw):>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Render time of the /analyze results page: per-request template compile vs compiled + cached fragments
+
+    python bench_results_render.py [requests]
+
+"Before" is what every /analyze call did: render_template_string on the
+inline RESULTS_HTML, which re-parses and recompiles the template. "After"
+is render_results: the template is compiled once, the market-state part of
+the page is cached per snapshot version, and only the position-sizing block
+is rendered per request. Both render the same snapshot for the same
+account profiles, and the pages are checked to be identical.
+"""
+import importlib
+import statistics
+import sys
+import time
+
+from flask import render_template_string
+
+# module -> (assistant, position sizing method, RESULTS_HTML needs the sentiment card)
+VERSIONS = {
+    'ver1': ('advanced_bot', 'calculate_position_sizing', True),
+    'ver2': ('beginner_bot', 'calculate_simple_position_size', False),
+    'ver3': ('ai_bot', 'calculate_simple_position_size', False),
+    'ver4': ('ai_bot', 'calculate_simple_position_size', False),
+}
+PROFILES = [(balance, risk) for balance in (500, 1000, 2500, 10000, 50000) for risk in (1, 2, 3.5, 5)]
+
+
+def before(module, snapshot, balance, risk):
+    bot_name, sizing, has_sentiment = VERSIONS[module.__name__]
+    bot = getattr(module, bot_name)
+    analysis = dict(snapshot.payload['analysis'])
+    analysis['position_sizing'] = getattr(bot, sizing)(analysis['current_price'], balance, risk)
+    if module.__name__ == 'ver1' and analysis['educational_tips']:  # its risk tip quotes the user's risk
+        analysis['educational_tips'] = bot.get_educational_tips(risk)
+    extra = {'sentiment': snapshot.payload['sentiment']} if has_sentiment else {}
+    return render_template_string(module.RESULTS_HTML, analysis=analysis, error=None, **extra)
+
+
+def after(module, snapshot, balance, risk):
+    return module.render_results(snapshot.timeframe, balance, risk)
+
+
+def timings(function, module, snapshot, requests):
+    samples = []
+    for i in range(requests):
+        balance, risk = PROFILES[i % len(PROFILES)]
+        start = time.perf_counter()
+        function(module, snapshot, balance, risk)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{'version':<9}{'before p50 ms':>15}{'before p95 ms':>15}{'after p50 ms':>14}{'after p95 ms':>14}{'speedup':>10}")
+    for name in VERSIONS:
+        module = importlib.import_module(name)
+        snapshot = module.analysis_snapshots.refresh('30')
+        if snapshot is None:
+            print(f"{name:<9}no analysis available (see the log above)")
+            continue
+        with module.app.test_request_context('/analyze', method='POST'):
+            for balance, risk in PROFILES:
+                assert before(module, snapshot, balance, risk) == after(module, snapshot, balance, risk), name
+            old_p50, old_p95 = timings(before, module, snapshot, requests)
+            new_p50, new_p95 = timings(after, module, snapshot, requests)
+        print(f"{name:<9}{old_p50:>15.3f}{old_p95:>15.3f}{new_p50:>14.3f}{new_p95:>14.3f}{old_p50 / new_p50:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,699 @@
+import functools
+import inspect
+import math
+from collections import deque
+from typing import Optional, Iterable
+
+import numpy as np
+
+
+class StreamingRSI:
+    """Wilder RSI updated in constant time per appended price"""
+
+    def __init__(self, period=14):
+        self.period = period
+        self.prev_price = None
+        self.count = 0  # price changes seen so far
+        self.gain_sum = 0.0
+        self.loss_sum = 0.0
+        self.avg_gain = None
+        self.avg_loss = None
+
+    @classmethod
+    def from_prices(cls, prices: Iterable[float], period=14):
+        """Build a state that has already consumed the given prices"""
+        state = cls(period)
+        for price in prices:
+            state.update(price)
+        return state
+
+    def update(self, price: float) -> Optional[float]:
+        """Feed the next price and return the current RSI"""
+        if self.prev_price is None:
+            self.prev_price = price
+            return None
+
+        change = price - self.prev_price
+        self.prev_price = price
+        gain = change if change > 0 else 0.0
+        loss = -change if change < 0 else 0.0
+        self.count += 1
+
+        if self.avg_gain is None:
+            # Seed with the simple average of the first `period` changes
+            self.gain_sum += gain
+            self.loss_sum += loss
+            if self.count == self.period:
+                self.avg_gain = self.gain_sum / self.period
+                self.avg_loss = self.loss_sum / self.period
+        else:
+            self.avg_gain = (self.avg_gain * (self.period - 1) + gain) / self.period
+            self.avg_loss = (self.avg_loss * (self.period - 1) + loss) / self.period
+
+        return self.value
+
+    @property
+    def value(self) -> Optional[float]:
+        if self.avg_gain is None:
+            return None
+        if self.avg_loss == 0:
+            return 100.0
+        rs = self.avg_gain / self.avg_loss
+        return 100 - (100 / (1 + rs))
+
+
+class StreamingEMA:
+    """Exponential moving average updated in constant time per price"""
+
+    def __init__(self, period, sma_seed=True):
+        self.period = period
+        self.alpha = 2 / (period + 1)
+        self.sma_seed = sma_seed
+        self.count = 0
+        self.seed_sum = 0.0
+        self.value = None
+
+    def update(self, price: float) -> Optional[float]:
+        """Feed the next price and return the current EMA"""
+        self.count += 1
+        if self.value is not None:
+            self.value = price * self.alpha + self.value * (1 - self.alpha)
+        elif not self.sma_seed:
+            self.value = float(price)
+        else:
+            self.seed_sum += price
+            if self.count == self.period:
+                self.value = self.seed_sum / self.period
+        return self.value
+
+
+class EMABank:
+    """Set of EMAs advanced together, one multiply-add per period per price"""
+
+    def __init__(self, periods, sma_seed=True):
+        self.emas = {period: StreamingEMA(period, sma_seed) for period in sorted(set(periods))}
+
+    def update(self, price: float):
+        for ema in self.emas.values():
+            ema.update(price)
+
+    def __contains__(self, period):
+        return period in self.emas
+
+    def get(self, period) -> Optional[float]:
+        ema = self.emas.get(period)
+        return ema.value if ema is not None else None
+
+    def values(self):
+        return {period: ema.value for period, ema in self.emas.items()}
+
+
+class StreamingMACD:
+    """MACD line, signal EMA and histogram advanced once per price"""
+
+    def __init__(self, fast=12, slow=26, signal=9, sma_seed=True):
+        self.fast_ema = StreamingEMA(fast, sma_seed)
+        self.slow_ema = StreamingEMA(slow, sma_seed)
+        self.signal_ema = StreamingEMA(signal, sma_seed)
+        self.macd_line = None
+        self.signal_line = None
+        self.histogram = None
+
+    def update(self, price: float):
+        """Feed the next price and return (macd_line, signal_line, histogram)"""
+        fast = self.fast_ema.update(price)
+        slow = self.slow_ema.update(price)
+        if fast is not None and slow is not None:
+            self.macd_line = fast - slow
+            self.signal_line = self.signal_ema.update(self.macd_line)
+            if self.signal_line is not None:
+                self.histogram = self.macd_line - self.signal_line
+        return self.macd_line, self.signal_line, self.histogram
+
+
+class RollingWindowStats:
+    """Running mean and variance over several trailing windows of one price buffer
+
+    Each window keeps a Welford-style mean and sum of squared deviations that
+    is adjusted in O(1) as a price enters and the oldest one leaves.
+    """
+
+    resync_interval = 1000  # updates between exact recomputes to shed float drift
+
+    def __init__(self, windows=(20,)):
+        self.windows = tuple(sorted(set(windows)))
+        self.buffer = deque(maxlen=max(self.windows))
+        self.means = {window: 0.0 for window in self.windows}
+        self.m2 = {window: 0.0 for window in self.windows}
+        self.updates = 0
+
+    def update(self, price: float):
+        """Feed the next price into every window"""
+        size = len(self.buffer)
+        for window in self.windows:
+            mean = self.means[window]
+            if size < window:
+                delta = price - mean
+                mean += delta / (size + 1)
+                self.m2[window] += delta * (price - mean)
+            else:
+                oldest = self.buffer[-window]
+                new_mean = mean + (price - oldest) / window
+                self.m2[window] += (price - oldest) * (price - new_mean + oldest - mean)
+                mean = new_mean
+            self.means[window] = mean
+        self.buffer.append(price)
+
+        self.updates += 1
+        if self.updates % self.resync_interval == 0:
+            self.resync()
+
+    def resync(self):
+        """Recompute every window exactly from the buffer"""
+        prices = list(self.buffer)
+        for window in self.windows:
+            recent = prices[-window:]
+            mean = sum(recent) / len(recent) if recent else 0.0
+            self.means[window] = mean
+            self.m2[window] = sum((x - mean) ** 2 for x in recent)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def mean(self, window) -> Optional[float]:
+        if len(self.buffer) < window:
+            return None
+        if window in self.means:
+            return self.means[window]
+        return sum(list(self.buffer)[-window:]) / window
+
+    def variance(self, window) -> Optional[float]:
+        """Population variance of the last `window` prices"""
+        if len(self.buffer) < window:
+            return None
+        if window in self.m2:
+            return max(self.m2[window] / window, 0.0)
+        recent = list(self.buffer)[-window:]
+        mean = sum(recent) / window
+        return sum((x - mean) ** 2 for x in recent) / window
+
+    def std(self, window) -> Optional[float]:
+        variance = self.variance(window)
+        return math.sqrt(variance) if variance is not None else None
+
+    def bollinger_bands(self, window=20, num_std=2):
+        """Return (upper, middle, lower) for the trailing window"""
+        middle = self.mean(window)
+        if middle is None:
+            return None, None, None
+        band = self.std(window) * num_std
+        return middle + band, middle, middle - band
+
+
+class RollingExtremum:
+    """Trailing-window max and min kept in monotonic deques (amortized O(1) per update)"""
+
+    def __init__(self, window):
+        self.window = window
+        self.count = 0
+        self.maxima = deque()  # (index, value), values decreasing
+        self.minima = deque()  # (index, value), values increasing
+
+    def update(self, value: float):
+        index = self.count
+        self.count += 1
+
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((index, value))
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((index, value))
+
+        oldest = index - self.window
+        if self.maxima[0][0] <= oldest:
+            self.maxima.popleft()
+        if self.minima[0][0] <= oldest:
+            self.minima.popleft()
+
+    @property
+    def max(self) -> Optional[float]:
+        return self.maxima[0][1] if self.maxima else None
+
+    @property
+    def min(self) -> Optional[float]:
+        return self.minima[0][1] if self.minima else None
+
+
+class StreamingATR:
+    """Average True Range advanced once per OHLC bar
+
+    Only the previous close and the smoothed range are carried between bars.
+    `method` is 'wilder' (seeded with the mean of the first `period` true
+    ranges) or 'simple' (plain mean of the last `period` true ranges).
+    """
+
+    def __init__(self, period=14, method='wilder'):
+        if method not in ('wilder', 'simple'):
+            raise ValueError(f"Unknown ATR method: {method}")
+        self.period = period
+        self.method = method
+        self.prev_close = None
+        self.count = 0  # true ranges seen so far
+        self.ranges = deque(maxlen=period)
+        self.range_sum = 0.0
+        self.value = None
+
+    def update(self, high: float, low: float, close: float) -> Optional[float]:
+        """Feed the next bar and return the current ATR"""
+        if self.prev_close is None:
+            self.prev_close = close
+            return None
+
+        true_range = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.prev_close = close
+        self.count += 1
+
+        if self.method == 'simple' or self.value is None:
+            if len(self.ranges) == self.period:
+                self.range_sum -= self.ranges[0]
+            self.ranges.append(true_range)
+            self.range_sum += true_range
+            if self.count >= self.period:
+                self.value = self.range_sum / self.period
+        else:
+            self.value = (self.value * (self.period - 1) + true_range) / self.period
+
+        return self.value
+
+
+class IndicatorCache:
+    """Memoizes indicator results keyed by (history version, indicator, params)"""
+
+    def __init__(self):
+        self.version = 0
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        """Start a new history version - called whenever a price is appended"""
+        self.version += 1
+        self.entries.clear()
+
+    def get(self, name, params, compute):
+        key = (self.version, name, params)
+        if key in self.entries:
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        value = compute()
+        self.entries[key] = value
+        return value
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total * 100 if total else 0.0
+
+    def stats(self) -> str:
+        return f"Cache hits: {self.hits} | Misses: {self.misses} | Hit rate: {self.hit_rate:.1f}%"
+
+
+def memoized_indicator(method):
+    """Cache a BitcoinPredictor indicator method in `self.indicator_cache`
+
+    Arguments are normalised against the signature, so calculate_rsi() and
+    calculate_rsi(14) share one entry.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        params = tuple(bound.arguments.values())[1:]
+        return self.indicator_cache.get(method.__name__, params, lambda: method(self, *args, **kwargs))
+
+    return wrapper
+
+
+def recursive_filter(values, alpha, initial):
+    """Evaluate y[t] = (1 - alpha) * y[t-1] + alpha * x[t] along the last axis
+
+    `values` may be 1-D or 2-D (one row per alpha). The recursion is solved
+    in closed form block by block, so the only Python loop is over blocks
+    whose length keeps the decay powers well inside float64 range.
+    """
+    x = np.asarray(values, dtype=float)
+    squeeze = x.ndim == 1
+    x = np.atleast_2d(x)
+    rows, n = x.shape
+    alpha = np.broadcast_to(np.asarray(alpha, dtype=float).reshape(-1), (rows,))
+    prev = np.broadcast_to(np.asarray(initial, dtype=float).reshape(-1), (rows,)).copy()
+
+    y = np.empty_like(x)
+    decay = 1.0 - alpha
+    passthrough = decay <= 0  # alpha == 1: the output is the input
+    decay = np.where(passthrough, 1.0, decay)
+
+    # Longest block for which decay ** block stays above 1e-10
+    block = int(np.log(1e-10) / np.log(decay.min())) if decay.min() < 1 else n
+    block = max(1, min(block, 4096))
+
+    for start in range(0, n, block):
+        chunk = x[:, start:start + block]
+        powers = decay[:, None] ** np.arange(1, chunk.shape[1] + 1)
+        acc = np.cumsum(chunk / powers, axis=1) * alpha[:, None]
+        out = powers * (prev[:, None] + acc)
+        y[:, start:start + chunk.shape[1]] = out
+        if out.shape[1]:
+            prev = out[:, -1]
+
+    y[passthrough] = x[passthrough]
+    return y[0] if squeeze else y
+
+
+def rsi_series(prices, period=14):
+    """Full Wilder RSI series for a price array
+
+    Returns an array aligned with `prices` (NaN until `period` changes are
+    available). Passing a sequence of periods returns a 2-D array with one
+    row per period.
+    """
+    prices = np.asarray(prices, dtype=float)
+    periods = np.atleast_1d(period).astype(int)
+    n = len(prices)
+    result = np.full((len(periods), n), np.nan)
+
+    deltas = np.diff(prices)
+    gains = np.clip(deltas, 0, None)
+    losses = np.clip(-deltas, 0, None)
+
+    active = [i for i, p in enumerate(periods) if n >= p + 1]
+    if active:
+        # Align every period so its seed sits in column 0, then smooth all rows at once
+        width = n - int(periods[active].min())
+        gain_rows = np.zeros((len(active), width))
+        loss_rows = np.zeros((len(active), width))
+        seed_gain = np.empty(len(active))
+        seed_loss = np.empty(len(active))
+        for row, i in enumerate(active):
+            p = periods[i]
+            seed_gain[row] = gains[:p].mean()
+            seed_loss[row] = losses[:p].mean()
+            gain_rows[row, 1:n - p] = gains[p:]
+            loss_rows[row, 1:n - p] = losses[p:]
+
+        alpha = 1.0 / periods[active]
+        avg_gain = recursive_filter(gain_rows[:, 1:], alpha, seed_gain)
+        avg_loss = recursive_filter(loss_rows[:, 1:], alpha, seed_loss)
+        avg_gain = np.hstack([seed_gain[:, None], avg_gain])
+        avg_loss = np.hstack([seed_loss[:, None], avg_loss])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = np.where(avg_loss == 0, 100.0, 100 - 100 / (1 + avg_gain / avg_loss))
+
+        for row, i in enumerate(active):
+            p = periods[i]
+            result[i, p:] = rsi[row, :n - p]
+
+    return result[0] if np.ndim(period) == 0 else result
+
+
+def ema_series(prices, period, sma_seed=True):
+    """Full EMA series for a price array
+
+    With `sma_seed` the first value is the simple average of the first
+    `period` prices (NaN before it); otherwise the EMA starts at prices[0].
+    Passing a sequence of periods returns a (periods x n) matrix computed
+    in one vectorized pass.
+    """
+    prices = np.asarray(prices, dtype=float)
+    periods = np.atleast_1d(period).astype(int)
+    n = len(prices)
+    alphas = 2.0 / (periods + 1)
+    result = np.full((len(periods), n), np.nan)
+
+    if not sma_seed:
+        if n:
+            result[:, 0] = prices[0]
+            rows = np.broadcast_to(prices[1:], (len(periods), n - 1))
+            result[:, 1:] = recursive_filter(rows, alphas, prices[0])
+    else:
+        active = [i for i, p in enumerate(periods) if n >= p]
+        if active:
+            # Align every period so its SMA seed sits just before column 0
+            width = n - int(periods[active].min())
+            rows = np.zeros((len(active), width))
+            seeds = np.empty(len(active))
+            for row, i in enumerate(active):
+                p = periods[i]
+                seeds[row] = prices[:p].mean()
+                rows[row, :n - p] = prices[p:]
+
+            smoothed = recursive_filter(rows, alphas[active], seeds)
+            for row, i in enumerate(active):
+                p = periods[i]
+                result[i, p - 1] = seeds[row]
+                result[i, p:] = smoothed[row, :n - p]
+
+    return result[0] if np.ndim(period) == 0 else result
+
+
+def macd_series(prices, fast=12, slow=26, signal=9, sma_seed=True):
+    """Fast EMA, slow EMA, MACD line, signal EMA and histogram as full arrays"""
+    prices = np.asarray(prices, dtype=float)
+    ema_fast = ema_series(prices, fast, sma_seed)
+    ema_slow = ema_series(prices, slow, sma_seed)
+    macd_line = ema_fast - ema_slow
+
+    # The signal EMA runs over the MACD line from its first defined value
+    signal_line = np.full(len(prices), np.nan)
+    start = slow - 1 if sma_seed else 0
+    if len(prices) > start:
+        signal_line[start:] = ema_series(macd_line[start:], signal, sma_seed)
+
+    return {
+        'ema_fast': ema_fast,
+        'ema_slow': ema_slow,
+        'macd': macd_line,
+        'signal': signal_line,
+        'histogram': macd_line - signal_line
+    }
+
+
+def rolling_mean_std(prices, window):
+    """Rolling mean and population standard deviation as full series
+
+    Window sums come from cumulative sums taken over blocks of two windows,
+    each shifted by a local reference price, so the variance never subtracts
+    two large sums of squared prices. NaN until `window` prices are available.
+    """
+    prices = np.asarray(prices, dtype=float)
+    n = len(prices)
+    mean = np.full(n, np.nan)
+    std = np.full(n, np.nan)
+    if n < window:
+        return mean, std
+
+    blocks = -(-n // window)
+    padded = np.zeros((blocks + 1) * window)
+    padded[window:window + n] = prices
+    # Row k holds block k-1 followed by block k, centred on block k's first price
+    rows = np.lib.stride_tricks.sliding_window_view(padded, 2 * window)[::window][:blocks]
+    reference = prices[::window][:blocks, None]
+    deviations = rows - reference
+    deviations[0, :window] = 0.0
+
+    zeros = np.zeros((blocks, 1))
+    sums = np.hstack([zeros, np.cumsum(deviations, axis=1)])
+    squares = np.hstack([zeros, np.cumsum(deviations ** 2, axis=1)])
+    ends = np.arange(window + 1, 2 * window + 1)
+    window_sum = (sums[:, ends] - sums[:, ends - window]).ravel()[:n]
+    window_squares = (squares[:, ends] - squares[:, ends - window]).ravel()[:n]
+
+    offset = (window_sum / window)[window - 1:]
+    variance = np.maximum(window_squares[window - 1:] / window - offset ** 2, 0.0)
+    mean[window - 1:] = np.repeat(reference[:, 0], window)[:n][window - 1:] + offset
+    std[window - 1:] = np.sqrt(variance)
+    return mean, std
+
+
+def sma_series(prices, window):
+    """Simple moving average as a full series"""
+    return rolling_mean_std(prices, window)[0]
+
+
+def bollinger_series(prices, window=20, num_std=2):
+    """Upper, middle and lower Bollinger Band series"""
+    middle, std = rolling_mean_std(prices, window)
+    return middle + std * num_std, middle, middle - std * num_std
+
+
+def _rolling_extremum(values, window, combine, fill):
+    """Van Herk/Gil-Werman sliding extremum: block prefix/suffix scans, O(n)"""
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    result = np.full(n, np.nan)
+    if n < window or window < 1:
+        return result
+
+    blocks = -(-n // window)
+    padded = np.full(blocks * window, fill)
+    padded[:n] = values
+    grid = padded.reshape(blocks, window)
+    prefix = combine.accumulate(grid, axis=1).ravel()
+    suffix = combine.accumulate(grid[:, ::-1], axis=1)[:, ::-1].ravel()
+
+    # A window spans at most two blocks: the tail of one and the head of the next
+    ends = np.arange(window - 1, n)
+    result[window - 1:] = combine(suffix[ends - window + 1], prefix[ends])
+    return result
+
+
+def rolling_max(values, window):
+    """Trailing-window maximum as a full series (NaN until `window` values)"""
+    return _rolling_extremum(values, window, np.maximum, -np.inf)
+
+
+def rolling_min(values, window):
+    """Trailing-window minimum as a full series (NaN until `window` values)"""
+    return _rolling_extremum(values, window, np.minimum, np.inf)
+
+
+def donchian_series(high_prices, low_prices, window=20):
+    """Upper, middle and lower Donchian Channel series"""
+    upper = rolling_max(high_prices, window)
+    lower = rolling_min(low_prices, window)
+    return upper, (upper + lower) / 2, lower
+
+
+def williams_r_series(high_prices, low_prices, close_prices, window=14):
+    """Williams %R series (-100..0); -50 where the range is flat"""
+    highest = rolling_max(high_prices, window)
+    lowest = rolling_min(low_prices, window)
+    span = highest - lowest
+    with np.errstate(divide='ignore', invalid='ignore'):
+        williams_r = (highest - np.asarray(close_prices, dtype=float)) / span * -100
+    return np.where(span == 0, -50.0, williams_r)
+
+
+def stochastic_rsi_series(rsi_values, window=14):
+    """Stochastic RSI series (0..100); 50 where the RSI range is flat"""
+    rsi_values = np.asarray(rsi_values, dtype=float)
+    highest = rolling_max(rsi_values, window)
+    lowest = rolling_min(rsi_values, window)
+    span = highest - lowest
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stoch_rsi = (rsi_values - lowest) / span * 100
+    return np.where(span == 0, 50.0, stoch_rsi)
+
+
+def ichimoku_series(high_prices, low_prices, tenkan=9, kijun=26, senkou=52):
+    """Tenkan-sen, Kijun-sen, Senkou Span A and Span B series (unshifted)"""
+    def midpoint(window):
+        return (rolling_max(high_prices, window) + rolling_min(low_prices, window)) / 2
+
+    tenkan_sen = midpoint(tenkan)
+    kijun_sen = midpoint(kijun)
+    return {
+        'tenkan_sen': tenkan_sen,
+        'kijun_sen': kijun_sen,
+        'senkou_span_a': (tenkan_sen + kijun_sen) / 2,
+        'senkou_span_b': midpoint(senkou)
+    }
+
+
+def true_range_series(high_prices, low_prices, close_prices):
+    """True range per bar (NaN for the first bar, which has no previous close)"""
+    high = np.asarray(high_prices, dtype=float)
+    low = np.asarray(low_prices, dtype=float)
+    prev_close = np.asarray(close_prices, dtype=float)[:-1]
+    true_range = np.full(len(high), np.nan)
+    true_range[1:] = np.maximum.reduce([
+        high[1:] - low[1:],
+        np.abs(high[1:] - prev_close),
+        np.abs(low[1:] - prev_close)
+    ])
+    return true_range
+
+
+def atr_series(high_prices, low_prices, close_prices, period=14, method='wilder'):
+    """Full ATR series, matching StreamingATR bar for bar (NaN until `period` true ranges)"""
+    if method not in ('wilder', 'simple'):
+        raise ValueError(f"Unknown ATR method: {method}")
+    true_range = true_range_series(high_prices, low_prices, close_prices)
+    n = len(true_range)
+    atr = np.full(n, np.nan)
+    if n < period + 1:
+        return atr
+
+    if method == 'simple':
+        atr[1:] = sma_series(true_range[1:], period)
+    else:
+        seed = true_range[1:period + 1].mean()
+        atr[period] = seed
+        atr[period + 1:] = recursive_filter(true_range[period + 1:], 1.0 / period, seed)
+    return atr
+
+
+def atr_target_series(high_prices, low_prices, close_prices, period=14, method='simple',
+                      target_multiple=1.0, stop_multiple=0.8):
+    """Take-profit and stop-loss levels at every bar, for backtesting ATR targets
+
+    Uses the same rule as the live predictor: close + target_multiple * ATR
+    and close - stop_multiple * ATR. NaN until the ATR is defined.
+    """
+    close = np.asarray(close_prices, dtype=float)
+    atr = atr_series(high_prices, low_prices, close, period, method)
+    return close + atr * target_multiple, close - atr * stop_multiple
+
+
+def scan_candlestick_patterns(open_prices, high_prices, low_prices, close_prices):
+    """Find every candlestick pattern occurrence across whole OHLC arrays
+
+    Returns {pattern name: array of bar indices}, where the index is the bar
+    that completes the pattern. Each pattern is one boolean mask over the
+    full history, so the scan is a handful of vectorized comparisons.
+    """
+    o = np.asarray(open_prices, dtype=float)
+    h = np.asarray(high_prices, dtype=float)
+    l = np.asarray(low_prices, dtype=float)
+    c = np.asarray(close_prices, dtype=float)
+    n = len(c)
+
+    body = np.abs(c - o)
+    candle_range = h - l
+    bullish = c > o
+    bearish = c < o
+
+    def shifted(values, bars, fill=np.nan):
+        """values[i - bars] aligned to index i"""
+        out = np.full(n, fill, dtype=np.asarray(values).dtype)
+        if bars < n:
+            out[bars:] = values[:n - bars]
+        return out
+
+    o1, c1, body1 = shifted(o, 1), shifted(c, 1), shifted(body, 1)
+    o2, c2, body2 = shifted(o, 2), shifted(c, 2), shifted(body, 2)
+    bullish1, bearish1 = shifted(bullish, 1, False), shifted(bearish, 1, False)
+    bullish2, bearish2 = shifted(bullish, 2, False), shifted(bearish, 2, False)
+
+    hammer_shape = (np.minimum(o, c) > (h + l) / 2) & (candle_range > 3 * body)
+    star_body = body1 <= 0.3 * body2
+
+    masks = {
+        'Bullish Engulfing': bullish & (o < c1) & (c > o1) & ((c - o) > (o1 - c1)),
+        'Bearish Engulfing': bearish & (o > c1) & (c < o1) & ((o - c) > (c1 - o1)),
+        'Hammer': hammer_shape & bullish,
+        'Hanging Man': hammer_shape & ~bullish,
+        'Doji': (candle_range > 0) & (body <= 0.1 * candle_range),
+        'Morning Star': bearish2 & star_body & bullish & (c > (o2 + c2) / 2),
+        'Evening Star': bullish2 & star_body & bearish & (c < (o2 + c2) / 2),
+        'Three White Soldiers': (bullish2 & bullish1 & bullish & (c1 > c2) & (c > c1) &
+                                 (o1 > o2) & (o1 < c2) & (o > o1) & (o < c1)),
+        'Three Black Crows': (bearish2 & bearish1 & bearish & (c1 < c2) & (c < c1) &
+                              (o1 < o2) & (o1 > c2) & (o < o1) & (o > c1)),
+    }
+    return {name: np.flatnonzero(mask) for name, mask in masks.items()}
@@ -0,0 +1,1236 @@
+import argparse
+import base64
+import email.utils
+import gzip
+import hashlib
+import http.client
+import json
+import logging
+import os
+import random
+import socket
+import ssl
+import struct
+import threading
+import time
+import urllib.error
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
+
+class Clock:
+    """Time source for the data loops: the wall clock live, a virtual clock during a replay
+
+    A replay starts the clock at the first journaled response, and only
+    `sleep` moves it forward, so the loop that sleeps drives time and every
+    run sees the same sequence. `speed` divides the real wait (1 plays back
+    as recorded, 100 a hundred times faster); None does not wait at all.
+    """
+
+    def __init__(self):
+        self.now = None  # virtual epoch seconds while replaying, None when live
+        self.end = None
+        self.speed = None
+        self.lock = threading.Lock()
+
+    @property
+    def replaying(self) -> bool:
+        return self.now is not None
+
+    @property
+    def finished(self) -> bool:
+        """True once a replay has moved past the last journaled entry"""
+        return self.now is not None and self.now > self.end
+
+    def time(self) -> float:
+        return time.time() if self.now is None else self.now
+
+    def monotonic(self) -> float:
+        return time.monotonic() if self.now is None else self.now
+
+    def sleep(self, seconds):
+        if self.now is None:
+            time.sleep(seconds)
+            return
+        if self.speed:
+            time.sleep(seconds / self.speed)
+        with self.lock:
+            self.now += seconds
+
+    def start_replay(self, start, end, speed=None):
+        self.now, self.end, self.speed = start, end, speed
+
+
+# Shared by the data loops, the caches and the replayed providers
+clock = Clock()
+
+
+class _Flight:
+    """One in-progress fetch that concurrent callers for the same key wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """Time-bounded response cache that coalesces concurrent misses into one fetch
+
+    Entries are keyed by endpoint and parameters. While a key is being
+    fetched, other callers wait for that same result instead of issuing
+    their own request. With `stale_while_refresh` an expired entry is
+    returned at once while a single background refresh replaces it, but
+    only until it is `max_stale` seconds old; after that callers wait for a
+    fresh fetch and see its error if it fails. A ttl of 0 only coalesces
+    requests that are in flight together and stores nothing.
+    """
+
+    def __init__(self, ttl=30.0, stale_while_refresh=False, max_stale=300.0, max_entries=256):
+        self.ttl = ttl
+        self.stale_while_refresh = stale_while_refresh
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self.entries = {}  # key -> (value, stored at)
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stale_hits = 0
+
+    def get(self, key, fetch, ttl=None):
+        """Cached value for `key`, calling `fetch()` at most once across concurrent callers"""
+        ttl = self.ttl if ttl is None else ttl
+        store = ttl > 0
+        with self.lock:
+            entry = self.entries.get(key)
+            age = clock.monotonic() - entry[1] if entry is not None else None
+            if entry is not None and age < ttl:
+                self.hits += 1
+                return entry[0]
+
+            flight = self.flights.get(key)
+            if entry is not None and self.stale_while_refresh and age < self.max_stale:
+                self.stale_hits += 1
+                if flight is None:
+                    self.misses += 1
+                    self.flights[key] = _Flight()
+                    threading.Thread(target=self._refresh, args=(key, fetch, store), daemon=True).start()
+                return entry[0]
+
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self.flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if leader:
+            return self._run(key, fetch, store)
+        flight.event.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _run(self, key, fetch, store=True):
+        flight = self.flights[key]
+        try:
+            flight.value = fetch()
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+                if store and flight.error is None and flight.value is not None:
+                    self.entries[key] = (flight.value, clock.monotonic())
+                    if len(self.entries) > self.max_entries:
+                        oldest = min(self.entries, key=lambda k: self.entries[k][1])
+                        del self.entries[oldest]
+            flight.event.set()
+
+    def _refresh(self, key, fetch, store):
+        try:
+            self._run(key, fetch, store)
+        except Exception as e:
+            logging.warning(f"Background refresh failed for {key}: {e}")
+
+    def stats(self) -> str:
+        return (f"Hits: {self.hits} | Stale: {self.stale_hits} | Coalesced: {self.coalesced} | "
+                f"Upstream: {self.misses}")
+
+
+class RateLimited(urllib.error.URLError):
+    """Raised instead of sending a request to a provider that is out of budget"""
+
+
+class TokenBucket:
+    """Requests allowed at `rate` per second with bursts up to `capacity`
+
+    A Retry-After pause empties the bucket until the provider says to
+    come back. Nothing here sleeps: callers ask and get a yes or no.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> bool:
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self) -> bool:
+        if not self.available():
+            return False
+        self.tokens -= 1
+        return True
+
+    def pause(self, seconds):
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until the next request would be allowed"""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+# Published public-API limits, kept a little under the documented ceiling:
+# name -> (host, requests per second, burst)
+PROVIDER_LIMITS = {
+    'CoinGecko': ('api.coingecko.com', 25 / 60, 5),  # ~30 calls/min on the public plan
+    'Binance': ('api.binance.com', 10.0, 20),  # 6000 request weight/min, price tickers weigh 1-2
+    'Bybit': ('api.bybit.com', 10.0, 20),  # 120 requests per 5 s per IP
+    'CryptoCompare': ('min-api.cryptocompare.com', 20.0, 40),  # 50/s, 2000/min free tier
+}
+
+
+class RequestScheduler:
+    """Token bucket per upstream provider, consulted before every request
+
+    Requests to a host without budget fail fast with RateLimited instead of
+    waiting, so the engine thread never blocks on a limit. A 429/418/503
+    answer pauses the provider for its Retry-After (or `default_pause`).
+    `has_budget(name)` lets source selection skip throttled providers and
+    move the tick to the ones that can still be asked.
+    """
+
+    def __init__(self, limits=PROVIDER_LIMITS, default_pause=60.0):
+        self.default_pause = default_pause
+        self.buckets = {name: TokenBucket(rate, burst) for name, (host, rate, burst) in limits.items()}
+        self.hosts = {host: name for name, (host, rate, burst) in limits.items()}
+        self.rejected = {name: 0 for name in self.buckets}
+        self.lock = threading.Lock()
+
+    def provider(self, host) -> Optional[str]:
+        return self.hosts.get(host)
+
+    def has_budget(self, name) -> bool:
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            return True
+        with self.lock:
+            return bucket.available()
+
+    def acquire(self, name) -> bool:
+        """Take one request from `name`'s budget; providers without a limit always pass"""
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            return True
+        with self.lock:
+            if bucket.take():
+                return True
+            self.rejected[name] += 1
+            return False
+
+    def throttle(self, name, retry_after=None):
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            return
+        seconds = self.default_pause if retry_after is None else retry_after
+        with self.lock:
+            bucket.pause(seconds)
+        logging.warning(f"{name} rate limited - pausing it for {seconds:.0f}s")
+
+    def wait_time(self, name) -> float:
+        """Seconds until `name` can take another request (0 for providers without a limit)"""
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            return 0.0
+        with self.lock:
+            return bucket.wait_time()
+
+    @staticmethod
+    def parse_retry_after(value) -> Optional[float]:
+        """Retry-After as seconds, from either delta-seconds or an HTTP date"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def with_budget(self, sources):
+        """(name, function) pairs whose provider can take a request now"""
+        return [source for source in sources if self.has_budget(source[0])]
+
+    def summary(self) -> str:
+        """Providers that are waiting for budget or have had requests deferred"""
+        with self.lock:
+            parts = []
+            for name, bucket in self.buckets.items():
+                wait = bucket.wait_time()
+                if wait > 0 or self.rejected[name]:
+                    parts.append(f"{name}: {'wait ' + format(wait, '.0f') + 's' if wait > 0 else 'ok'}, "
+                                 f"{self.rejected[name]} deferred")
+            return " | ".join(parts)
+
+
+# Shared by every provider call in the process
+request_scheduler = RequestScheduler()
+
+
+class PooledHTTPClient:
+    """Keep-alive HTTP(S) connections pooled per host, with gzip/deflate transfers
+
+    Each (scheme, host, port) keeps up to `max_per_host` connections; callers
+    beyond that wait for one to be released. Failures surface as
+    urllib.error.HTTPError / URLError so existing provider error handling
+    keeps working unchanged.
+    """
+
+    def __init__(self, max_per_host=4, compress=True, scheduler=None):
+        self.max_per_host = max_per_host
+        self.compress = compress
+        self.scheduler = scheduler  # optional RequestScheduler checked before each request
+        self.idle = {}  # (scheme, host, port) -> idle connections
+        self.slots = {}  # (scheme, host, port) -> semaphore bounding open connections
+        self.lock = threading.Lock()
+        self.connections_opened = 0
+        self.requests_sent = 0
+        # Identical GETs in flight together share one request; a ttl also caches the JSON
+        self.response_cache = TTLCache(ttl=0)
+
+    def _slot(self, key):
+        with self.lock:
+            if key not in self.slots:
+                self.slots[key] = threading.BoundedSemaphore(self.max_per_host)
+                self.idle[key] = []
+            return self.slots[key]
+
+    def _connect(self, key, timeout):
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        with self.lock:
+            self.connections_opened += 1
+        return connection_class(host, port, timeout=timeout)
+
+    def _checkout(self, key, timeout):
+        with self.lock:
+            idle = self.idle[key]
+            connection = idle.pop() if idle else None
+        if connection is None:
+            return self._connect(key, timeout), False
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        connection.timeout = timeout
+        return connection, True
+
+    def _release(self, key, connection, reusable):
+        if reusable:
+            with self.lock:
+                self.idle[key].append(connection)
+        else:
+            connection.close()
+
+    @staticmethod
+    def _decode(body: bytes, encoding: str) -> bytes:
+        encoding = encoding.lower()
+        if encoding == 'gzip':
+            return gzip.decompress(body)
+        if encoding == 'deflate':
+            try:
+                return zlib.decompress(body)
+            except zlib.error:
+                return zlib.decompress(body, -zlib.MAX_WBITS)  # raw deflate stream
+        return body
+
+    def request(self, url, headers=None, timeout=10, method='GET'):
+        """Send one request and return (status, response headers, decoded body)
+
+        While a journal is recording, every response and connection error is
+        written to it; while one is replaying, nothing goes on the wire.
+        """
+        if journal is not None and journal.replaying:
+            return journal.response(url, clock.time())
+        started = clock.time()
+        try:
+            status, response_headers, body = self._send(url, headers, timeout, method)
+        except RateLimited:
+            raise  # a local budget decision, not a provider answer
+        except urllib.error.URLError as e:
+            if journal is not None and journal.recording:
+                journal.record_response(url, started, error=e.reason)
+            raise
+        if journal is not None and journal.recording:
+            journal.record_response(url, started, status, response_headers, body)
+        return status, response_headers, body
+
+    def _send(self, url, headers, timeout, method):
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'http'
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        request_headers = {'Connection': 'keep-alive'}
+        if self.compress:
+            request_headers['Accept-Encoding'] = 'gzip, deflate'
+        request_headers.update(headers or {})
+
+        provider = self.scheduler.provider(parts.hostname) if self.scheduler is not None else None
+        if provider is not None and not self.scheduler.acquire(provider):
+            raise RateLimited(f"{provider} request budget exhausted")
+
+        slot = self._slot(key)
+        if not slot.acquire(timeout=timeout):
+            raise urllib.error.URLError(f"connection pool for {parts.hostname} exhausted")
+        try:
+            for attempt in range(2):
+                connection, reused = self._checkout(key, timeout)
+                try:
+                    connection.request(method, path, headers=request_headers)
+                    response = connection.getresponse()
+                    body = response.read()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                    connection.close()
+                    if reused and attempt == 0:
+                        continue  # the server dropped an idle keep-alive connection; retry on a fresh one
+                    raise urllib.error.URLError(e)
+                except (OSError, http.client.HTTPException) as e:
+                    connection.close()
+                    raise urllib.error.URLError(e)
+
+                with self.lock:
+                    self.requests_sent += 1
+                retry_after = RequestScheduler.parse_retry_after(response.getheader('Retry-After'))
+                if provider is not None and (response.status in (418, 429) or
+                                             (response.status == 503 and retry_after is not None)):
+                    self.scheduler.throttle(provider, retry_after)
+                self._release(key, connection, not response.will_close)
+                body = self._decode(body, response.getheader('Content-Encoding', ''))
+                return response.status, response.headers, body
+        finally:
+            slot.release()
+
+    def get(self, url, headers=None, timeout=10) -> bytes:
+        """GET a URL and return the body, raising HTTPError on a non-2xx status"""
+        status, response_headers, body = self.request(url, headers, timeout)
+        if not 200 <= status < 300:
+            raise urllib.error.HTTPError(url, status, http.client.responses.get(status, ''), response_headers, None)
+        return body
+
+    def get_json(self, url, headers=None, timeout=10, ttl=0):
+        """GET a URL and parse the body as JSON, reusing a response younger than `ttl` seconds"""
+        return self.response_cache.get(url, lambda: json.loads(self.get(url, headers, timeout).decode()), ttl)
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+                connections.clear()
+
+
+# Shared by every provider call in the process
+http_client = PooledHTTPClient(scheduler=request_scheduler)
+
+
+class ResponseJournal:
+    """Raw provider traffic as JSON lines, written while recording and served back during a replay
+
+    Recording writes one line per HTTP response (status, headers and the
+    decoded body, or the connection error) stamped with the clock time the
+    request started, and one line per stream message or REST poll stamped
+    with its arrival time. A replay serves each URL's responses in recorded
+    order as the clock passes them, skipping those it no longer asks for.
+    """
+
+    SKIPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'connection')
+
+    def __init__(self, path, mode='replay'):
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.responses = {}  # url -> HTTP entries, oldest first
+        self.stream = {}  # url -> stream message and poll entries, oldest first
+        self.cursors = {}  # (kind, url) -> index of the next entry to serve
+        self.start = self.end = None
+        self.file = None
+        if mode == 'record':
+            self.file = open(path, 'w', encoding='utf-8')
+        else:
+            self._load()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == 'record'
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == 'replay'
+
+    def _write(self, entry):
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def record_response(self, url, started, status=None, headers=None, body=None, error=None):
+        entry = {'t': started, 'kind': 'http', 'url': url}
+        if error is not None:
+            entry['error'] = str(error)
+        else:
+            entry['status'] = status
+            entry['headers'] = [(name, value) for name, value in headers.items()
+                                if name.lower() not in self.SKIPPED_HEADERS]
+            try:
+                entry['body'] = body.decode('utf-8')
+            except UnicodeDecodeError:
+                entry['body_b64'] = base64.b64encode(body).decode()
+        self._write(entry)
+
+    def record_stream(self, url, message=None):
+        """A stream message, or with no message a REST poll made while the stream was down"""
+        if message is None:
+            self._write({'t': clock.time(), 'kind': 'poll', 'url': url})
+        else:
+            self._write({'t': clock.time(), 'kind': 'ws', 'url': url, 'message': message})
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        if not entries:
+            raise ValueError(f"{self.path} has no recorded responses")
+        entries.sort(key=lambda entry: entry['t'])
+        for entry in entries:
+            target = self.responses if entry['kind'] == 'http' else self.stream
+            target.setdefault(entry['url'], []).append(entry)
+        self.start, self.end = entries[0]['t'], entries[-1]['t']
+
+    def response(self, url, now):
+        """(status, headers, body) of the newest recorded response for `url` that is due by `now`
+
+        A response recorded later than `now` is never served: before the first
+        one is due the request fails as it would have live, and a run that
+        asks more often than the recording gets the latest due response again.
+        """
+        entries = self.responses.get(url)
+        if not entries:
+            raise urllib.error.URLError(f"no recorded response for {url}")
+        with self.lock:
+            index = self.cursors.get(('http', url), 0)  # the oldest response not served yet
+            if entries[index]['t'] > now:
+                if index == 0:
+                    raise urllib.error.URLError(f"no response recorded yet for {url}")
+                index -= 1
+            else:
+                while index + 1 < len(entries) and entries[index + 1]['t'] <= now:
+                    index += 1  # the recording asked more often than this run does
+                self.cursors[('http', url)] = min(index + 1, len(entries) - 1)
+        entry = entries[index]
+        if 'error' in entry:
+            raise urllib.error.URLError(entry['error'])
+        headers = http.client.HTTPMessage()
+        for name, value in entry['headers']:
+            headers[name] = value
+        body = base64.b64decode(entry['body_b64']) if 'body_b64' in entry else entry['body'].encode('utf-8')
+        return entry['status'], headers, body
+
+    def stream_until(self, url, now) -> list:
+        """Stream entries for `url` recorded after the previous call and up to `now`"""
+        entries = self.stream.get(url, [])
+        with self.lock:
+            start = index = self.cursors.get(('stream', url), 0)
+            while index < len(entries) and entries[index]['t'] <= now:
+                index += 1
+            self.cursors[('stream', url)] = index
+        return entries[start:index]
+
+    def close(self):
+        if self.file is not None:
+            with self.lock:
+                self.file.close()
+                self.file = None
+
+
+# Set by start_recording / start_replay; None runs against the live providers only
+journal: Optional[ResponseJournal] = None
+
+REPLAY_SPEEDS = {'1': 1.0, '100': 100.0, 'max': None}
+
+
+def start_recording(path) -> ResponseJournal:
+    global journal
+    journal = ResponseJournal(path, mode='record')
+    return journal
+
+
+def start_replay(path, speed=None) -> ResponseJournal:
+    """Serve every provider call from the journal at `path` on the virtual clock"""
+    global journal
+    journal = ResponseJournal(path, mode='replay')
+    clock.start_replay(journal.start, journal.end, speed)
+    random.seed(0)  # the simulated fallbacks and prediction jitter draw from random
+    return journal
+
+
+def configure_record_replay(argv=None) -> Optional[str]:
+    """Apply --record PATH or --replay PATH [--speed 1|100|max] from the command line
+
+    Other arguments are ignored. Returns a line describing the mode for the
+    startup log, or None for a normal live session.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--record', metavar='PATH')
+    parser.add_argument('--replay', metavar='PATH')
+    parser.add_argument('--speed', default='1', choices=REPLAY_SPEEDS)
+    args, _ = parser.parse_known_args(argv)
+    if args.replay:
+        start_replay(args.replay, REPLAY_SPEEDS[args.speed])
+        return f"Replaying {args.replay} at {args.speed}{'x' if args.speed != 'max' else ' speed'}"
+    if args.record:
+        start_recording(args.record)
+        return f"Recording provider responses to {args.record}"
+    return None
+
+
+class SourceHealth:
+    """Latency/error averages and circuit-breaker state for one data source"""
+
+    def __init__(self):
+        self.latency = None  # EWMA of request time in seconds
+        self.error_rate = 0.0  # EWMA of failures, 0..1
+        self.failures = 0  # consecutive failures
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.probing = False
+
+
+class SourceHealthTracker:
+    """Ranks data sources by latency and error rate and trips a breaker on dead ones
+
+    A source opens after `failure_threshold` consecutive failures and is
+    skipped for `cooldown` seconds. After that a single half-open probe is
+    let through: success closes the breaker, failure reopens it. With a
+    RequestScheduler, a source whose provider is out of request budget is
+    also skipped until its bucket refills.
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=30.0, smoothing=0.3, scheduler=None):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self.scheduler = scheduler
+        self.sources = {}
+        self.lock = threading.Lock()
+
+    def _health(self, name) -> SourceHealth:
+        health = self.sources.get(name)
+        if health is None:
+            health = self.sources[name] = SourceHealth()
+        if health.state == 'open' and clock.monotonic() - health.opened_at >= self.cooldown:
+            health.state = 'half-open'
+            health.probing = False
+        return health
+
+    def is_available(self, name) -> bool:
+        if self.scheduler is not None and not self.scheduler.has_budget(name):
+            return False
+        with self.lock:
+            health = self._health(name)
+            return health.state == 'closed' or (health.state == 'half-open' and not health.probing)
+
+    def allow(self, name) -> bool:
+        """Like is_available, but claims the single probe of a half-open source"""
+        if self.scheduler is not None and not self.scheduler.has_budget(name):
+            return False
+        with self.lock:
+            health = self._health(name)
+            if health.state == 'closed':
+                return True
+            if health.state == 'half-open' and not health.probing:
+                health.probing = True
+                return True
+            return False
+
+    def record(self, name, latency, ok):
+        with self.lock:
+            health = self._health(name)
+            a = self.smoothing
+            health.latency = latency if health.latency is None else a * latency + (1 - a) * health.latency
+            health.error_rate = a * (0.0 if ok else 1.0) + (1 - a) * health.error_rate
+            health.probing = False
+
+            if ok:
+                if health.state != 'closed':
+                    logging.info(f"{name} circuit closed - source recovered")
+                health.state = 'closed'
+                health.failures = 0
+                return
+
+            health.failures += 1
+            if health.state == 'half-open' or health.failures >= self.failure_threshold:
+                if health.state != 'open':
+                    logging.warning(f"{name} circuit open after {health.failures} failures - "
+                                    f"skipping it for {self.cooldown:.0f}s")
+                health.state = 'open'
+                health.opened_at = clock.monotonic()
+
+    def call(self, name, fetch_function):
+        """Run one fetch, recording its latency and whether it returned a positive price
+
+        RateLimited is passed on unrecorded: the local request budget refused
+        the call, so it says nothing about the source. A half-open probe it
+        interrupted is handed back so the next call can probe instead.
+        """
+        start = time.perf_counter()
+        try:
+            result = fetch_function()
+        except RateLimited:
+            with self.lock:
+                self._health(name).probing = False
+            raise
+        except Exception:
+            self.record(name, time.perf_counter() - start, False)
+            raise
+        self.record(name, time.perf_counter() - start, result is not None and result > 0)
+        return result
+
+    def score(self, name) -> float:
+        """Expected cost of asking a source: latency inflated by its error rate (lower is better)"""
+        with self.lock:
+            health = self._health(name)
+            # Replayed requests take no real time, so only error rates order sources in a replay
+            latency = 1.0 if clock.replaying else (health.latency or 0.0)
+            return latency / max(1.0 - health.error_rate, 0.05)
+
+    def rank(self, sources):
+        """Available (name, function) pairs, fastest healthy source first"""
+        available = [source for source in sources if self.is_available(source[0])]
+        return sorted(available, key=lambda source: self.score(source[0]))
+
+    def summary(self) -> str:
+        with self.lock:
+            parts = []
+            for name, health in self.sources.items():
+                latency = f"{health.latency * 1000:.0f}ms" if health.latency is not None else "n/a"
+                parts.append(f"{name}: {health.state}, {latency}, {health.error_rate:.0%} err")
+        throttled = self.scheduler.summary() if self.scheduler is not None else ""
+        if throttled:
+            parts.append(throttled)
+        return " | ".join(parts)
+
+
+class PriceFanout:
+    """Queries every price source at once and settles on the first quorum that agrees
+
+    Sources are (name, function) pairs returning a price or None. A tick ends
+    as soon as `quorum` valid prices lie within `tolerance` of each other, or
+    when the latency budget runs out. Slower sources finish in the background
+    and their answers are dropped; a source still busy from an earlier tick
+    is skipped rather than queued again.
+    """
+
+    def __init__(self, quorum=2, budget=4.0, tolerance=0.005, max_workers=8, health=None):
+        self.quorum = quorum
+        self.budget = budget  # seconds per tick
+        self.tolerance = tolerance  # relative price spread that still counts as agreement
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="price-source")
+        self.in_flight = {}
+        self.latencies = {}  # source name -> seconds taken by its last request
+        self.last_prices = {}  # source name -> price used for the last combined price
+        self.health = health  # optional SourceHealthTracker that can veto sources
+        self.lock = threading.Lock()
+
+    def _timed_call(self, name, fetch_function):
+        start = time.perf_counter()
+        try:
+            if self.health is not None:
+                return self.health.call(name, fetch_function)
+            return fetch_function()
+        finally:
+            with self.lock:
+                self.latencies[name] = time.perf_counter() - start
+
+    def _agreeing(self, prices: Dict[str, float]) -> Dict[str, float]:
+        """Largest group of prices within `tolerance` of one another's anchor"""
+        best = {}
+        for anchor in prices.values():
+            group = {name: price for name, price in prices.items()
+                     if abs(price - anchor) <= anchor * self.tolerance}
+            if len(group) > len(best):
+                best = group
+        return best
+
+    def fetch(self, sources: Iterable[Tuple[str, Callable[[], Optional[float]]]],
+              validate: Optional[Callable[[float], bool]] = None) -> Optional[float]:
+        """Return the average of the agreeing prices, or None if no source answered"""
+        deadline = time.monotonic() + self.budget
+        pending = {}
+        for name, fetch_function in sources:
+            running = self.in_flight.get(name)
+            if running is not None and not running.done():
+                logging.warning(f"{name} is still answering the previous request - skipping it this tick")
+                continue
+            if self.health is not None and not self.health.allow(name):
+                continue  # circuit open
+            future = self.executor.submit(self._timed_call, name, fetch_function)
+            self.in_flight[name] = future
+            pending[future] = name
+
+        prices = {}
+        agreed = {}
+        # A replay waits for every source so the same answers settle each tick
+        while pending and (clock.replaying or len(agreed) < self.quorum):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    price = future.result()
+                except Exception as e:
+                    logging.warning(f"Failed to fetch from {name}: {e}")
+                    continue
+                if price and price > 0 and (validate is None or validate(price)):
+                    prices[name] = float(price)
+            if clock.replaying:
+                prices = dict(sorted(prices.items()))  # completion order varies between runs
+            agreed = self._agreeing(prices)
+
+        for future, name in pending.items():
+            future.cancel()
+            logging.info(f"{name} had not answered when the tick settled - ignoring its result")
+
+        # Without a quorum fall back to whatever answered, as the sequential loop did
+        used = agreed if len(agreed) >= self.quorum else prices
+        self.last_prices = used
+        if not used:
+            return None
+        return sum(used.values()) / len(used)
+
+    def latency_summary(self) -> str:
+        with self.lock:
+            return " | ".join(f"{name} {latency * 1000:.0f}ms" for name, latency in self.latencies.items())
+
+
+class WebSocketClient:
+    """Minimal RFC 6455 client on the standard library: text frames, ping/pong and close"""
+
+    GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+    def __init__(self, url, timeout=10.0):
+        self.url = url
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = b''
+
+    def connect(self, read_timeout=30.0):
+        parts = urlsplit(self.url)
+        secure = parts.scheme == 'wss'
+        host = parts.hostname
+        port = parts.port or (443 if secure else 80)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+
+        sock = socket.create_connection((host, port), timeout=self.timeout)
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+        key = base64.b64encode(os.urandom(16)).decode()
+        handshake = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n\r\n"
+        )
+        sock.sendall(handshake.encode())
+        self.sock = sock
+        self.buffer = b''
+
+        while b'\r\n\r\n' not in self.buffer:
+            self._fill()
+        header, self.buffer = self.buffer.split(b'\r\n\r\n', 1)
+        lines = header.decode('latin-1').split('\r\n')
+        if ' 101 ' not in lines[0] + ' ':
+            raise ConnectionError(f"WebSocket handshake refused: {lines[0]}")
+        headers = {name.strip().lower(): value.strip()
+                   for name, _, value in (line.partition(':') for line in lines[1:])}
+        expected = base64.b64encode(hashlib.sha1((key + self.GUID).encode()).digest()).decode()
+        if headers.get('sec-websocket-accept') != expected:
+            raise ConnectionError("WebSocket handshake returned a bad accept key")
+        sock.settimeout(read_timeout)
+
+    def _fill(self):
+        chunk = self.sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("WebSocket closed by server")
+        self.buffer += chunk
+
+    def _read(self, size):
+        while len(self.buffer) < size:
+            self._fill()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def _send_frame(self, opcode, payload=b''):
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([0x80 | length])
+        elif length < 1 << 16:
+            header += bytes([0x80 | 126]) + struct.pack('!H', length)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack('!Q', length)
+        mask = os.urandom(4)  # clients must mask every frame
+        masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        self.sock.sendall(header + mask + masked)
+
+    def send_text(self, text):
+        self._send_frame(0x1, text.encode())
+
+    def recv(self) -> str:
+        """Next text message, answering pings along the way"""
+        message = b''
+        while True:
+            first, second = self._read(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', self._read(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', self._read(8))[0]
+            mask = self._read(4) if second & 0x80 else None
+            payload = self._read(length)
+            if mask:
+                payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+            if opcode == 0x9:  # ping
+                self._send_frame(0xA, payload)
+            elif opcode == 0x8:  # close
+                try:
+                    self._send_frame(0x8, payload[:2])
+                finally:
+                    raise ConnectionError("WebSocket closed by server")
+            elif opcode in (0x0, 0x1, 0x2):
+                message += payload
+                if first & 0x80:
+                    return message.decode('utf-8', errors='replace')
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self._send_frame(0x8)
+            except OSError:
+                pass
+            self.sock.close()
+            self.sock = None
+
+
+def parse_binance_trade(message) -> Optional[Tuple[float, float, float]]:
+    """(price, epoch seconds, quantity) from a Binance <symbol>@trade stream message"""
+    data = json.loads(message)
+    if data.get('e') != 'trade':
+        return None
+    return float(data['p']), data['T'] / 1000, float(data['q'])
+
+
+BINANCE_TRADE_STREAM = "wss://stream.binance.com:9443/ws/btcusdt@trade"
+
+
+class TickStream:
+    """Pushes ticks from a WebSocket trade stream into `on_tick(price, timestamp[, volume])`
+
+    Runs on its own thread and reconnects with exponential backoff. While
+    the stream is down, the optional `poll()` REST fetch keeps ticks
+    flowing every `poll_interval` seconds until a reconnect succeeds.
+    During a replay no thread is started: `catch_up()` delivers the
+    journaled messages and polls up to the replay clock instead.
+    """
+
+    def __init__(self, url, parse, on_tick, poll=None, subscribe=None, poll_interval=5.0,
+                 reconnect_delay=1.0, max_reconnect_delay=30.0, read_timeout=30.0):
+        self.url = url
+        self.parse = parse
+        self.on_tick = on_tick
+        self.poll = poll
+        self.subscribe = subscribe  # optional message sent after connecting
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.read_timeout = read_timeout
+        self.running = False
+        self.connected = False
+        self.client = None
+        self.thread = None
+        self.ticks_received = 0
+        self.ticks_polled = 0
+        self.last_tick_at = None
+        self.wake = threading.Event()
+
+    def start(self):
+        self.running = True
+        if journal is not None and journal.replaying:
+            self.connected = True
+            return
+        self.thread = threading.Thread(target=self._run, daemon=True, name="tick-stream")
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+        client = self.client
+        if client is not None:
+            client.close()
+
+    def _emit(self, *tick):
+        self.last_tick_at = clock.time()
+        self.on_tick(*tick)
+
+    def catch_up(self):
+        """Deliver the journaled stream traffic up to the replay clock; a no-op for a live stream"""
+        if journal is None or not journal.replaying or not self.running:
+            return
+        for entry in journal.stream_until(self.url, clock.time()):
+            if entry['kind'] == 'ws':
+                tick = self.parse(entry['message'])
+                if tick is not None:
+                    self.ticks_received += 1
+                    self._emit(*tick)
+            elif self.poll is not None:
+                self._poll_once()
+
+    def _stream(self):
+        self.client = WebSocketClient(self.url)
+        self.client.connect(self.read_timeout)
+        if self.subscribe:
+            self.client.send_text(self.subscribe)
+        self.connected = True
+        logging.info(f"Tick stream connected: {self.url}")
+        while self.running:
+            message = self.client.recv()
+            if journal is not None and journal.recording:
+                journal.record_stream(self.url, message)
+            tick = self.parse(message)
+            if tick is not None:
+                self.ticks_received += 1
+                self._emit(*tick)
+
+    def _poll_until(self, deadline):
+        """Fall back to REST polling until it is time to try the stream again"""
+        while self.running and time.monotonic() < deadline:
+            if self.poll is not None:
+                if journal is not None and journal.recording:
+                    journal.record_stream(self.url)
+                self._poll_once()
+            self.wake.wait(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+
+    def _poll_once(self):
+        try:
+            price = self.poll()
+            if price:
+                self.ticks_polled += 1
+                self._emit(price, clock.time())
+        except Exception as e:
+            logging.warning(f"Polling fallback failed: {e}")
+
+    def _run(self):
+        delay = self.reconnect_delay
+        while self.running:
+            try:
+                self._stream()
+            except Exception as e:
+                if self.connected:
+                    delay = self.reconnect_delay  # a working connection resets the backoff
+                if self.running:
+                    logging.warning(f"Tick stream disconnected: {e} - reconnecting in {delay:.1f}s")
+            finally:
+                self.connected = False
+                if self.client is not None:
+                    self.client.close()
+                    self.client = None
+            self._poll_until(time.monotonic() + delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def status(self) -> str:
+        if self.connected:
+            return f"Stream: live ({self.ticks_received} ticks)"
+        return f"Stream: reconnecting, polling ({self.ticks_polled} polls)"
+
+
+TIMEFRAME_SECONDS = {'1m': 60, '5m': 300, '15m': 900, '1h': 3600, '4h': 14400}
+
+
+class Bar:
+    """One OHLCV bar; `start` is the epoch second the bar opens at"""
+
+    __slots__ = ('start', 'open', 'high', 'low', 'close', 'volume', 'ticks')
+
+    def __init__(self, start, price, volume=0.0):
+        self.start = start
+        self.open = self.high = self.low = self.close = price
+        self.volume = volume
+        self.ticks = 1
+
+    @classmethod
+    def from_ohlcv(cls, start, open_, high, low, close, volume=0.0):
+        bar = cls(start, open_, volume)
+        bar.high, bar.low, bar.close = high, low, close
+        return bar
+
+    def add(self, price, volume=0.0):
+        if price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += volume
+        self.ticks += 1
+
+    @property
+    def green(self) -> bool:
+        return self.close > self.open
+
+    def __repr__(self):
+        return (f"Bar({self.start:.0f}, o={self.open}, h={self.high}, l={self.low}, "
+                f"c={self.close}, v={self.volume}, ticks={self.ticks})")
+
+
+class BarAggregator:
+    """Builds OHLCV bars for several timeframes from one stream of timestamped ticks
+
+    Bars are aligned to the epoch (a 5m bar starts on a multiple of 300 s)
+    and a bar closes when the first tick of a later bar arrives. Each
+    timeframe keeps its last `max_bars` closed bars in a ring buffer, and
+    `on_close` listeners are called with (timeframe, bar) once per closed
+    bar, so indicators can advance per bar instead of per tick. Ticks
+    older than the forming bar are dropped.
+    """
+
+    def __init__(self, timeframes: Iterable[str] = tuple(TIMEFRAME_SECONDS), max_bars=500):
+        self.seconds = {timeframe: TIMEFRAME_SECONDS[timeframe] for timeframe in timeframes}
+        self.closed = {timeframe: deque(maxlen=max_bars) for timeframe in self.seconds}
+        self.forming: Dict[str, Optional[Bar]] = {timeframe: None for timeframe in self.seconds}
+        self.listeners = []
+        self.late_ticks = 0
+        self.lock = threading.Lock()
+
+    def on_close(self, listener: Callable[[str, Bar], None]):
+        self.listeners.append(listener)
+
+    def seed(self, timeframe, bars: Iterable[Bar]):
+        """Preload closed bars (e.g. REST klines) and replay them to the listeners"""
+        seeded = []
+        with self.lock:
+            history = self.closed[timeframe]
+            forming = self.forming[timeframe]
+            for bar in bars:
+                if history and bar.start <= history[-1].start:
+                    continue
+                if forming is not None and bar.start >= forming.start:
+                    break
+                history.append(bar)
+                seeded.append(bar)
+        self._notify([(timeframe, bar) for bar in seeded])
+        return len(seeded)
+
+    def _notify(self, closed):
+        # Listeners run outside the lock so they may read bars back
+        for timeframe, bar in closed:
+            for listener in self.listeners:
+                try:
+                    listener(timeframe, bar)
+                except Exception as e:
+                    logging.warning(f"Bar close listener failed for {timeframe}: {e}")
+
+    def add_tick(self, price, timestamp, volume=0.0):
+        closed = []
+        late = False
+        with self.lock:
+            for timeframe, seconds in self.seconds.items():
+                start = timestamp - timestamp % seconds
+                bar = self.forming[timeframe]
+                if bar is None or start > bar.start:
+                    if bar is not None:
+                        self.closed[timeframe].append(bar)
+                        closed.append((timeframe, bar))
+                    self.forming[timeframe] = Bar(start, price, volume)
+                elif start == bar.start:
+                    bar.add(price, volume)
+                else:
+                    late = True
+            self.late_ticks += late
+        self._notify(closed)
+        return closed
+
+    def bars(self, timeframe) -> list:
+        """Closed bars for `timeframe`, oldest first"""
+        with self.lock:
+            return list(self.closed[timeframe])
+
+    def closes(self, timeframe) -> list:
+        with self.lock:
+            return [bar.close for bar in self.closed[timeframe]]
+
+    def current(self, timeframe) -> Optional[Bar]:
+        """The bar still forming for `timeframe`, if any tick has arrived"""
+        return self.forming[timeframe]
+
+    def last_closed(self, timeframe) -> Optional[Bar]:
+        with self.lock:
+            bars = self.closed[timeframe]
+            return bars[-1] if bars else None
+
+
+BINANCE_KLINES = "https://api.binance.com/api/v3/klines"
+
+
+def fetch_binance_bars(timeframe, limit=100, symbol='BTCUSDT') -> list:
+    """Closed Binance klines for `timeframe` as Bars, oldest first (the forming kline is dropped)"""
+    rows = http_client.get_json(
+        f"{BINANCE_KLINES}?symbol={symbol}&interval={timeframe}&limit={limit}",
+        timeout=10
+    )
+    now_ms = clock.time() * 1000
+    return [
+        Bar.from_ohlcv(row[0] / 1000, float(row[1]), float(row[2]), float(row[3]),
+                       float(row[4]), float(row[5]))
+        for row in rows if row[6] < now_ms
+    ]
@@ -0,0 +1,262 @@
+import io
+import math
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+DEFAULT_DIRECTORY = 'ohlcv_data'
+INTERVAL_MS = {'hourly': 3600 * 1000, 'daily': 86400 * 1000}
+
+
+class OHLCVStore:
+    """Append-only columnar OHLCV history on disk, memory-mapped for reads
+
+    Every column is a flat little-endian float64 file (timestamps in epoch
+    milliseconds). Rows newer than the last stored timestamp are appended in
+    place; only the rare backfill of older rows rewrites the files. A
+    rewrite writes every new column before it replaces any old one, and a
+    commit marker records that the new set is complete, so an interrupted
+    rewrite is either finished or discarded when the store is next opened.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, name='btc_usd_daily'):
+        self.path = os.path.join(directory, name)
+        os.makedirs(self.path, exist_ok=True)
+        self.lock = threading.Lock()
+        self._repair()
+
+    def _column_path(self, column):
+        return os.path.join(self.path, f"{column}.f8")
+
+    def _commit_marker_path(self):
+        return os.path.join(self.path, 'rewrite.commit')
+
+    def _recover_rewrite(self):
+        """Finish a rewrite whose new columns were all written, or discard one that was cut short"""
+        committed = os.path.exists(self._commit_marker_path())
+        for column in COLUMNS:
+            temporary = self._column_path(column) + '.tmp'
+            if os.path.exists(temporary):
+                if committed:
+                    os.replace(temporary, self._column_path(column))
+                else:
+                    os.remove(temporary)
+        if committed:
+            os.remove(self._commit_marker_path())
+
+    def _repair(self):
+        """Settle an interrupted rewrite, then cut every column back to the shortest one (a half-written append)"""
+        self._recover_rewrite()
+        sizes = []
+        for column in COLUMNS:
+            column_path = self._column_path(column)
+            if not os.path.exists(column_path):
+                open(column_path, 'wb').close()
+            sizes.append(os.path.getsize(column_path) // 8)
+        rows = min(sizes)
+        for column in COLUMNS:
+            if os.path.getsize(self._column_path(column)) != rows * 8:
+                with open(self._column_path(column), 'r+b') as f:
+                    f.truncate(rows * 8)
+
+    def __len__(self):
+        return os.path.getsize(self._column_path('timestamp')) // 8
+
+    def _map(self, column):
+        if len(self) == 0:
+            return np.empty(0)
+        return np.memmap(self._column_path(column), dtype='<f8', mode='r')
+
+    def first_timestamp(self) -> Optional[float]:
+        return float(self._map('timestamp')[0]) if len(self) else None
+
+    def last_timestamp(self) -> Optional[float]:
+        return float(self._map('timestamp')[-1]) if len(self) else None
+
+    def read(self, since=None) -> Dict[str, np.ndarray]:
+        """Memory-mapped column views, optionally only rows at or after `since`"""
+        with self.lock:
+            columns = {column: self._map(column) for column in COLUMNS}
+        start = 0 if since is None else int(np.searchsorted(columns['timestamp'], since, side='left'))
+        return {column: values[start:] for column, values in columns.items()}
+
+    def merge(self, rows: Dict[str, np.ndarray]) -> int:
+        """Add rows the store does not cover yet and return how many were added
+
+        Rows after the last timestamp are appended; rows before the first
+        trigger a rewrite with them prepended; rows inside the stored span are
+        already covered and ignored.
+        """
+        timestamps = np.asarray(rows['timestamp'], dtype=float)
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+        keep = np.concatenate([[True], np.diff(timestamps) > 0]) if len(timestamps) else np.zeros(0, bool)
+        new = {column: np.asarray(rows[column], dtype='<f8')[order][keep] for column in COLUMNS}
+        timestamps = new['timestamp']
+
+        with self.lock:
+            stored = len(self)
+            if stored == 0:
+                older = np.zeros(len(timestamps), bool)
+                newer = np.ones(len(timestamps), bool)
+            else:
+                existing = np.memmap(self._column_path('timestamp'), dtype='<f8', mode='r')
+                older = timestamps < existing[0]
+                newer = timestamps > existing[-1]
+                del existing
+
+            if older.any():
+                self._rewrite({column: new[column][older] for column in COLUMNS})
+            if newer.any():
+                for column in COLUMNS:
+                    with open(self._column_path(column), 'ab') as f:
+                        f.write(new[column][newer].tobytes())
+            return int(older.sum() + newer.sum())
+
+    def _rewrite(self, prefix):
+        """Prepend rows by writing fresh column files and swapping them all in"""
+        for column in COLUMNS:
+            column_path = self._column_path(column)
+            current = np.fromfile(column_path, dtype='<f8')
+            np.concatenate([prefix[column], current]).astype('<f8').tofile(column_path + '.tmp')
+        # From here on the new set is complete; _recover_rewrite finishes the swap if it is interrupted
+        open(self._commit_marker_path(), 'wb').close()
+        for column in COLUMNS:
+            os.replace(self._column_path(column) + '.tmp', self._column_path(column))
+        os.remove(self._commit_marker_path())
+
+
+# Rows end up one per line; the remaining brackets and quotes are blanked out
+_NUMBERS_ONLY = bytes.maketrans(b'[]"', b'   ')
+_ROW_BREAK = re.compile(rb'\]\s*,\s*\[')
+_NESTED_ARRAY_END = re.compile(rb'\]\s*\]')
+
+
+def _parse_rows(raw: bytes, columns) -> np.ndarray:
+    """(rows, len(columns)) float64 array from the JSON text of an array of numeric rows
+
+    The rows are rewritten as CSV lines and read by NumPy's C parser, so no
+    Python object is created per row or per value.
+    """
+    body = raw.strip()[1:-1]  # drop the outer brackets
+    if not body.strip():
+        return np.empty((0, len(columns)))
+    body = body.replace(b'],[', b'\n').replace(b'], [', b'\n')
+    if b'],' in body:
+        body = _ROW_BREAK.sub(b'\n', body)  # pretty-printed JSON
+    return np.loadtxt(io.BytesIO(body.translate(_NUMBERS_ONLY)), delimiter=',',
+                      usecols=columns, dtype=np.float64, ndmin=2)
+
+
+def _json_rows(raw: bytes, key, columns) -> np.ndarray:
+    """Rows of the nested numeric array stored under `key` in a JSON object, decoded without json.loads"""
+    match = re.search(rb'"' + key.encode() + rb'"\s*:\s*\[', raw)
+    if match is None:
+        return np.empty((0, len(columns)))
+    start = match.end() - 1
+    if raw[start + 1:start + 64].lstrip()[:1] == b']':
+        return np.empty((0, len(columns)))
+    end = _NESTED_ARRAY_END.search(raw, start)
+    if end is None:
+        raise ValueError(f"unterminated {key} array")
+    return _parse_rows(raw[start:end.end()], columns)
+
+
+def kline_rows(payload) -> Dict[str, np.ndarray]:
+    """OHLCV columns from a Binance klines payload, raw bytes or already decoded"""
+    if isinstance(payload, (bytes, bytearray)):
+        if payload[:64].lstrip()[:1] != b'[':
+            raise ValueError(f"unexpected klines payload: {bytes(payload[:200])!r}")
+        rows = _parse_rows(bytes(payload), range(6))
+    else:
+        rows = np.asarray([row[:6] for row in payload], dtype=float).reshape(-1, 6)
+    return {column: np.ascontiguousarray(rows[:, i]) for i, column in enumerate(COLUMNS)}
+
+
+def market_chart_rows(data) -> Dict[str, np.ndarray]:
+    """OHLCV columns from a CoinGecko market_chart payload (close-only, so O=H=L=C)
+
+    `data` is either the raw response body, which is decoded straight into
+    NumPy arrays, or the JSON already loaded into Python lists.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        prices = _json_rows(bytes(data), 'prices', (0, 1))
+        volumes = _json_rows(bytes(data), 'total_volumes', (0, 1))
+    else:
+        prices = np.asarray(data.get('prices') or [], dtype=float).reshape(-1, 2)
+        volumes = np.asarray(data.get('total_volumes') or [], dtype=float).reshape(-1, 2)
+    close = np.ascontiguousarray(prices[:, 1])
+    volume = volumes[:, 1] if len(volumes) == len(prices) else np.zeros(len(prices))
+    return {
+        'timestamp': np.ascontiguousarray(prices[:, 0]),
+        'open': close,
+        'high': close,
+        'low': close,
+        'close': close,
+        'volume': volume
+    }
+
+
+def local_datetime_index(timestamps_ms):
+    """Naive local-time DatetimeIndex for epoch-millisecond timestamps, converted in one vectorized pass
+
+    Matches `datetime.fromtimestamp(ms / 1000)` per row, including DST changes.
+    """
+    import pandas as pd
+    from dateutil import tz
+
+    # A tzfile carries its transition table, so pandas converts it vectorized; tzlocal() goes row by row
+    local = tz.gettz() or tz.tzlocal()
+    utc = pd.to_datetime(np.asarray(timestamps_ms, dtype=np.int64), unit='ms', utc=True)
+    return utc.tz_convert(local).tz_localize(None).rename('date')
+
+
+class MarketChartHistory:
+    """CoinGecko market_chart history kept on disk, topped up with only the missing candles
+
+    `fetch_chart(days, interval)` performs the upstream call and returns the
+    market_chart response body (raw bytes or decoded JSON). Candles from closed intervals are persisted;
+    the still-forming latest point is served from the response only.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, symbol='btc_usd'):
+        self.directory = directory
+        self.symbol = symbol
+        self.stores = {}
+        self.lock = threading.Lock()
+
+    def store(self, interval) -> OHLCVStore:
+        with self.lock:
+            if interval not in self.stores:
+                self.stores[interval] = OHLCVStore(self.directory, f"{self.symbol}_{interval}")
+            return self.stores[interval]
+
+    def history(self, days, interval, fetch_chart: Callable[[int, str], dict]) -> Dict[str, np.ndarray]:
+        """Columns covering the last `days` days, fetching only what the store lacks"""
+        store = self.store(interval)
+        step = INTERVAL_MS[interval]
+        now = time.time() * 1000
+        start = now - days * 86400 * 1000
+
+        first, last = store.first_timestamp(), store.last_timestamp()
+        if first is None or first > start + step:
+            fetch_days = days  # store does not reach back far enough yet
+        else:
+            fetch_days = max(1, math.ceil((now - last) / (86400 * 1000)))
+
+        rows = market_chart_rows(fetch_chart(fetch_days, interval))
+        closed = rows['timestamp'] < (now // step) * step
+        added = store.merge({column: values[closed] for column, values in rows.items()})
+        if added:
+            print(f"💾 Stored {added} new {interval} candles ({len(store)} on disk)")
+
+        history = store.read(since=start)
+        live = ~closed & (rows['timestamp'] > (store.last_timestamp() or 0))
+        if live.any():
+            history = {column: np.concatenate([history[column], rows[column][live]]) for column in COLUMNS}
+        return history
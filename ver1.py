@@ -1,11 +1,17 @@
-from flask import Flask, render_template_string, request, jsonify
-import requests
+from flask import Flask, request, jsonify
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import os 
 import json
 from collections import deque
+from urllib.parse import urlencode
+
+from indicators import (rsi_series, macd_series, bollinger_series, stochastic_rsi_series,
+                        williams_r_series, ichimoku_series, scan_candlestick_patterns)
+from ohlcv_store import MarketChartHistory, local_datetime_index
+from market_data import TTLCache, http_client
+from analysis_snapshot import SnapshotRefresher, FragmentPage, EventBroadcaster, SignalPublisher, parse_scenarios
 
 app = Flask(__name__)
 
@@ -353,6 +359,7 @@ RESULTS_HTML = '''
                                 <h5 class="mb-0"><i class="fas fa-calculator me-2"></i>Risk Management</h5>
                             </div>
                             <div class="card-body">
+                                {% block position_sizing %}
                                 <div class="mb-3">
                                     <small class="text-muted">Recommended Position Size</small>
                                     <div class="h4 text-success">${{ analysis.position_sizing.recommended_size }}</div>
@@ -370,6 +377,7 @@ RESULTS_HTML = '''
                                     <div class="h6 text-success">Target 1: ${{ analysis.position_sizing.take_profit_1 }}</div>
                                     <div class="h6 text-success">Target 2: ${{ analysis.position_sizing.take_profit_2 }}</div>
                                 </div>
+                                {% endblock %}
                                 
                                 <div class="alert alert-{{ analysis.risk_level.color }} mt-3">
                                     <small><strong>Risk Level:</strong> {{ analysis.risk_level.level }}</small><br>
@@ -497,30 +505,23 @@ class AdvancedBitcoinTradingAssistant:
     def __init__(self):
         self.indicators = {}
         self.historical_predictions = deque(maxlen=100)
+        # Candle history on disk; each request only downloads what is missing
+        self.price_store = MarketChartHistory()
+        # Concurrent fetches of one chart share a download; kept shorter than the snapshot interval
+        # so every background refresh sees a fresh response
+        self.response_cache = TTLCache(ttl=30)
         
     def calculate_rsi(self, prices, window=14):
         """Calculate RSI with enhanced accuracy"""
         if len(prices) < window + 1:
             return 50
-            
-        deltas = np.diff(prices)
-        gains = np.where(deltas > 0, deltas, 0)
-        losses = np.where(deltas < 0, -deltas, 0)
-        
-        avg_gains = np.zeros_like(prices)
-        avg_losses = np.zeros_like(prices)
-        
-        avg_gains[window] = np.mean(gains[:window])
-        avg_losses[window] = np.mean(losses[:window])
-        
-        for i in range(window + 1, len(prices)):
-            avg_gains[i] = (avg_gains[i-1] * (window - 1) + gains[i-1]) / window
-            avg_losses[i] = (avg_losses[i-1] * (window - 1) + losses[i-1]) / window
-        
-        rs = avg_gains[window:] / np.where(avg_losses[window:] == 0, 1, avg_losses[window:])
-        rsi = 100 - (100 / (1 + rs))
         
-        return float(rsi[-1]) if len(rsi) > 0 else 50
+        rsi = rsi_series(prices, window)
+        return float(rsi[-1])
+    
+    def calculate_rsi_series(self, prices, window=14):
+        """Full RSI series (one row per window when several are given)"""
+        return rsi_series(prices, window)
     
     def calculate_sma(self, prices, window):
         """Calculate Simple Moving Average"""
@@ -556,64 +557,41 @@ class AdvancedBitcoinTradingAssistant:
         
         return upper_band, sma, lower_band
     
+    def calculate_bollinger_series(self, prices, window=20, num_std=2):
+        """Full upper/middle/lower Bollinger Band series for backtests and charts"""
+        return bollinger_series(prices, window, num_std)
+    
     def calculate_stochastic_rsi(self, rsi_values, window=14):
         """Calculate Stochastic RSI"""
         if len(rsi_values) < window:
             return 50
-            
-        current_rsi = rsi_values[-1]
-        min_rsi = min(rsi_values[-window:])
-        max_rsi = max(rsi_values[-window:])
         
-        if max_rsi == min_rsi:
-            return 50
-            
-        stoch_rsi = (current_rsi - min_rsi) / (max_rsi - min_rsi) * 100
-        return stoch_rsi
+        return float(stochastic_rsi_series(rsi_values, window)[-1])
     
     def calculate_williams_r(self, high_prices, low_prices, close_prices, window=14):
         """Calculate Williams %R"""
         if len(high_prices) < window:
             return -50
-            
-        highest_high = max(high_prices[-window:])
-        lowest_low = min(low_prices[-window:])
-        current_close = close_prices[-1]
         
-        if highest_high == lowest_low:
-            return -50
-            
-        williams_r = (highest_high - current_close) / (highest_high - lowest_low) * -100
-        return williams_r
+        return float(williams_r_series(high_prices, low_prices, close_prices, window)[-1])
     
     def calculate_macd(self, prices, fast=12, slow=26, signal=9):
         """Calculate MACD with signal line"""
-        ema_fast = self.calculate_ema(prices, fast)
-        ema_slow = self.calculate_ema(prices, slow)
-        macd_line = ema_fast - ema_slow
-        
-        # Simple signal line calculation
-        macd_values = [self.calculate_ema(prices[i-slow:i] if i>=slow else prices[:i], fast) - 
-                      self.calculate_ema(prices[i-slow:i] if i>=slow else prices[:i], slow) 
-                      for i in range(slow, len(prices))]
+        if len(prices) == 0:
+            return 0.0, 0.0, 0.0
         
-        if len(macd_values) >= signal:
-            signal_line = np.mean(macd_values[-signal:])
-        else:
-            signal_line = np.mean(macd_values) if macd_values else 0
-            
-        histogram = macd_line - signal_line
-        return macd_line, signal_line, histogram
+        # EMAs start at the first price, as in calculate_ema
+        macd = macd_series(prices, fast, slow, signal, sma_seed=False)
+        return float(macd['macd'][-1]), float(macd['signal'][-1]), float(macd['histogram'][-1])
     
     def detect_ichimoku_cloud(self, high_prices, low_prices, close_prices):
         """Simplified Ichimoku Cloud detection"""
         if len(high_prices) < 52:
             return "Insufficient data"
             
-        tenkan_sen = (max(high_prices[-9:]) + min(low_prices[-9:])) / 2
-        kijun_sen = (max(high_prices[-26:]) + min(low_prices[-26:])) / 2
-        senkou_span_a = (tenkan_sen + kijun_sen) / 2
-        senkou_span_b = (max(high_prices[-52:]) + min(low_prices[-52:])) / 2
+        cloud = ichimoku_series(high_prices, low_prices)
+        senkou_span_a = cloud['senkou_span_a'][-1]
+        senkou_span_b = cloud['senkou_span_b'][-1]
         
         current_price = close_prices[-1]
         
@@ -631,24 +609,10 @@ class AdvancedBitcoinTradingAssistant:
         if len(close_prices) < 3:
             return patterns
             
-        # Bullish Engulfing
-        if (close_prices[-1] > open_prices[-1] and 
-            open_prices[-1] < close_prices[-2] and 
-            close_prices[-1] > open_prices[-2] and
-            (close_prices[-1] - open_prices[-1]) > (open_prices[-2] - close_prices[-2])):
-            patterns.append("Bullish Engulfing")
-            
-        # Bearish Engulfing
-        if (close_prices[-1] < open_prices[-1] and 
-            open_prices[-1] > close_prices[-2] and 
-            close_prices[-1] < open_prices[-2] and
-            (open_prices[-1] - close_prices[-1]) > (close_prices[-2] - open_prices[-2])):
-            patterns.append("Bearish Engulfing")
-            
-        # Hammer
-        if (min(open_prices[-1], close_prices[-1]) > (high_prices[-1] + low_prices[-1]) / 2 and
-            (high_prices[-1] - low_prices[-1]) > 3 * abs(close_prices[-1] - open_prices[-1])):
-            patterns.append("Hammer" if close_prices[-1] > open_prices[-1] else "Hanging Man")
+        # Scan the last three bars and keep the patterns completed by the latest one
+        found = scan_candlestick_patterns(open_prices[-3:], high_prices[-3:],
+                                          low_prices[-3:], close_prices[-3:])
+        patterns = [name for name, indices in found.items() if len(indices) and indices[-1] == 2]
             
         return patterns
     
@@ -831,23 +795,29 @@ class AdvancedBitcoinTradingAssistant:
             'sma_50': round(sma_50, 2)
         }
     
-    def fetch_bitcoin_data(self, days=30):
-        """Fetch Bitcoin data from CoinGecko API"""
-        try:
-            print(f"📡 Fetching Bitcoin data for {days} days...")
+    def fetch_market_chart(self, days, interval):
+        """Download a CoinGecko market_chart payload; concurrent requests share one call"""
+        def download():
             url = "https://api.coingecko.com/api/v3/coins/bitcoin/market_chart"
             params = {
                 'vs_currency': 'usd', 
                 'days': days, 
-                'interval': 'daily' if days > 1 else 'hourly'
+                'interval': interval
             }
-            response = requests.get(url, params=params, timeout=15)
-            response.raise_for_status()
-            data = response.json()
+            # Raw body through the pooled client; the candle store decodes it straight into arrays
+            return http_client.get(f"{url}?{urlencode(params)}", timeout=15)
+        
+        return self.response_cache.get(('market_chart', days, interval), download)
+    
+    def fetch_bitcoin_data(self, days=30):
+        """Fetch Bitcoin data from CoinGecko API, topping up the local candle store"""
+        try:
+            print(f"📡 Fetching Bitcoin data for {days} days...")
+            history = self.price_store.history(days, 'daily' if days > 1 else 'hourly', self.fetch_market_chart)
             
             # Process the data
-            prices = [price[1] for price in data['prices']]
-            dates = [datetime.fromtimestamp(price[0] / 1000) for price in data['prices']]
+            prices = history['close']
+            dates = local_datetime_index(history['timestamp'])
             
             df = pd.DataFrame({
                 'date': dates,
@@ -1019,7 +989,25 @@ class AdvancedBitcoinTradingAssistant:
         }
         
         # Educational tips
-        educational_tips = [
+        educational_tips = self.get_educational_tips(risk_per_trade)
+        
+        return {
+            **basic_analysis,
+            'multi_timeframe_analysis': multi_tf_analysis,
+            'primary_timeframe': '30D',
+            'indicators_used': len(advanced_indicators),
+            'advanced_indicators': advanced_indicators,
+            'patterns': patterns,
+            'position_sizing': position_sizing,
+            'risk_level': {'level': risk_level, 'color': risk_color, 'description': risk_desc},
+            'signals': enhanced_signals,
+            'ml_insights': ml_insights,
+            'educational_tips': educational_tips
+        }
+    
+    def get_educational_tips(self, risk_per_trade=2):
+        """Learning Center tips; the risk tip quotes the user's risk per trade"""
+        return [
             {
                 'icon': 'chart-line',
                 'title': 'Multi-Timeframe Analysis',
@@ -1041,20 +1029,6 @@ class AdvancedBitcoinTradingAssistant:
                 'content': 'Markets evolve. Keep learning about new indicators and risk management strategies.'
             }
         ]
-        
-        return {
-            **basic_analysis,
-            'multi_timeframe_analysis': multi_tf_analysis,
-            'primary_timeframe': '30D',
-            'indicators_used': len(advanced_indicators),
-            'advanced_indicators': advanced_indicators,
-            'patterns': patterns,
-            'position_sizing': position_sizing,
-            'risk_level': {'level': risk_level, 'color': risk_color, 'description': risk_desc},
-            'signals': enhanced_signals,
-            'ml_insights': ml_insights,
-            'educational_tips': educational_tips
-        }
     
     def get_default_analysis(self, df):
         """Default analysis when data is insufficient"""
@@ -1088,60 +1062,152 @@ class AdvancedBitcoinTradingAssistant:
 # Initialize the advanced trading assistant
 advanced_bot = AdvancedBitcoinTradingAssistant()
 
+ANALYSIS_TIMEFRAMES = ('1', '7', '30', '90')
+
+def compute_analysis(time_frame):
+    """Full analysis for one timeframe, for the results page and the JSON API"""
+    df = advanced_bot.fetch_bitcoin_data(days=int(time_frame))
+    return {
+        'analysis': advanced_bot.get_advanced_analysis(df),
+        'sentiment': {'sentiment': 'Greed', 'score': 65, 'color': 'warning'},
+        'rsi': advanced_bot.calculate_rsi(df['price'].values)
+    }
+
+# The JSON API only reads these snapshots; the analysis runs on the refresher thread
+analysis_snapshots = SnapshotRefresher(compute_analysis, ANALYSIS_TIMEFRAMES, interval=60)
+
+# Dashboards follow these fields over /api/stream; a refresh that leaves them unchanged sends nothing
+def signal_fields(payload):
+    analysis = payload['analysis']
+    return {
+        'recommendation': analysis['recommendation'],
+        'confidence': analysis['confidence'],
+        'rsi': round(payload['rsi'], 1),
+        'price': round(analysis['current_price'], 2)
+    }
+
+signal_events = EventBroadcaster()
+analysis_snapshots.on_publish(SignalPublisher(signal_events, signal_fields))
+
+# Templates are compiled once; the index page has no variables, so it is rendered once too
+INDEX_PAGE = app.jinja_env.from_string(INDEX_HTML).render()
+results_page = FragmentPage(app.jinja_env, RESULTS_HTML, 'position_sizing')
+
+def render_results(time_frame, account_balance, risk_per_trade):
+    """Results page from the latest snapshot; only the position-sizing block is rendered per request"""
+    snapshot = analysis_snapshots.get(time_frame)
+    if snapshot is None:
+        raise RuntimeError(analysis_snapshots.unavailable_reason(time_frame))
+    analysis = snapshot.payload['analysis']
+    
+    def page_context():
+        # The Learning Center quotes the user's risk, so pages are also cached per risk setting
+        tips = advanced_bot.get_educational_tips(risk_per_trade) if analysis['educational_tips'] else []
+        return {
+            'analysis': {**analysis, 'educational_tips': tips},
+            'sentiment': snapshot.payload['sentiment'],
+            'error': None
+        }
+    
+    position_sizing = advanced_bot.calculate_position_sizing(analysis['current_price'], account_balance, risk_per_trade)
+    return results_page.render((time_frame, snapshot.version, risk_per_trade), page_context,
+                               {'analysis': {'position_sizing': position_sizing}})
+
 @app.route('/')
 def index():
-    return render_template_string(INDEX_HTML)
+    return INDEX_PAGE
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
     try:
         time_frame = request.form.get('time_frame', '30')
+        if not analysis_snapshots.supports(time_frame):
+            error_msg = f"Unsupported time frame {time_frame!r} - choose {', '.join(ANALYSIS_TIMEFRAMES)} days"
+            return results_page.template.render(error=error_msg), 400
         analysis_type = request.form.get('analysis_type', 'technical')
         account_balance = float(request.form.get('account_balance', 1000))
         risk_per_trade = float(request.form.get('risk_per_trade', 2))
         
-        print(f"🔍 Starting advanced analysis: {time_frame} days, {analysis_type} type")
-        
-        # Fetch data for the selected timeframe
-        df = advanced_bot.fetch_bitcoin_data(days=int(time_frame))
+        print(f"🔍 Advanced analysis: {time_frame} days, {analysis_type} type")
         
-        # Get comprehensive analysis
-        analysis = advanced_bot.get_advanced_analysis(df, account_balance, risk_per_trade)
-        
-        # Simulate sentiment (in real implementation, fetch from API)
-        sentiment = {
-            'sentiment': 'Greed',
-            'score': 65,
-            'color': 'warning'
-        }
-        
-        print(f"✅ Advanced analysis complete: {analysis['recommendation']} with {analysis['confidence']}% confidence")
-        
-        return render_template_string(RESULTS_HTML, 
-                                    analysis=analysis, 
-                                    sentiment=sentiment,
-                                    error=None)
+        # Market analysis comes from the background snapshot for this timeframe
+        return render_results(time_frame, account_balance, risk_per_trade)
                                     
     except Exception as e:
         error_msg = f"Advanced analysis failed: {str(e)}"
         print(f"❌ {error_msg}")
-        return render_template_string(RESULTS_HTML, 
-                                    error=error_msg)
+        return results_page.template.render(error=error_msg)
 
 @app.route('/api/advanced_analysis')
 def api_advanced_analysis():
-    """Enhanced JSON API endpoint"""
+    """Enhanced JSON API endpoint, served from the latest background snapshot"""
     try:
-        df = advanced_bot.fetch_bitcoin_data()
-        analysis = advanced_bot.get_advanced_analysis(df)
-        sentiment = {'sentiment': 'Greed', 'score': 65, 'color': 'warning'}
-        
+        time_frame = request.args.get('time_frame', '30')
+        if time_frame not in ANALYSIS_TIMEFRAMES:
+            return jsonify({
+                'success': False,
+                'error': f"time_frame must be one of {', '.join(ANALYSIS_TIMEFRAMES)}",
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        snapshot = analysis_snapshots.get(time_frame)
+        if snapshot is None:
+            return jsonify({
+                'success': False,
+                'error': analysis_snapshots.unavailable_reason(time_frame),
+                'timestamp': datetime.now().isoformat()
+            }), 503
+        
+        headers = analysis_snapshots.cache_headers(snapshot)
+        if snapshot.matches(request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')):
+            return app.response_class(status=304, headers=headers)  # nothing rendered or serialized
+        
+        body = snapshot.response_body(success=True, timestamp=datetime.now().isoformat(),
+                                      **analysis_snapshots.describe(snapshot))
+        return app.response_class(body, mimetype='application/json', headers=headers)
+    except Exception as e:
         return jsonify({
-            'success': True,
-            'timestamp': datetime.now().isoformat(),
-            'analysis': analysis,
-            'sentiment': sentiment
+            'success': False, 
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
         })
+
+@app.route('/api/batch_analysis', methods=['POST'])
+def api_batch_analysis():
+    """Many account scenarios in one call: one snapshot per distinct timeframe, position sizing per scenario"""
+    try:
+        scenarios = parse_scenarios(request.get_json(silent=True), ANALYSIS_TIMEFRAMES, 'technical')
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    try:
+        # The market analysis is shared by every scenario on the same timeframe
+        snapshots = {}
+        for time_frame in sorted({scenario['time_frame'] for scenario in scenarios}, key=int):
+            snapshot = analysis_snapshots.get(time_frame)
+            if snapshot is None:
+                return jsonify({
+                    'success': False,
+                    'error': analysis_snapshots.unavailable_reason(time_frame),
+                    'timestamp': datetime.now().isoformat()
+                }), 503
+            snapshots[time_frame] = snapshot
+        
+        results = []
+        for scenario in scenarios:
+            current_price = snapshots[scenario['time_frame']].payload['analysis']['current_price']
+            position_sizing = advanced_bot.calculate_position_sizing(
+                current_price, scenario['account_balance'], scenario['risk_per_trade']
+            )
+            results.append({**scenario, 'position_sizing': position_sizing})
+        
+        body = analysis_snapshots.batch_body(snapshots, results, success=True,
+                                             timestamp=datetime.now().isoformat(), scenarios=len(results))
+        return app.response_class(body, mimetype='application/json')
     except Exception as e:
         return jsonify({
             'success': False, 
@@ -1149,6 +1215,24 @@ def api_advanced_analysis():
             'timestamp': datetime.now().isoformat()
         })
 
+@app.route('/api/stream')
+def api_stream():
+    """Server-sent events: a compact 'signal' event whenever a timeframe's recommendation, confidence, RSI or price changes"""
+    time_frames = request.args.getlist('time_frame')
+    unsupported = [time_frame for time_frame in time_frames if time_frame not in ANALYSIS_TIMEFRAMES]
+    if unsupported:
+        return jsonify({
+            'success': False,
+            'error': f"unsupported time_frame {', '.join(unsupported)}; use one of {', '.join(ANALYSIS_TIMEFRAMES)}",
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    # Events are produced by the snapshot refresher; a connection only forwards them
+    analysis_snapshots.start()
+    events = signal_events.subscribe(time_frames, request.headers.get('Last-Event-ID'))
+    return app.response_class(events, mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/health')
 def health_check():
     return jsonify({
@@ -1165,6 +1249,7 @@ if __name__ == '__main__':
     print("🤖 Enhanced with Machine Learning & Multi-Timeframe Analysis")
     print("📊 Web Interface: http://localhost:5000")
     print("🔗 Advanced API:  http://localhost:5000/api/advanced_analysis")
+    print("📡 Live Signals:  http://localhost:5000/api/stream")
     print("❤️  Health Check:  http://localhost:5000/health")
     print("=" * 60)
     print("⚠️  IMPORTANT: This is for EDUCATIONAL PURPOSES only!")
@@ -5,7 +5,6 @@ import time
 import json
 from datetime import datetime, timedelta
 from collections import deque
-import urllib.request
 import urllib.error
 import math
 import random
@@ -13,6 +12,10 @@ import logging
 import sys
 from typing import Optional, Tuple, List, Dict, Any
 
+from market_data import (PriceFanout, SourceHealthTracker, request_scheduler, http_client,
+                         clock, configure_record_replay, RateLimited)
+from indicators import StreamingRSI, RollingWindowStats, RollingExtremum
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -31,12 +34,18 @@ class DataManager:
         self.consecutive_errors = 0
         self.max_retries = 3
         self.cache_duration = 30  # seconds
+        # Latency/error scores and circuit breaker per data source
+        self.source_health = SourceHealthTracker(scheduler=request_scheduler)
+        self.price_fanout = PriceFanout(quorum=2, budget=4.0, health=self.source_health)
         
     def fetch_with_retry(self, fetch_function, description="data"):
         """Fetch data with retry logic and error handling"""
         for attempt in range(self.max_retries):
+            if not self.source_health.allow(description):
+                logging.info(f"Skipping {description} - circuit open or out of request budget")
+                break
             try:
-                result = fetch_function()
+                result = self.source_health.call(description, fetch_function)
                 if result is not None and result > 0:
                     self.consecutive_errors = 0
                     self.last_successful_fetch = datetime.now()
@@ -48,6 +57,20 @@ class DataManager:
         self.consecutive_errors += 1
         logging.error(f"All retries failed for {description}")
         return None
+        
+    def fetch_from_sources(self, sources, validate=None):
+        """Query every source in parallel and combine the first quorum that agrees"""
+        price = self.price_fanout.fetch(sources, validate)
+        if price is None:
+            self.consecutive_errors += 1
+            logging.error("All data sources failed")
+            return None
+        
+        self.consecutive_errors = 0
+        self.last_successful_fetch = datetime.now()
+        logging.info(f"Combined price from {list(self.price_fanout.last_prices)}: ${price:,.2f} "
+                     f"({self.price_fanout.latency_summary()})")
+        return price
 
 class BitcoinPredictor:
     def __init__(self, root):
@@ -74,7 +97,13 @@ class BitcoinPredictor:
         
         # Data storage with validation
         self.price_history = deque(maxlen=200)  # Increased for better analysis
+        # Rolling mean/variance shared by the SMA and Bollinger calculations
+        self.rolling_stats = RollingWindowStats((10, 20, 30, 50))
+        # 20-price high/low window behind the support/resistance levels
+        self.price_range = RollingExtremum(20)
         self.volume_history = deque(maxlen=200)
+        # Wilder RSI state per period, advanced once per appended price
+        self.rsi_states = {14: StreamingRSI(14)}
         self.current_price = 0
         self.price_change = 0
         self.change_percentage = 0
@@ -515,46 +544,21 @@ class BitcoinPredictor:
             ("CryptoCompare", self.get_cryptocompare_data)
         ]
         
-        prices = []
-        successful_sources = []
-        
-        for source_name, source_func in sources:
-            try:
-                price = self.data_manager.fetch_with_retry(
-                    source_func, f"{source_name} price"
-                )
-                if price and self.validate_price_data(price):
-                    prices.append(price)
-                    successful_sources.append(source_name)
-                    logging.info(f"Successfully fetched from {source_name}: ${price:,.2f}")
-                    
-                    if len(prices) >= 2:  # We have enough reliable sources
-                        break
-            except Exception as e:
-                logging.warning(f"Failed to fetch from {source_name}: {e}")
-                continue
-        
-        if prices:
-            # Weighted average favoring more reliable sources
-            weighted_price = sum(prices) / len(prices)
-            logging.info(f"Combined price from {successful_sources}: ${weighted_price:,.2f}")
-            return weighted_price
-        
-        logging.error("All data sources failed")
-        return None
+        # All sources race within one latency budget; two agreeing prices settle the tick
+        return self.data_manager.fetch_from_sources(sources, validate=self.validate_price_data)
     
     def get_binance_data(self) -> Optional[float]:
         """Fetch data from Binance API with enhanced error handling"""
         try:
             url = "https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT"
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
-                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+                timeout=10
             )
-            with urllib.request.urlopen(req, timeout=10) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    return float(data['price'])
+            return float(data['price'])
+        except RateLimited:
+            raise
         except urllib.error.URLError as e:
             logging.warning(f"Binance URL error: {e}")
         except json.JSONDecodeError as e:
@@ -567,14 +571,14 @@ class BitcoinPredictor:
         """Fetch data from CoinGecko API"""
         try:
             url = "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd"
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
-                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+                timeout=10
             )
-            with urllib.request.urlopen(req, timeout=10) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    return data['bitcoin']['usd']
+            return data['bitcoin']['usd']
+        except RateLimited:
+            raise
         except Exception as e:
             logging.warning(f"CoinGecko error: {e}")
         return None
@@ -583,14 +587,14 @@ class BitcoinPredictor:
         """Fetch data from CryptoCompare API"""
         try:
             url = "https://min-api.cryptocompare.com/data/price?fsym=BTC&tsyms=USD"
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
-                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+                timeout=10
             )
-            with urllib.request.urlopen(req, timeout=10) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    return data['USD']
+            return data['USD']
+        except RateLimited:
+            raise
         except Exception as e:
             logging.warning(f"CryptoCompare error: {e}")
         return None
@@ -722,7 +726,7 @@ class BitcoinPredictor:
         if len(self.price_history) < period:
             return None
         try:
-            return sum(list(self.price_history)[-period:]) / period
+            return self.rolling_stats.mean(period)
         except Exception as e:
             logging.warning(f"SMA calculation error: {e}")
             return None
@@ -761,36 +765,25 @@ class BitcoinPredictor:
             logging.warning(f"MACD calculation error: {e}")
             return None, None, None
     
+    def add_price(self, price):
+        """Append a price to the history and advance the streaming indicators"""
+        self.price_history.append(price)
+        self.rolling_stats.update(price)
+        self.price_range.update(price)
+        for state in self.rsi_states.values():
+            state.update(price)
+    
     def calculate_rsi(self, period=14):
         if len(self.price_history) < period + 1:
             return None
         
         try:
-            prices = list(self.price_history)
-            gains = []
-            losses = []
-            
-            for i in range(1, len(prices)):
-                change = prices[i] - prices[i-1]
-                if change > 0:
-                    gains.append(change)
-                    losses.append(0)
-                else:
-                    gains.append(0)
-                    losses.append(abs(change))
-            
-            if len(gains) < period:
-                return None
-            
-            avg_gain = sum(gains[-period:]) / period
-            avg_loss = sum(losses[-period:]) / period
-            
-            if avg_loss == 0:
-                return 100
-            
-            rs = avg_gain / avg_loss
-            rsi = 100 - (100 / (1 + rs))
-            return rsi
+            state = self.rsi_states.get(period)
+            if state is None:
+                # First request for this period - replay the history once
+                state = StreamingRSI.from_prices(list(self.price_history), period)
+                self.rsi_states[period] = state
+            return state.value
         except Exception as e:
             logging.warning(f"RSI calculation error: {e}")
             return None
@@ -800,16 +793,7 @@ class BitcoinPredictor:
             return None, None, None
         
         try:
-            prices = list(self.price_history)[-period:]
-            middle_band = sum(prices) / period
-            
-            variance = sum((x - middle_band) ** 2 for x in prices) / period
-            std_dev = math.sqrt(variance)
-            
-            upper_band = middle_band + (std_dev * 2)
-            lower_band = middle_band - (std_dev * 2)
-            
-            return upper_band, middle_band, lower_band
+            return self.rolling_stats.bollinger_bands(period)
         except Exception as e:
             logging.warning(f"Bollinger Bands calculation error: {e}")
             return None, None, None
@@ -819,10 +803,9 @@ class BitcoinPredictor:
             return [], []
         
         try:
-            prices = list(self.price_history)
-            recent_high = max(prices[-20:])
-            recent_low = min(prices[-20:])
-            current_price = prices[-1]
+            recent_high = self.price_range.max
+            recent_low = self.price_range.min
+            current_price = self.price_history[-1]
             
             support1 = recent_low
             support2 = recent_low - (recent_high - recent_low) * 0.1
@@ -1240,7 +1223,8 @@ class BitcoinPredictor:
             success_rate = (self.successful_updates / (self.successful_updates + self.failed_updates)) * 100 if (self.successful_updates + self.failed_updates) > 0 else 0
             
             self.performance_var.set(
-                f"Uptime: {uptime_str} | Success: {self.successful_updates} | Failed: {self.failed_updates} | Rate: {success_rate:.1f}%"
+                f"Uptime: {uptime_str} | Success: {self.successful_updates} | Failed: {self.failed_updates} | Rate: {success_rate:.1f}% | "
+                f"{self.data_manager.source_health.summary()}"
             )
         except Exception as e:
             logging.warning(f"Performance metrics update error: {e}")
@@ -1303,7 +1287,7 @@ class BitcoinPredictor:
         error_count = 0
         max_consecutive_errors = 10
         
-        while self.running:
+        while self.running and not clock.finished:
             try:
                 new_price = self.fetch_bitcoin_data()
                 
@@ -1314,7 +1298,7 @@ class BitcoinPredictor:
                         self.price_change = new_price - previous_price
                         self.change_percentage = (self.price_change / previous_price) * 100
                     
-                    self.price_history.append(new_price)
+                    self.add_price(new_price)
                     previous_price = new_price
                     error_count = 0
                     
@@ -1334,16 +1318,18 @@ class BitcoinPredictor:
                             self.current_price = simulated_price
                             self.price_change = simulated_price - previous_price
                             self.change_percentage = (self.price_change / previous_price) * 100
-                            self.price_history.append(simulated_price)
+                            self.add_price(simulated_price)
                             self.root.after(0, self.update_display)
                             logging.warning("Using simulated data due to API failures")
                 
-                time.sleep(5)  # Increased delay to respect API rate limits
+                clock.sleep(5)  # Increased delay to respect API rate limits
                 
             except Exception as e:
                 error_count += 1
                 logging.error(f"Data loop error: {e}")
-                time.sleep(10)  # Longer delay on error
+                clock.sleep(10)  # Longer delay on error
+        if clock.finished:
+            logging.info("Replay finished")
     
     def schedule_health_check(self):
         """Schedule periodic health checks"""
@@ -1357,6 +1343,7 @@ class BitcoinPredictor:
                     f"Failed updates: {self.failed_updates}, "
                     f"Price history: {len(self.price_history)}"
                 )
+                logging.info(f"Source health - {self.data_manager.source_health.summary()}")
                 
                 # Check if UI is responsive
                 if self.root.winfo_exists():
@@ -1399,6 +1386,9 @@ class BitcoinPredictor:
 def main():
     """Main application entry point"""
     try:
+        replay_mode = configure_record_replay()
+        if replay_mode:
+            logging.info(replay_mode)
         root = tk.Tk()
         app = BitcoinPredictor(root)
         root.protocol("WM_DELETE_WINDOW", app.on_closing)
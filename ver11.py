@@ -2,10 +2,8 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
 import time
-import json
 from datetime import datetime, timedelta, timezone
 from collections import deque
-import urllib.request
 import urllib.error
 import math
 import random
@@ -14,6 +12,9 @@ import sys
 from typing import Optional, Tuple, List, Dict, Any
 import numpy as np
 
+from market_data import PriceFanout, SourceHealthTracker, request_scheduler, http_client, BarAggregator, fetch_binance_bars, RateLimited
+from indicators import RollingWindowStats, EMABank, RollingExtremum, StreamingATR, atr_series
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -138,14 +139,8 @@ class AdvancedIndicators:
             return None
         
         try:
-            true_ranges = []
-            for i in range(1, len(high_prices)):
-                tr1 = high_prices[i] - low_prices[i]
-                tr2 = abs(high_prices[i] - close_prices[i-1])
-                tr3 = abs(low_prices[i] - close_prices[i-1])
-                true_ranges.append(max(tr1, tr2, tr3))
-            
-            return sum(true_ranges[-period:]) / period
+            atr = atr_series(high_prices, low_prices, close_prices, period, method='simple')
+            return float(atr[-1])
         except Exception as e:
             logging.warning(f"ATR calculation error: {e}")
             return None
@@ -186,6 +181,10 @@ class DataManager:
         self.consecutive_errors = 0
         self.max_retries = 3
         self.cache_duration = 30
+        # Latency/error scores and circuit breaker per data source
+        self.source_health = SourceHealthTracker(scheduler=request_scheduler)
+        # Either source alone is trusted, so the first valid answer wins the race
+        self.price_fanout = PriceFanout(quorum=1, budget=10.0, health=self.source_health)
         
         # Initialize advanced components
         self.strategies = TradingStrategies()
@@ -195,8 +194,11 @@ class DataManager:
     def fetch_with_retry(self, fetch_function, description="data"):
         """Fetch data with retry logic and error handling"""
         for attempt in range(self.max_retries):
+            if not self.source_health.allow(description):
+                logging.info(f"Skipping {description} - circuit open or out of request budget")
+                break
             try:
-                result = fetch_function()
+                result = self.source_health.call(description, fetch_function)
                 if result is not None and result > 0:
                     self.consecutive_errors = 0
                     self.last_successful_fetch = datetime.now(timezone.utc)
@@ -208,6 +210,20 @@ class DataManager:
         self.consecutive_errors += 1
         logging.error(f"All retries failed for {description}")
         return None
+        
+    def fetch_from_sources(self, sources, validate=None):
+        """Query every source in parallel and combine the first quorum that agrees"""
+        price = self.price_fanout.fetch(sources, validate)
+        if price is None:
+            self.consecutive_errors += 1
+            logging.error("All data sources failed")
+            return None
+        
+        self.consecutive_errors = 0
+        self.last_successful_fetch = datetime.now(timezone.utc)
+        logging.info(f"Combined price from {list(self.price_fanout.last_prices)}: ${price:,.2f} "
+                     f"({self.price_fanout.latency_summary()})")
+        return price
 
 class BitcoinPredictor:
     def __init__(self, root):
@@ -224,9 +240,20 @@ class BitcoinPredictor:
         
         # Enhanced data storage
         self.price_history = deque(maxlen=500)
+        # Rolling mean/variance behind the Bollinger Band calculation
+        self.rolling_stats = RollingWindowStats((20,))
+        # 20-price high/low window behind the support/resistance levels
+        self.price_range = RollingExtremum(20)
+        # Every EMA the predictor reads, advanced together once per price
+        self.ema_bank = EMABank((9, 10, 12, 20, 26, 30, 50, 200))
         self.volume_history = deque(maxlen=500)
         self.high_history = deque(maxlen=500)
         self.low_history = deque(maxlen=500)
+        # ATR over the high/low/close bars, advanced once per bar
+        self.atr_state = StreamingATR(14, method='simple')
+        # Real 5m OHLC bars built from the timestamped polls feed the histories above
+        self.bars = BarAggregator(('5m',), max_bars=500)
+        self.bars.on_close(self.on_bar_close)
         
         self.current_price = 0
         self.price_change = 0
@@ -652,15 +679,8 @@ class BitcoinPredictor:
 
     def calculate_atr_targets(self):
         """Calculate targets using ATR"""
-        if len(self.high_history) < 15 or len(self.low_history) < 15 or len(self.price_history) < 15:
-            return self.current_price * 1.03, self.current_price * 0.98
-        
         try:
-            atr = self.data_manager.indicators.calculate_atr(
-                list(self.high_history)[-15:],
-                list(self.low_history)[-15:],
-                list(self.price_history)[-15:]
-            )
+            atr = self.atr_state.value
             
             if atr is None:
                 return self.current_price * 1.03, self.current_price * 0.98
@@ -712,10 +732,14 @@ class BitcoinPredictor:
             self.advanced_indicators['news_sentiment'] = news_sentiment
             self.advanced_indicators['news_items'] = news_items
             
-            # EMA trend
-            ema_20 = self.calculate_ema(20)
-            ema_50 = self.calculate_ema(50)
-            if ema_20 is not None and ema_50 is not None:
+            # EMA trend - 50/200 crossover once enough history, 20/50 until then
+            ema_20 = self.ema_bank.get(20)
+            ema_50 = self.ema_bank.get(50)
+            ema_200 = self.ema_bank.get(200)
+            self.advanced_indicators['ema_200'] = ema_200
+            if ema_50 is not None and ema_200 is not None:
+                self.advanced_indicators['ema_trend'] = 'bullish' if ema_50 > ema_200 else 'bearish'
+            elif ema_20 is not None and ema_50 is not None:
                 self.advanced_indicators['ema_trend'] = 'bullish' if ema_20 > ema_50 else 'bearish'
             else:
                 self.advanced_indicators['ema_trend'] = None
@@ -1019,6 +1043,8 @@ class BitcoinPredictor:
         if len(self.price_history) < period:
             return None
         try:
+            if period in self.ema_bank:
+                return self.ema_bank.get(period)
             return self.data_manager.indicators.calculate_ema(list(self.price_history), period)
         except Exception as e:
             logging.warning(f"EMA calculation error: {e}")
@@ -1059,22 +1085,20 @@ class BitcoinPredictor:
             logging.warning(f"RSI calculation error: {e}")
             return None
 
+    def add_price(self, price):
+        """Append a price to the history and advance the streaming indicators"""
+        self.price_history.append(price)
+        self.rolling_stats.update(price)
+        self.price_range.update(price)
+        self.ema_bank.update(price)
+    
     def calculate_bollinger_bands(self, period=20):
         """Calculate Bollinger Bands"""
         if len(self.price_history) < period:
             return None, None, None
         
         try:
-            prices = list(self.price_history)[-period:]
-            middle_band = sum(prices) / period
-            
-            variance = sum((x - middle_band) ** 2 for x in prices) / period
-            std_dev = math.sqrt(variance)
-            
-            upper_band = middle_band + (std_dev * 2)
-            lower_band = middle_band - (std_dev * 2)
-            
-            return upper_band, middle_band, lower_band
+            return self.rolling_stats.bollinger_bands(period)
         except Exception as e:
             logging.warning(f"Bollinger Bands calculation error: {e}")
             return None, None, None
@@ -1103,10 +1127,9 @@ class BitcoinPredictor:
             return [], []
         
         try:
-            prices = list(self.price_history)
-            recent_high = max(prices[-20:])
-            recent_low = min(prices[-20:])
-            current_price = prices[-1]
+            recent_high = self.price_range.max
+            recent_low = self.price_range.min
+            current_price = self.price_history[-1]
             
             support1 = recent_low
             support2 = recent_low - (recent_high - recent_low) * 0.1
@@ -1238,7 +1261,8 @@ class BitcoinPredictor:
             success_rate = (self.successful_updates / (self.successful_updates + self.failed_updates)) * 100 if (self.successful_updates + self.failed_updates) > 0 else 0
             
             self.performance_var.set(
-                f"Uptime: {uptime_str} | Success: {self.successful_updates} | Failed: {self.failed_updates} | Rate: {success_rate:.1f}%"
+                f"Uptime: {uptime_str} | Success: {self.successful_updates} | Failed: {self.failed_updates} | Rate: {success_rate:.1f}% | "
+                f"{self.data_manager.source_health.summary()}"
             )
         except Exception as e:
             logging.warning(f"Performance metrics update error: {e}")
@@ -1252,77 +1276,85 @@ class BitcoinPredictor:
             ("Binance", self.fetch_binance_data),
         ]
         
-        for source_name, fetch_func in sources:
-            try:
-                price = fetch_func()
-                if price and price > 0:
-                    logging.info(f"Successfully fetched from {source_name}: ${price:,.2f}")
-                    
-                    # Update price change
-                    if self.price_history:
-                        previous_price = self.price_history[-1]
-                        self.price_change = price - previous_price
-                        self.change_percentage = (self.price_change / previous_price) * 100
-                    
-                    self.current_price = price
-                    self.price_history.append(price)
-                    
-                    # Simulate OHLC data for demonstration
-                    if len(self.price_history) > 1:
-                        high_price = max(self.price_history[-2], price)
-                        low_price = min(self.price_history[-2], price)
-                        volume = random.uniform(1000000, 50000000)
-                        
-                        self.high_history.append(high_price)
-                        self.low_history.append(low_price)
-                        self.volume_history.append(volume)
-                    
-                    self.data_manager.consecutive_errors = 0
-                    return True
-                    
-            except Exception as e:
-                logging.warning(f"Failed to fetch from {source_name}: {e}")
-                continue
-        
-        # All sources failed
-        self.data_manager.consecutive_errors += 1
+        price = self.data_manager.fetch_from_sources(sources)
+        if price:
+            # Update price change
+            if self.price_history:
+                previous_price = self.price_history[-1]
+                self.price_change = price - previous_price
+                self.change_percentage = (self.price_change / previous_price) * 100
+            
+            self.current_price = price
+            self.add_price(price)
+            self.bars.add_tick(price, time.time())
+            
+            return True
         
         # Use simulated data as last resort
         if self.price_history:
             simulated_change = random.uniform(-0.01, 0.01)
             simulated_price = self.price_history[-1] * (1 + simulated_change)
             self.current_price = simulated_price
-            self.price_history.append(simulated_price)
+            self.add_price(simulated_price)
             logging.warning("Using simulated data due to API failures")
             return True
         
         return False
 
+    def on_bar_close(self, timeframe, bar):
+        """Append a closed 5m bar to the high/low/volume histories and advance the ATR"""
+        self.high_history.append(bar.high)
+        self.low_history.append(bar.low)
+        # Polled quotes carry no traded volume, so live bars take it from the matching Binance kline
+        volume = bar.volume or self.kline_volume(bar.start)
+        if volume > 0:
+            self.volume_history.append(volume)
+        self.atr_state.update(bar.high, bar.low, bar.close)
+
+    def kline_volume(self, start) -> float:
+        """Traded volume of the closed 5m Binance kline opening at `start`, or 0 if it is unavailable"""
+        try:
+            for kline in fetch_binance_bars('5m', limit=3):
+                if abs(kline.start - start) < 1:
+                    return kline.volume
+            logging.warning(f"No closed 5m kline for {datetime.fromtimestamp(start):%H:%M}")
+        except Exception as e:
+            logging.warning(f"Could not fetch 5m kline volume: {e}")
+        return 0.0
+
+    def seed_bars(self):
+        """Warm the 5m bar histories from recent Binance klines"""
+        try:
+            seeded = self.bars.seed('5m', fetch_binance_bars('5m', limit=100))
+            logging.info(f"Seeded {seeded} closed 5m bars")
+        except Exception as e:
+            logging.warning(f"Could not seed 5m bars: {e}")
+
     def fetch_coingecko_data(self):
         """Fetch data from CoinGecko API with better error handling"""
         try:
             url = "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd"
             
             # Add headers to avoid 429 errors
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
                 headers={
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
                     'Accept': 'application/json'
-                }
+                },
+                timeout=15
             )
             
-            with urllib.request.urlopen(req, timeout=15) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    if 'bitcoin' in data and 'usd' in data['bitcoin']:
-                        return data['bitcoin']['usd']
+            if 'bitcoin' in data and 'usd' in data['bitcoin']:
+                return data['bitcoin']['usd']
             return None
             
+        except RateLimited:
+            raise
         except urllib.error.HTTPError as e:
             if e.code == 429:
-                logging.warning("CoinGecko rate limit exceeded, waiting...")
-                time.sleep(60)  # Wait longer on rate limit
+                # The request scheduler has paused CoinGecko; other sources take the next ticks
+                logging.warning("CoinGecko rate limit exceeded - deferring to other sources")
             return None
         except Exception as e:
             logging.warning(f"CoinGecko fetch error: {e}")
@@ -1333,17 +1365,16 @@ class BitcoinPredictor:
         try:
             url = "https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT"
             
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
-                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+                timeout=15
             )
             
-            with urllib.request.urlopen(req, timeout=15) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    return float(data['price'])
-            return None
+            return float(data['price'])
             
+        except RateLimited:
+            raise
         except Exception as e:
             logging.warning(f"Binance fetch error: {e}")
             return None
@@ -1351,6 +1382,7 @@ class BitcoinPredictor:
     def start_data_fetching(self):
         """Start the data fetching thread"""
         def fetch_loop():
+            self.seed_bars()
             while self.running:
                 try:
                     success = self.fetch_bitcoin_data_enhanced()
@@ -1376,6 +1408,7 @@ class BitcoinPredictor:
                 success_rate = (self.successful_updates / (self.successful_updates + self.failed_updates)) * 100 if (self.successful_updates + self.failed_updates) > 0 else 0
                 
                 logging.info(f"Health check - Uptime: {uptime}, Success rate: {success_rate:.1f}%")
+                logging.info(f"Source health - {self.data_manager.source_health.summary()}")
                 
                 # Schedule next health check
                 self.root.after(300000, health_check)  # Every 5 minutes
@@ -2,10 +2,8 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
 import time
-import json
 from datetime import datetime, timedelta
 from collections import deque
-import urllib.request
 import urllib.error
 import math
 import random
@@ -14,6 +12,9 @@ import sys
 from typing import Optional, Tuple, List, Dict, Any
 import numpy as np
 
+from market_data import SourceHealthTracker, request_scheduler, http_client, RateLimited
+from indicators import RollingWindowStats, RollingExtremum, StreamingATR, atr_series
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -135,14 +136,8 @@ class AdvancedIndicators:
             return None
         
         try:
-            true_ranges = []
-            for i in range(1, len(high_prices)):
-                tr1 = high_prices[i] - low_prices[i]
-                tr2 = abs(high_prices[i] - close_prices[i-1])
-                tr3 = abs(low_prices[i] - close_prices[i-1])
-                true_ranges.append(max(tr1, tr2, tr3))
-            
-            return sum(true_ranges[-period:]) / period
+            atr = atr_series(high_prices, low_prices, close_prices, period, method='simple')
+            return float(atr[-1])
         except Exception as e:
             logging.warning(f"ATR calculation error: {e}")
             return None
@@ -183,6 +178,8 @@ class DataManager:
         self.consecutive_errors = 0
         self.max_retries = 3
         self.cache_duration = 30
+        # Latency/error scores and circuit breaker per data source
+        self.source_health = SourceHealthTracker(scheduler=request_scheduler)
         
         # Initialize advanced components
         self.strategies = TradingStrategies()
@@ -192,8 +189,11 @@ class DataManager:
     def fetch_with_retry(self, fetch_function, description="data"):
         """Fetch data with retry logic and error handling"""
         for attempt in range(self.max_retries):
+            if not self.source_health.allow(description):
+                logging.info(f"Skipping {description} - circuit open or out of request budget")
+                break
             try:
-                result = fetch_function()
+                result = self.source_health.call(description, fetch_function)
                 if result is not None and result > 0:
                     self.consecutive_errors = 0
                     self.last_successful_fetch = datetime.now()
@@ -221,9 +221,15 @@ class BitcoinPredictor:
         
         # Enhanced data storage
         self.price_history = deque(maxlen=500)
+        # Rolling mean/variance behind the Bollinger Band calculation
+        self.rolling_stats = RollingWindowStats((20,))
+        # 20-price high/low window behind the support/resistance levels
+        self.price_range = RollingExtremum(20)
         self.volume_history = deque(maxlen=500)
         self.high_history = deque(maxlen=500)
         self.low_history = deque(maxlen=500)
+        # ATR over the high/low/close bars, advanced once per bar
+        self.atr_state = StreamingATR(14, method='simple')
         
         self.current_price = 0
         self.price_change = 0
@@ -649,15 +655,8 @@ class BitcoinPredictor:
 
     def calculate_atr_targets(self):
         """Calculate targets using ATR"""
-        if len(self.high_history) < 15 or len(self.low_history) < 15 or len(self.price_history) < 15:
-            return self.current_price * 1.03, self.current_price * 0.98
-        
         try:
-            atr = self.data_manager.indicators.calculate_atr(
-                list(self.high_history)[-15:],
-                list(self.low_history)[-15:],
-                list(self.price_history)[-15:]
-            )
+            atr = self.atr_state.value
             
             if atr is None:
                 return self.current_price * 1.03, self.current_price * 0.98
@@ -1043,22 +1042,19 @@ class BitcoinPredictor:
             logging.warning(f"RSI calculation error: {e}")
             return None
 
+    def add_price(self, price):
+        """Append a price to the history and advance the streaming indicators"""
+        self.price_history.append(price)
+        self.rolling_stats.update(price)
+        self.price_range.update(price)
+    
     def calculate_bollinger_bands(self, period=20):
         """Calculate Bollinger Bands"""
         if len(self.price_history) < period:
             return None, None, None
         
         try:
-            prices = list(self.price_history)[-period:]
-            middle_band = sum(prices) / period
-            
-            variance = sum((x - middle_band) ** 2 for x in prices) / period
-            std_dev = math.sqrt(variance)
-            
-            upper_band = middle_band + (std_dev * 2)
-            lower_band = middle_band - (std_dev * 2)
-            
-            return upper_band, middle_band, lower_band
+            return self.rolling_stats.bollinger_bands(period)
         except Exception as e:
             logging.warning(f"Bollinger Bands calculation error: {e}")
             return None, None, None
@@ -1087,10 +1083,9 @@ class BitcoinPredictor:
             return [], []
         
         try:
-            prices = list(self.price_history)
-            recent_high = max(prices[-20:])
-            recent_low = min(prices[-20:])
-            current_price = prices[-1]
+            recent_high = self.price_range.max
+            recent_low = self.price_range.min
+            current_price = self.price_history[-1]
             
             support1 = recent_low
             support2 = recent_low - (recent_high - recent_low) * 0.1
@@ -1210,7 +1205,8 @@ class BitcoinPredictor:
             success_rate = (self.successful_updates / (self.successful_updates + self.failed_updates)) * 100 if (self.successful_updates + self.failed_updates) > 0 else 0
             
             self.performance_var.set(
-                f"Uptime: {uptime_str} | Success: {self.successful_updates} | Failed: {self.failed_updates} | Rate: {success_rate:.1f}%"
+                f"Uptime: {uptime_str} | Success: {self.successful_updates} | Failed: {self.failed_updates} | Rate: {success_rate:.1f}% | "
+                f"{self.data_manager.source_health.summary()}"
             )
         except Exception as e:
             logging.warning(f"Performance metrics update error: {e}")
@@ -1224,9 +1220,12 @@ class BitcoinPredictor:
             ("Binance", self.fetch_binance_data),
         ]
         
-        for source_name, fetch_func in sources:
+        # Fastest healthy source first; open circuits and throttled providers are skipped
+        for source_name, fetch_func in self.data_manager.source_health.rank(sources):
+            if not self.data_manager.source_health.allow(source_name):
+                continue
             try:
-                price = fetch_func()
+                price = self.data_manager.source_health.call(source_name, fetch_func)
                 if price and price > 0:
                     logging.info(f"Successfully fetched from {source_name}: ${price:,.2f}")
                     
@@ -1237,7 +1236,7 @@ class BitcoinPredictor:
                         self.change_percentage = (self.price_change / previous_price) * 100
                     
                     self.current_price = price
-                    self.price_history.append(price)
+                    self.add_price(price)
                     
                     # Simulate OHLC data for demonstration
                     if len(self.price_history) > 1:
@@ -1248,6 +1247,7 @@ class BitcoinPredictor:
                         self.high_history.append(high_price)
                         self.low_history.append(low_price)
                         self.volume_history.append(volume)
+                        self.atr_state.update(high_price, low_price, price)
                     
                     self.data_manager.consecutive_errors = 0
                     return True
@@ -1264,7 +1264,7 @@ class BitcoinPredictor:
             simulated_change = random.uniform(-0.01, 0.01)
             simulated_price = self.price_history[-1] * (1 + simulated_change)
             self.current_price = simulated_price
-            self.price_history.append(simulated_price)
+            self.add_price(simulated_price)
             logging.warning("Using simulated data due to API failures")
             return True
         
@@ -1276,25 +1276,25 @@ class BitcoinPredictor:
             url = "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd"
             
             # Add headers to avoid 429 errors
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
                 headers={
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
                     'Accept': 'application/json'
-                }
+                },
+                timeout=15
             )
             
-            with urllib.request.urlopen(req, timeout=15) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    if 'bitcoin' in data and 'usd' in data['bitcoin']:
-                        return data['bitcoin']['usd']
+            if 'bitcoin' in data and 'usd' in data['bitcoin']:
+                return data['bitcoin']['usd']
             return None
             
+        except RateLimited:
+            raise
         except urllib.error.HTTPError as e:
             if e.code == 429:
-                logging.warning("CoinGecko rate limit exceeded, waiting...")
-                time.sleep(60)  # Wait longer on rate limit
+                # The request scheduler has paused CoinGecko; other sources take the next ticks
+                logging.warning("CoinGecko rate limit exceeded - deferring to other sources")
             return None
         except Exception as e:
             logging.warning(f"CoinGecko fetch error: {e}")
@@ -1305,17 +1305,16 @@ class BitcoinPredictor:
         try:
             url = "https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT"
             
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
-                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+                timeout=15
             )
             
-            with urllib.request.urlopen(req, timeout=15) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    return float(data['price'])
-            return None
+            return float(data['price'])
             
+        except RateLimited:
+            raise
         except Exception as e:
             logging.warning(f"Binance fetch error: {e}")
             return None
@@ -1348,6 +1347,7 @@ class BitcoinPredictor:
                 success_rate = (self.successful_updates / (self.successful_updates + self.failed_updates)) * 100 if (self.successful_updates + self.failed_updates) > 0 else 0
                 
                 logging.info(f"Health check - Uptime: {uptime}, Success rate: {success_rate:.1f}%")
+                logging.info(f"Source health - {self.data_manager.source_health.summary()}")
                 
                 # Schedule next health check
                 self.root.after(300000, health_check)  # Every 5 minutes
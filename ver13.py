@@ -5,7 +5,6 @@ import time
 import json
 from datetime import datetime, timedelta
 from collections import deque
-import urllib.request
 import urllib.error
 import math
 import random
@@ -13,6 +12,11 @@ import logging
 import sys
 from typing import Optional, Tuple, List, Dict, Any
 
+from market_data import (PriceFanout, SourceHealthTracker, request_scheduler, http_client, TickStream,
+                         BINANCE_TRADE_STREAM, parse_binance_trade, BarAggregator, fetch_binance_bars,
+                         clock, configure_record_replay, RateLimited)
+from indicators import StreamingRSI, StreamingMACD, RollingWindowStats, IndicatorCache, memoized_indicator, RollingExtremum
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -31,12 +35,18 @@ class DataManager:
         self.consecutive_errors = 0
         self.max_retries = 3
         self.cache_duration = 30  # seconds
+        # Latency/error scores and circuit breaker per data source
+        self.source_health = SourceHealthTracker(scheduler=request_scheduler)
+        self.price_fanout = PriceFanout(quorum=2, budget=4.0, health=self.source_health)
         
     def fetch_with_retry(self, fetch_function, description="data"):
         """Fetch data with retry logic and error handling"""
         for attempt in range(self.max_retries):
+            if not self.source_health.allow(description):
+                logging.info(f"Skipping {description} - circuit open or out of request budget")
+                break
             try:
-                result = fetch_function()
+                result = self.source_health.call(description, fetch_function)
                 if result is not None and result > 0:
                     self.consecutive_errors = 0
                     self.last_successful_fetch = datetime.now()
@@ -48,6 +58,20 @@ class DataManager:
         self.consecutive_errors += 1
         logging.error(f"All retries failed for {description}")
         return None
+        
+    def fetch_from_sources(self, sources, validate=None):
+        """Query every source in parallel and combine the first quorum that agrees"""
+        price = self.price_fanout.fetch(sources, validate)
+        if price is None:
+            self.consecutive_errors += 1
+            logging.error("All data sources failed")
+            return None
+        
+        self.consecutive_errors = 0
+        self.last_successful_fetch = datetime.now()
+        logging.info(f"Combined price from {list(self.price_fanout.last_prices)}: ${price:,.2f} "
+                     f"({self.price_fanout.latency_summary()})")
+        return price
 
 class BitcoinPredictor:
     def __init__(self, root):
@@ -67,8 +91,8 @@ class BitcoinPredictor:
         self.max_valid_price = 1000000  # Maximum reasonable BTC price
         
         # RSI Strategy variables
-        self.rsi_5m = 0
-        self.rsi_15m = 0
+        self.rsi_5m = None  # advanced on each closed 5m/15m bar
+        self.rsi_15m = None
         self.rsi_30 = False  # RSI below 30 flag
         self.green_candle_confirmed = False
         self.bullish_5m = False
@@ -83,7 +107,21 @@ class BitcoinPredictor:
         
         # Data storage with validation
         self.price_history = deque(maxlen=200)  # Increased for better analysis
+        # Rolling mean/variance shared by the SMA and Bollinger calculations
+        self.rolling_stats = RollingWindowStats((10, 20, 30, 50))
+        # 20-price high/low window behind the support/resistance levels
+        self.price_range = RollingExtremum(20)
+        # Per-tick memo of indicator results, invalidated by add_price
+        self.indicator_cache = IndicatorCache()
         self.volume_history = deque(maxlen=200)
+        # Wilder RSI state per period, advanced once per appended price
+        self.rsi_states = {14: StreamingRSI(14)}
+        self.macd_state = StreamingMACD(12, 26, 9)
+        # Real 1m/5m/15m OHLCV bars built from the timestamped ticks; the
+        # RSI strategy advances once per closed bar of its own timeframe
+        self.bars = BarAggregator(('1m', '5m', '15m'))
+        self.bar_rsi = {'5m': StreamingRSI(14), '15m': StreamingRSI(14)}
+        self.bars.on_close(self.on_bar_close)
         self.current_price = 0
         self.price_change = 0
         self.change_percentage = 0
@@ -108,6 +146,12 @@ class BitcoinPredictor:
         self.failed_updates = 0
         
         self.setup_ui()
+        # Newest price pushed by the trade stream (or its polling fallback)
+        self.tick_stream = None
+        self.latest_tick = None
+        self.latest_tick_at = 0.0
+        self.last_price_paint = 0.0
+        
         self.running = True
         self.start_data_fetching()
         
@@ -576,48 +620,23 @@ class BitcoinPredictor:
             ("CryptoCompare", self.get_cryptocompare_data)
         ]
         
-        prices = []
-        successful_sources = []
-        
-        for source_name, source_func in sources:
-            try:
-                price = self.data_manager.fetch_with_retry(
-                    source_func, f"{source_name} price"
-                )
-                if price and self.validate_price_data(price):
-                    prices.append(price)
-                    successful_sources.append(source_name)
-                    logging.info(f"Successfully fetched from {source_name}: ${price:,.2f}")
-                    
-                    if len(prices) >= 2:  # We have enough reliable sources
-                        break
-            except Exception as e:
-                logging.warning(f"Failed to fetch from {source_name}: {e}")
-                continue
-        
-        if prices:
-            # Weighted average favoring more reliable sources
-            weighted_price = sum(prices) / len(prices)
-            logging.info(f"Combined price from {successful_sources}: ${weighted_price:,.2f}")
-            return weighted_price
-        
-        logging.error("All data sources failed")
-        return None
+        # All sources race within one latency budget; two agreeing prices settle the tick
+        return self.data_manager.fetch_from_sources(sources, validate=self.validate_price_data)
 
     def get_bybit_data(self) -> Optional[float]:
         """Fetch data from Bybit API - PRIMARY DATA SOURCE"""
         try:
             # Bybit public endpoint for BTCUSDT perpetual
             url = "https://api.bybit.com/v2/public/tickers?symbol=BTCUSDT"
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
-                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+                timeout=10
             )
-            with urllib.request.urlopen(req, timeout=10) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    if data['ret_code'] == 0 and len(data['result']) > 0:
-                        return float(data['result'][0]['last_price'])
+            if data['ret_code'] == 0 and len(data['result']) > 0:
+                return float(data['result'][0]['last_price'])
+        except RateLimited:
+            raise
         except urllib.error.URLError as e:
             logging.warning(f"Bybit URL error: {e}")
         except json.JSONDecodeError as e:
@@ -630,14 +649,14 @@ class BitcoinPredictor:
         """Fetch data from CoinGecko API"""
         try:
             url = "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd"
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
-                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+                timeout=10
             )
-            with urllib.request.urlopen(req, timeout=10) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    return data['bitcoin']['usd']
+            return data['bitcoin']['usd']
+        except RateLimited:
+            raise
         except Exception as e:
             logging.warning(f"CoinGecko error: {e}")
         return None
@@ -646,14 +665,14 @@ class BitcoinPredictor:
         """Fetch data from CryptoCompare API"""
         try:
             url = "https://min-api.cryptocompare.com/data/price?fsym=BTC&tsyms=USD"
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
-                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+                timeout=10
             )
-            with urllib.request.urlopen(req, timeout=10) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    return data['USD']
+            return data['USD']
+        except RateLimited:
+            raise
         except Exception as e:
             logging.warning(f"CryptoCompare error: {e}")
         return None
@@ -663,25 +682,10 @@ class BitcoinPredictor:
     def check_rsi_strategy(self):
         """Check RSI 30 strategy conditions"""
         try:
-            # Calculate RSI for different timeframes
-            self.rsi_5m = self.calculate_rsi(10)  # Shorter period for 5min
-            self.rsi_15m = self.calculate_rsi(14)  # Standard period for 15min
-            
+            # RSI, candle and trend flags are refreshed by on_bar_close
             # Check RSI < 30 condition
             rsi_condition = self.rsi_5m is not None and self.rsi_5m < 30
             
-            # Check green candle (price increased in last period)
-            if len(self.price_history) >= 2:
-                current_price = self.price_history[-1]
-                previous_price = self.price_history[-2]
-                self.green_candle_confirmed = current_price > previous_price
-            else:
-                self.green_candle_confirmed = False
-            
-            # Check bullish trends (simplified - using moving averages)
-            self.bullish_5m = self.is_bullish_trend(5)
-            self.bullish_15m = self.is_bullish_trend(15)
-            
             # All conditions met for buy signal
             self.buy_signal_active = (rsi_condition and 
                                     self.green_candle_confirmed and 
@@ -694,13 +698,28 @@ class BitcoinPredictor:
         except Exception as e:
             logging.warning(f"RSI strategy check error: {e}")
     
-    def is_bullish_trend(self, lookback_period):
-        """Check if trend is bullish for given lookback period"""
-        if len(self.price_history) < lookback_period + 1:
+    def on_bar_close(self, timeframe, bar):
+        """Advance the per-timeframe strategy inputs once per closed bar (tick thread)"""
+        if timeframe == '1m':
+            self.volume_history.append(bar.volume)
+            return
+        state = self.bar_rsi[timeframe]
+        state.update(bar.close)
+        if timeframe == '5m':
+            self.rsi_5m = state.value
+            self.green_candle_confirmed = bar.green
+            self.bullish_5m = self.is_bullish_trend('5m', 5)
+        else:
+            self.rsi_15m = state.value
+            self.bullish_15m = self.is_bullish_trend('15m', 5)
+    
+    def is_bullish_trend(self, timeframe, lookback_period):
+        """Check if the last `lookback_period` closed bars of `timeframe` trend up"""
+        prices = self.bars.closes(timeframe)[-(lookback_period + 1):]
+        if len(prices) < lookback_period + 1:
             return False
         
         try:
-            prices = list(self.price_history)[-lookback_period:]
             # Simple trend: more up moves than down moves
             up_moves = 0
             for i in range(1, len(prices)):
@@ -804,11 +823,16 @@ class BitcoinPredictor:
             return "Neutral ➡️", "yellow"
     
     def calculate_volume_trend(self) -> float:
-        """Calculate volume trend (simulated for now)"""
+        """Traded volume of the last 5 one-minute bars relative to the 5 before"""
         if len(self.volume_history) < 10:
             return 0
-        return random.uniform(-0.5, 0.5)  # Simulated volume analysis
+        volumes = list(self.volume_history)[-10:]
+        earlier = sum(volumes[:5])
+        if earlier == 0:
+            return 0
+        return max(-0.5, min(0.5, sum(volumes[5:]) / earlier - 1))
     
+    @memoized_indicator
     def calculate_trend_strength(self) -> Tuple[float, str]:
         """Calculate how strong the current trend is"""
         if len(self.price_history) < 20:
@@ -834,6 +858,7 @@ class BitcoinPredictor:
         else:
             return strength_score, "Weak"
     
+    @memoized_indicator
     def calculate_volatility(self) -> str:
         """Calculate market volatility with enhanced logic"""
         if len(self.price_history) < 15:
@@ -886,15 +911,17 @@ class BitcoinPredictor:
         except Exception as e:
             logging.warning(f"Position calculation error: {e}")
     
+    @memoized_indicator
     def calculate_sma(self, period):
         if len(self.price_history) < period:
             return None
         try:
-            return sum(list(self.price_history)[-period:]) / period
+            return self.rolling_stats.mean(period)
         except Exception as e:
             logging.warning(f"SMA calculation error: {e}")
             return None
     
+    @memoized_indicator
     def calculate_ema(self, period):
         if len(self.price_history) < period:
             return None
@@ -912,85 +939,62 @@ class BitcoinPredictor:
             logging.warning(f"EMA calculation error: {e}")
             return None
     
+    @memoized_indicator
     def calculate_macd(self):
         try:
-            ema_12 = self.calculate_ema(12)
-            ema_26 = self.calculate_ema(26)
-            
-            if ema_12 is None or ema_26 is None:
-                return None, None, None
-            
-            macd_line = ema_12 - ema_26
-            signal_line = self.calculate_ema(9)  # Typically EMA of MACD
-            histogram = macd_line - signal_line if signal_line else None
-            
-            return macd_line, signal_line, histogram
+            # Signal line is the 9-EMA of the MACD line, kept up to date by add_price
+            state = self.macd_state
+            return state.macd_line, state.signal_line, state.histogram
         except Exception as e:
             logging.warning(f"MACD calculation error: {e}")
             return None, None, None
     
+    def add_price(self, price):
+        """Append a price to the history and advance the streaming indicators"""
+        self.price_history.append(price)
+        self.rolling_stats.update(price)
+        self.price_range.update(price)
+        for state in self.rsi_states.values():
+            state.update(price)
+        self.macd_state.update(price)
+        self.indicator_cache.invalidate()
+    
+    @memoized_indicator
     def calculate_rsi(self, period=14):
         if len(self.price_history) < period + 1:
             return None
         
         try:
-            prices = list(self.price_history)
-            gains = []
-            losses = []
-            
-            for i in range(1, len(prices)):
-                change = prices[i] - prices[i-1]
-                if change > 0:
-                    gains.append(change)
-                    losses.append(0)
-                else:
-                    gains.append(0)
-                    losses.append(abs(change))
-            
-            if len(gains) < period:
-                return None
-            
-            avg_gain = sum(gains[-period:]) / period
-            avg_loss = sum(losses[-period:]) / period
-            
-            if avg_loss == 0:
-                return 100
-            
-            rs = avg_gain / avg_loss
-            rsi = 100 - (100 / (1 + rs))
-            return rsi
+            state = self.rsi_states.get(period)
+            if state is None:
+                # First request for this period - replay the history once
+                state = StreamingRSI.from_prices(list(self.price_history), period)
+                self.rsi_states[period] = state
+            return state.value
         except Exception as e:
             logging.warning(f"RSI calculation error: {e}")
             return None
     
+    @memoized_indicator
     def calculate_bollinger_bands(self, period=20):
         if len(self.price_history) < period:
             return None, None, None
         
         try:
-            prices = list(self.price_history)[-period:]
-            middle_band = sum(prices) / period
-            
-            variance = sum((x - middle_band) ** 2 for x in prices) / period
-            std_dev = math.sqrt(variance)
-            
-            upper_band = middle_band + (std_dev * 2)
-            lower_band = middle_band - (std_dev * 2)
-            
-            return upper_band, middle_band, lower_band
+            return self.rolling_stats.bollinger_bands(period)
         except Exception as e:
             logging.warning(f"Bollinger Bands calculation error: {e}")
             return None, None, None
     
+    @memoized_indicator
     def calculate_support_resistance(self):
         if len(self.price_history) < 20:
             return [], []
         
         try:
-            prices = list(self.price_history)
-            recent_high = max(prices[-20:])
-            recent_low = min(prices[-20:])
-            current_price = prices[-1]
+            recent_high = self.price_range.max
+            recent_low = self.price_range.min
+            current_price = self.price_history[-1]
             
             support1 = recent_low
             support2 = recent_low - (recent_high - recent_low) * 0.1
@@ -1420,11 +1424,14 @@ class BitcoinPredictor:
             success_rate = (self.successful_updates / (self.successful_updates + self.failed_updates)) * 100 if (self.successful_updates + self.failed_updates) > 0 else 0
             
             self.performance_var.set(
-                f"Uptime: {uptime_str} | Success: {self.successful_updates} | Failed: {self.failed_updates} | Rate: {success_rate:.1f}%"
+                f"Uptime: {uptime_str} | Success: {self.successful_updates} | Failed: {self.failed_updates} | Rate: {success_rate:.1f}% | "
+                f"{self.indicator_cache.stats()} | {self.data_manager.source_health.summary()} | "
+                f"{self.tick_stream.status() if self.tick_stream else 'Stream: starting'}"
             )
         except Exception as e:
             logging.warning(f"Performance metrics update error: {e}")
     
+    @memoized_indicator
     def calculate_reversal_probability(self):
         """Calculate probability of trend reversal"""
         try:
@@ -1464,6 +1471,7 @@ class BitcoinPredictor:
             logging.warning(f"Reversal probability calculation error: {e}")
             return "0% (Error)"
     
+    @memoized_indicator
     def calculate_price_trend(self):
         """Calculate short-term price trend"""
         if len(self.price_history) < 5:
@@ -1483,9 +1491,15 @@ class BitcoinPredictor:
         error_count = 0
         max_consecutive_errors = 10
         
-        while self.running:
+        # Seed the bar history first so the bar indicators see bars in order
+        self.seed_bars()
+        self.tick_stream.start()
+        next_sample = clock.monotonic()
+        
+        while self.running and not clock.finished:
             try:
-                new_price = self.fetch_bitcoin_data()
+                # Sample the newest pushed tick on a fixed 5 s clock so history steps stay even
+                new_price = self.sample_latest_tick()
                 
                 if new_price and self.validate_price_data(new_price):
                     self.current_price = new_price
@@ -1494,7 +1508,7 @@ class BitcoinPredictor:
                         self.price_change = new_price - previous_price
                         self.change_percentage = (self.price_change / previous_price) * 100
                     
-                    self.price_history.append(new_price)
+                    self.add_price(new_price)
                     previous_price = new_price
                     error_count = 0
                     
@@ -1514,16 +1528,20 @@ class BitcoinPredictor:
                             self.current_price = simulated_price
                             self.price_change = simulated_price - previous_price
                             self.change_percentage = (self.price_change / previous_price) * 100
-                            self.price_history.append(simulated_price)
+                            self.add_price(simulated_price)
                             self.root.after(0, self.update_display)
                             logging.warning("Using simulated data due to API failures")
                 
-                time.sleep(5)  # Increased delay to respect API rate limits
+                next_sample += 5
+                clock.sleep(max(0.0, next_sample - clock.monotonic()))
                 
             except Exception as e:
                 error_count += 1
                 logging.error(f"Data loop error: {e}")
-                time.sleep(10)  # Longer delay on error
+                clock.sleep(10)  # Longer delay on error
+                next_sample = clock.monotonic()
+        if clock.finished:
+            logging.info("Replay finished")
     
     def schedule_health_check(self):
         """Schedule periodic health checks"""
@@ -1535,8 +1553,10 @@ class BitcoinPredictor:
                     f"Health check - Uptime: {uptime}, "
                     f"Successful updates: {self.successful_updates}, "
                     f"Failed updates: {self.failed_updates}, "
-                    f"Price history: {len(self.price_history)}"
+                    f"Price history: {len(self.price_history)}, "
+                    f"{self.indicator_cache.stats()}"
                 )
+                logging.info(f"Source health - {self.data_manager.source_health.summary()}")
                 
                 # Check if UI is responsive
                 if self.root.winfo_exists():
@@ -1553,9 +1573,41 @@ class BitcoinPredictor:
         # Start health checks
         self.root.after(60000, health_check)
     
+    def on_tick(self, price, timestamp, volume=0.0):
+        """Tick stream callback: build bars, keep the newest price and repaint the price label (at most 4x/s)"""
+        if not self.validate_price_data(price):
+            return
+        self.bars.add_tick(price, timestamp, volume)
+        self.latest_tick = price
+        self.latest_tick_at = clock.time()
+        now = time.monotonic()
+        if now - self.last_price_paint >= 0.25:
+            self.last_price_paint = now
+            self.root.after(0, lambda: self.price_label.config(text=f"${price:,.0f}"))
+    
+    def seed_bars(self):
+        """Warm the 5m/15m bar history from recent Binance klines before ticks arrive"""
+        for timeframe in self.bar_rsi:
+            try:
+                seeded = self.bars.seed(timeframe, fetch_binance_bars(timeframe, limit=100))
+                logging.info(f"Seeded {seeded} closed {timeframe} bars")
+            except Exception as e:
+                logging.warning(f"Could not seed {timeframe} bars: {e}")
+    
+    def sample_latest_tick(self, max_age=15) -> Optional[float]:
+        """Newest streamed or polled price, or None once the feed has gone quiet"""
+        self.tick_stream.catch_up()  # a replay delivers its recorded ticks here
+        if self.latest_tick is None or clock.time() - self.latest_tick_at > max_age:
+            return None
+        return self.latest_tick
+    
     def start_data_fetching(self):
         """Start data fetching in a separate thread"""
         try:
+            self.tick_stream = TickStream(
+                BINANCE_TRADE_STREAM, parse_binance_trade, self.on_tick,
+                poll=self.fetch_bitcoin_data, poll_interval=5
+            )
             self.data_thread = threading.Thread(target=self.data_loop, daemon=True)
             self.data_thread.start()
             logging.info("Data fetching thread started")
@@ -1568,6 +1620,8 @@ class BitcoinPredictor:
         try:
             logging.info("Application closing...")
             self.running = False
+            if self.tick_stream is not None:
+                self.tick_stream.stop()
             # Give threads a moment to clean up
             time.sleep(1)
             self.root.destroy()
@@ -1579,6 +1633,9 @@ class BitcoinPredictor:
 def main():
     """Main application entry point"""
     try:
+        replay_mode = configure_record_replay()
+        if replay_mode:
+            logging.info(replay_mode)
         root = tk.Tk()
         app = BitcoinPredictor(root)
         root.protocol("WM_DELETE_WINDOW", app.on_closing)
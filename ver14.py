@@ -2,17 +2,19 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
 import time
-import json
 from datetime import datetime, timedelta
 from collections import deque
-import urllib.request
-import urllib.error
 import math
 import random
 import logging
 import sys
 from typing import Optional, Tuple, List, Dict, Any
 
+from market_data import (SourceHealthTracker, request_scheduler, http_client, TickStream, BINANCE_TRADE_STREAM,
+                         parse_binance_trade, BarAggregator, fetch_binance_bars,
+                         clock, configure_record_replay, RateLimited)
+from indicators import IndicatorCache, memoized_indicator, StreamingRSI
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -31,12 +33,17 @@ class DataManager:
         self.consecutive_errors = 0
         self.max_retries = 2
         self.cache_duration = 10  # Reduced for faster updates
+        # Latency/error scores and circuit breaker per data source
+        self.source_health = SourceHealthTracker(scheduler=request_scheduler)
         
     def fetch_with_retry(self, fetch_function, description="data"):
         """Fast fetch data with minimal retry logic"""
         for attempt in range(self.max_retries):
+            if not self.source_health.allow(description):
+                logging.info(f"Skipping {description} - circuit open or out of request budget")
+                break
             try:
-                result = fetch_function()
+                result = self.source_health.call(description, fetch_function)
                 if result is not None and result > 0:
                     self.consecutive_errors = 0
                     self.last_successful_fetch = datetime.now()
@@ -64,8 +71,8 @@ class BitcoinPredictor:
         self.max_valid_price = 1000000
         
         # RSI Strategy variables
-        self.rsi_5m = 0
-        self.rsi_15m = 0
+        self.rsi_5m = None  # advanced on each closed 5m/15m bar
+        self.rsi_15m = None
         self.rsi_30 = False
         self.green_candle_confirmed = False
         self.bullish_5m = False
@@ -95,16 +102,26 @@ class BitcoinPredictor:
         self.start_time = datetime.now()
         self.successful_updates = 0
         self.failed_updates = 0
+        self.feed_outages = 0  # times the tick feed went quiet for longer than 15 s
+        
+        # Indicator results memoized per price-history version
+        self.indicator_cache = IndicatorCache()
         
-        # Pre-calculate some values to speed up
-        self._last_calculation_time = datetime.now()
-        self._cached_rsi = None
-        self._cached_sma = {}
+        # Real 5m/15m OHLCV bars built from the timestamped ticks
+        self.bars = BarAggregator(('5m', '15m'), max_bars=50)
+        self.bar_rsi = {'5m': StreamingRSI(14), '15m': StreamingRSI(14)}
+        self.bars.on_close(self.on_bar_close)
         
         # Setup modern theme first
         self.setup_modern_theme()
         self.setup_ui()
         
+        # Newest price pushed by the trade stream (or its polling fallback)
+        self.tick_stream = None
+        self.latest_tick = None
+        self.latest_tick_at = 0.0
+        self.last_price_paint = 0.0
+        
         self.running = True
         # Start data fetching immediately
         self.start_data_fetching()
@@ -400,20 +417,13 @@ class BitcoinPredictor:
     # ===== ULTRA-FAST DATA FETCHING =====
     
     def fetch_bitcoin_data(self) -> Optional[float]:
-        """Fetch Bitcoin price only from CryptoCompare - SUPER FAST"""
+        """Fetch Bitcoin price only from CryptoCompare - SUPER FAST (None when it fails)"""
         try:
             price = self.data_manager.fetch_with_retry(
-                self.get_cryptocompare_data, "CryptoCompare price"
+                self.get_cryptocompare_data, "CryptoCompare"
             )
             if price and self.validate_price_data(price):
                 return price
-            
-            # Fallback: minimal simulation
-            if len(self.price_history) > 0:
-                last_price = self.price_history[-1]
-                simulated_change = random.uniform(-0.01, 0.01)
-                return last_price * (1 + simulated_change)
-                
             return None
             
         except Exception as e:
@@ -425,20 +435,20 @@ class BitcoinPredictor:
         try:
             # Using direct price endpoint for speed
             url = "https://min-api.cryptocompare.com/data/price?fsym=BTC&tsyms=USD"
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
                 headers={
                     'User-Agent': 'Mozilla/5.0',
                     'Accept': 'application/json'
-                }
+                },
+                timeout=5
             )
             
             # Very short timeout for speed
-            with urllib.request.urlopen(req, timeout=5) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    return data['USD']
-                    
+            return data['USD']
+            
+        except RateLimited:
+            raise
         except Exception as e:
             logging.warning(f"CryptoCompare fetch: {e}")
         return None
@@ -448,17 +458,16 @@ class BitcoinPredictor:
         try:
             # Get last 24 hours data from CryptoCompare (fast)
             url = "https://min-api.cryptocompare.com/data/v2/histohour?fsym=BTC&tsym=USD&limit=24"
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
-                headers={'User-Agent': 'Mozilla/5.0'}
+                headers={'User-Agent': 'Mozilla/5.0'},
+                timeout=5,
+                ttl=self.data_manager.cache_duration
             )
             
-            with urllib.request.urlopen(req, timeout=5) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    prices = [item['close'] for item in data['Data']['Data']]
-                    return prices
-                    
+            prices = [item['close'] for item in data['Data']['Data']]
+            return prices
+            
         except Exception as e:
             logging.warning(f"Historical data: {e}")
         
@@ -471,117 +480,65 @@ class BitcoinPredictor:
 
     # ===== OPTIMIZED CALCULATIONS =====
     
-    def calculate_rsi(self, period=10) -> Optional[float]:  # Reduced period for speed
-        """Optimized RSI calculation"""
-        if len(self.price_history) < period + 1:
-            return None
-        
-        # Use cache if recent
-        current_time = datetime.now()
-        if (self._cached_rsi and 
-            (current_time - self._last_calculation_time).total_seconds() < 2):
-            return self._cached_rsi
-        
-        try:
-            prices = list(self.price_history)
-            gains = []
-            losses = []
-            
-            # Fast calculation
-            for i in range(1, min(len(prices), period + 1)):
-                change = prices[-i] - prices[-i-1]
-                if change > 0:
-                    gains.append(change)
-                    losses.append(0)
-                else:
-                    gains.append(0)
-                    losses.append(abs(change))
-            
-            if not gains:
-                return None
-            
-            avg_gain = sum(gains) / len(gains)
-            avg_loss = sum(losses) / len(losses) if losses else 0
-            
-            if avg_loss == 0:
-                rsi = 100
-            else:
-                rs = avg_gain / avg_loss
-                rsi = 100 - (100 / (1 + rs))
-            
-            # Cache the result
-            self._cached_rsi = rsi
-            self._last_calculation_time = current_time
-            
-            return rsi
-            
-        except Exception as e:
-            logging.warning(f"RSI calculation: {e}")
-            return None
-
+    @memoized_indicator
     def calculate_sma(self, period):
         """Fast SMA calculation"""
-        if period in self._cached_sma:
-            return self._cached_sma[period]
-            
         if len(self.price_history) < period:
             return None
         
         try:
-            sma = sum(list(self.price_history)[-period:]) / period
-            self._cached_sma[period] = sma
-            return sma
+            return sum(list(self.price_history)[-period:]) / period
         except Exception as e:
             logging.warning(f"SMA calculation: {e}")
             return None
 
-    def calculate_fast_indicators(self):
-        """Calculate only essential indicators"""
-        current_rsi = self.calculate_rsi(10)
+    def add_price(self, price):
+        """Append a price and invalidate indicators computed on the old history"""
+        self.price_history.append(price)
+        self.indicator_cache.invalidate()
+
+    def on_bar_close(self, timeframe, bar):
+        """Advance the RSI strategy once per closed 5m/15m bar (tick thread)"""
+        state = self.bar_rsi[timeframe]
+        current_rsi = state.update(bar.close)
         
-        if current_rsi is not None:
-            # Update RSI tracking
-            self.last_rsi_values.append(current_rsi)
-            self.rsi_5m = current_rsi
+        if timeframe == '15m':
             self.rsi_15m = current_rsi
-            
-            # Fast RSI trend
-            if len(self.last_rsi_values) >= 2:
-                current = self.last_rsi_values[-1]
-                previous = self.last_rsi_values[-2]
-                if current > previous + 0.3:
-                    self.rsi_trend = "rising"
-                elif current < previous - 0.3:
-                    self.rsi_trend = "falling"
-                else:
-                    self.rsi_trend = "neutral"
-            
-            # Fast oversold check
-            self.rsi_30 = current_rsi < 30
-            self.approaching_oversold = 30 <= current_rsi <= 40
-            
-            # Fast green candle check
-            if len(self.price_history) >= 2:
-                self.green_candle_confirmed = self.price_history[-1] > self.price_history[-2]
-            else:
-                self.green_candle_confirmed = False
-            
-            # Fast trend checks
-            self.bullish_5m = self.is_bullish_trend_fast(3)  # Reduced lookback
-            self.bullish_15m = self.is_bullish_trend_fast(5)
-            
-            # Buy signal
-            self.buy_signal_active = (self.rsi_30 and 
-                                    self.green_candle_confirmed and 
-                                    self.bullish_5m and 
-                                    self.bullish_15m)
+            self.bullish_15m = self.is_bullish_trend_fast('15m', 5)
+        else:
+            self.rsi_5m = current_rsi
+            self.green_candle_confirmed = bar.green
+            self.bullish_5m = self.is_bullish_trend_fast('5m', 3)
+            
+            if current_rsi is not None:
+                # RSI trend from bar to bar
+                self.last_rsi_values.append(current_rsi)
+                if len(self.last_rsi_values) >= 2:
+                    current = self.last_rsi_values[-1]
+                    previous = self.last_rsi_values[-2]
+                    if current > previous + 0.3:
+                        self.rsi_trend = "rising"
+                    elif current < previous - 0.3:
+                        self.rsi_trend = "falling"
+                    else:
+                        self.rsi_trend = "neutral"
+                
+                # Oversold check
+                self.rsi_30 = current_rsi < 30
+                self.approaching_oversold = 30 <= current_rsi <= 40
+        
+        # Buy signal
+        self.buy_signal_active = (self.rsi_30 and 
+                                self.green_candle_confirmed and 
+                                self.bullish_5m and 
+                                self.bullish_15m)
 
-    def is_bullish_trend_fast(self, lookback):
-        """Fast trend detection"""
-        if len(self.price_history) < lookback + 1:
+    def is_bullish_trend_fast(self, timeframe, lookback):
+        """Fast trend detection over the last closed bars of `timeframe`"""
+        prices = self.bars.closes(timeframe)[-(lookback + 1):]
+        if len(prices) < lookback + 1:
             return False
         
-        prices = list(self.price_history)[-lookback:]
         up_moves = sum(1 for i in range(1, len(prices)) if prices[i] > prices[i-1])
         return up_moves > (len(prices) - 1) / 2
 
@@ -605,9 +562,7 @@ class BitcoinPredictor:
                     foreground=change_color
                 )
             
-            # Fast indicator calculations
-            self.calculate_fast_indicators()
-            
+            # RSI strategy state is advanced by on_bar_close
             # Update RSI monitor
             self.update_oversold_monitor_fast()
             
@@ -755,40 +710,97 @@ class BitcoinPredictor:
         """Ultra-fast data loop"""
         previous_price = None
         
-        while self.running:
+        # Seed the bar history first so the bar indicators see bars in order
+        self.seed_bars()
+        self.tick_stream.start()
+        next_sample = clock.monotonic()
+        feed_quiet = False
+        last_live = None
+        
+        while self.running and not clock.finished:
             try:
-                new_price = self.fetch_bitcoin_data()
+                # Sample the newest pushed tick on a fixed 3 s clock so history steps stay even
+                new_price = self.sample_latest_tick()
                 
                 if new_price and self.validate_price_data(new_price):
+                    feed_quiet = False
+                    last_live = datetime.now()
                     self.current_price = new_price
                     
                     if previous_price is not None:
                         self.price_change = new_price - previous_price
                         self.change_percentage = (self.price_change / previous_price) * 100
                     
-                    self.price_history.append(new_price)
+                    self.add_price(new_price)
                     previous_price = new_price
                     
                     # Fast UI update
                     self.root.after(0, self.update_critical_indicators)
                     
                     # Update status
-                    self.status_var.set(f"✅ Live @ {datetime.now().strftime('%H:%M:%S')}")
+                    self.status_var.set(
+                        f"✅ Live @ {datetime.now().strftime('%H:%M:%S')} | {self.tick_stream.status()} | "
+                        f"{self.data_manager.source_health.summary()}"
+                    )
+                elif last_live is not None:
+                    # No real price for 15 s: report the outage instead of filling it with made-up ticks
+                    if not feed_quiet:
+                        feed_quiet = True
+                        self.feed_outages += 1
+                        logging.warning(f"Price feed quiet since {last_live.strftime('%H:%M:%S')}")
+                    self.status_var.set(
+                        f"⚠️ No live price since {last_live.strftime('%H:%M:%S')} | OUTAGES: {self.feed_outages} | "
+                        f"{self.tick_stream.status()}"
+                    )
                 
-                # Faster updates - 3 seconds
-                time.sleep(3)
+                next_sample += 3
+                clock.sleep(max(0.0, next_sample - clock.monotonic()))
                 
             except Exception as e:
                 logging.error(f"Data loop: {e}")
-                time.sleep(5)
+                clock.sleep(5)
+                next_sample = clock.monotonic()
+        if clock.finished:
+            logging.info("Replay finished")
 
     def validate_price_data(self, price: float) -> bool:
         """Fast price validation"""
         return price is not None and self.min_valid_price <= price <= self.max_valid_price
 
+    def on_tick(self, price, timestamp, volume=0.0):
+        """Tick stream callback: build bars, keep the newest price and repaint the price label (at most 4x/s)"""
+        if not self.validate_price_data(price):
+            return
+        self.bars.add_tick(price, timestamp, volume)
+        self.latest_tick = price
+        self.latest_tick_at = clock.time()
+        now = time.monotonic()
+        if now - self.last_price_paint >= 0.25:
+            self.last_price_paint = now
+            self.root.after(0, lambda: self.price_label.config(text=f"${price:,.0f}"))
+
+    def seed_bars(self):
+        """Warm the 5m/15m bars from recent Binance klines before ticks arrive"""
+        for timeframe in self.bar_rsi:
+            try:
+                self.bars.seed(timeframe, fetch_binance_bars(timeframe, limit=50))
+            except Exception as e:
+                logging.warning(f"Seed {timeframe} bars: {e}")
+
+    def sample_latest_tick(self, max_age=15) -> Optional[float]:
+        """Newest streamed or polled price, or None once the feed has gone quiet"""
+        self.tick_stream.catch_up()  # a replay delivers its recorded ticks here
+        if self.latest_tick is None or clock.time() - self.latest_tick_at > max_age:
+            return None
+        return self.latest_tick
+
     def start_data_fetching(self):
         """Start fast data fetching"""
         try:
+            self.tick_stream = TickStream(
+                BINANCE_TRADE_STREAM, parse_binance_trade, self.on_tick,
+                poll=self.fetch_bitcoin_data, poll_interval=3
+            )
             self.data_thread = threading.Thread(target=self.data_loop, daemon=True)
             self.data_thread.start()
         except Exception as e:
@@ -797,11 +809,16 @@ class BitcoinPredictor:
     def on_closing(self):
         """Fast shutdown"""
         self.running = False
+        if self.tick_stream is not None:
+            self.tick_stream.stop()
         self.root.destroy()
 
 def main():
     """Optimized main function"""
     try:
+        replay_mode = configure_record_replay()
+        if replay_mode:
+            logging.info(replay_mode)
         root = tk.Tk()
         app = BitcoinPredictor(root)
         root.protocol("WM_DELETE_WINDOW", app.on_closing)
@@ -2,17 +2,18 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
 import time
-import json
 from datetime import datetime, timedelta
 from collections import deque
-import urllib.request
-import urllib.error
 import math
-import random
 import logging
 import sys
 from typing import Optional, Tuple, List, Dict, Any
 
+from market_data import (SourceHealthTracker, request_scheduler, http_client, TickStream, BINANCE_TRADE_STREAM,
+                         parse_binance_trade, BarAggregator, fetch_binance_bars,
+                         clock, configure_record_replay, RateLimited)
+from indicators import RollingWindowStats, EMABank, StreamingRSI
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -31,12 +32,17 @@ class DataManager:
         self.consecutive_errors = 0
         self.max_retries = 3
         self.cache_duration = 15
+        # Latency/error scores and circuit breaker per data source
+        self.source_health = SourceHealthTracker(scheduler=request_scheduler)
         
     def fetch_with_retry(self, fetch_function, description="data"):
         """Fetch data with smart retry logic"""
         for attempt in range(self.max_retries):
+            if not self.source_health.allow(description):
+                logging.info(f"Skipping {description} - circuit open or out of request budget")
+                break
             try:
-                result = fetch_function()
+                result = self.source_health.call(description, fetch_function)
                 if result is not None and result > 0:
                     self.consecutive_errors = 0
                     self.last_successful_fetch = datetime.now()
@@ -64,8 +70,8 @@ class BitcoinPredictor:
         self.max_valid_price = 1000000
         
         # Enhanced strategy variables
-        self.rsi_5m = 0
-        self.rsi_15m = 0
+        self.rsi_5m = None  # advanced on each closed 5m/15m bar
+        self.rsi_15m = None
         self.rsi_30 = False
         self.green_candle_confirmed = False
         self.bullish_5m = False
@@ -88,8 +94,16 @@ class BitcoinPredictor:
         
         # Data storage
         self.price_history = deque(maxlen=100)
+        # Rolling mean/variance behind the Bollinger Band calculation
+        self.rolling_stats = RollingWindowStats((20,))
+        # EMAs for the MACD and trend readouts, advanced together once per price
+        self.ema_bank = EMABank((5, 9, 12, 15, 26))
         self.volume_history = deque(maxlen=50)
         self.historical_data = deque(maxlen=200)
+        # Real 5m/15m OHLCV bars built from the timestamped ticks
+        self.bars = BarAggregator(('5m', '15m'), max_bars=100)
+        self.bar_rsi = {'5m': StreamingRSI(14), '15m': StreamingRSI(14)}
+        self.bars.on_close(self.on_bar_close)
         self.current_price = 0
         self.price_change = 0
         self.change_percentage = 0
@@ -105,6 +119,7 @@ class BitcoinPredictor:
         self.start_time = datetime.now()
         self.successful_updates = 0
         self.failed_updates = 0
+        self.feed_outages = 0  # times the tick feed went quiet for longer than 15 s
         
         # Cache for performance
         self._last_calculation_time = datetime.now()
@@ -114,6 +129,12 @@ class BitcoinPredictor:
         self.setup_futuristic_theme()
         self.setup_ui()
         
+        # Newest price pushed by the trade stream (or its polling fallback)
+        self.tick_stream = None
+        self.latest_tick = None
+        self.latest_tick_at = 0.0
+        self.last_price_paint = 0.0
+        
         self.running = True
         self.start_data_fetching()
         
@@ -468,27 +489,18 @@ class BitcoinPredictor:
     # ===== ENHANCED DATA FETCHING =====
     
     def fetch_bitcoin_data(self) -> Optional[float]:
-        """Fetch Bitcoin price from CryptoCompare with CoinGecko backup"""
+        """Fetch Bitcoin price from CryptoCompare with CoinGecko backup (None when both fail)"""
         try:
-            # Primary: CryptoCompare
-            price = self.data_manager.fetch_with_retry(
-                self.get_cryptocompare_data, "CryptoCompare price"
-            )
-            if price and self.validate_price_data(price):
-                return price
+            sources = [
+                ("CryptoCompare", self.get_cryptocompare_data),
+                ("CoinGecko", self.get_coingecko_data)
+            ]
             
-            # Secondary: CoinGecko
-            price = self.data_manager.fetch_with_retry(
-                self.get_coingecko_data, "CoinGecko price"
-            )
-            if price and self.validate_price_data(price):
-                return price
-                
-            # Fallback: use last known price with small variation
-            if len(self.price_history) > 0:
-                last_price = self.price_history[-1]
-                return last_price * (1 + random.uniform(-0.005, 0.005))
-                
+            # Fastest healthy source first; open circuits and throttled providers are skipped
+            for source_name, source_func in self.data_manager.source_health.rank(sources):
+                price = self.data_manager.fetch_with_retry(source_func, source_name)
+                if price and self.validate_price_data(price):
+                    return price
             return None
             
         except Exception as e:
@@ -499,16 +511,16 @@ class BitcoinPredictor:
         """Get real-time data from CryptoCompare"""
         try:
             url = "https://min-api.cryptocompare.com/data/price?fsym=BTC&tsyms=USD"
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
-                headers={'User-Agent': 'Mozilla/5.0', 'Accept': 'application/json'}
+                headers={'User-Agent': 'Mozilla/5.0', 'Accept': 'application/json'},
+                timeout=8
             )
             
-            with urllib.request.urlopen(req, timeout=8) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    return data['USD']
-                    
+            return data['USD']
+            
+        except RateLimited:
+            raise
         except Exception as e:
             logging.warning(f"CryptoCompare: {e}")
         return None
@@ -517,16 +529,16 @@ class BitcoinPredictor:
         """Get backup data from CoinGecko"""
         try:
             url = "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd"
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
-                headers={'User-Agent': 'Mozilla/5.0'}
+                headers={'User-Agent': 'Mozilla/5.0'},
+                timeout=8
             )
             
-            with urllib.request.urlopen(req, timeout=8) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    return data['bitcoin']['usd']
-                    
+            return data['bitcoin']['usd']
+            
+        except RateLimited:
+            raise
         except Exception as e:
             logging.warning(f"CoinGecko: {e}")
         return None
@@ -536,18 +548,17 @@ class BitcoinPredictor:
         try:
             # Use CoinGecko for historical data (more reliable for history)
             url = "https://api.coingecko.com/api/v3/coins/bitcoin/market_chart?vs_currency=usd&days=1&interval=hourly"
-            req = urllib.request.Request(
+            data = http_client.get_json(
                 url,
-                headers={'User-Agent': 'Mozilla/5.0'}
+                headers={'User-Agent': 'Mozilla/5.0'},
+                timeout=10,
+                ttl=self.data_manager.cache_duration
             )
             
-            with urllib.request.urlopen(req, timeout=10) as response:
-                if response.getcode() == 200:
-                    data = json.loads(response.read().decode())
-                    prices = [point[1] for point in data['prices']]
-                    self.historical_data.extend(prices)
-                    logging.info(f"Loaded {len(prices)} historical data points")
-                    
+            prices = [point[1] for point in data['prices']]
+            self.historical_data.extend(prices)
+            logging.info(f"Loaded {len(prices)} historical data points")
+            
         except Exception as e:
             logging.warning(f"Historical data load: {e}")
 
@@ -556,23 +567,8 @@ class BitcoinPredictor:
     def calculate_all_indicators(self):
         """Calculate all technical indicators"""
         try:
-            current_rsi = self.calculate_rsi(14)
-            
-            if current_rsi is not None:
-                # Update RSI tracking
-                self.last_rsi_values.append(current_rsi)
-                self.rsi_5m = current_rsi
-                self.rsi_15m = current_rsi
-                
-                # Enhanced RSI analysis
-                self.calculate_rsi_trend()
-                self.check_oversold_conditions(current_rsi)
-                
-                # Market structure
-                self.green_candle_confirmed = self.is_green_candle()
-                self.bullish_5m = self.is_bullish_trend(5)
-                self.bullish_15m = self.is_bullish_trend(15)
-                
+            # RSI, candle and trend inputs are advanced per closed bar in on_bar_close
+            if len(self.price_history) >= 15:
                 # Advanced indicators
                 self.calculate_macd_signal()
                 self.calculate_bollinger_signal()
@@ -589,36 +585,21 @@ class BitcoinPredictor:
         except Exception as e:
             logging.error(f"Indicator calculation: {e}")
 
-    def calculate_rsi(self, period=14):
-        """Enhanced RSI calculation"""
-        if len(self.price_history) < period + 1:
-            return None
+    def on_bar_close(self, timeframe, bar):
+        """Advance the RSI strategy inputs once per closed 5m/15m bar (tick thread)"""
+        current_rsi = self.bar_rsi[timeframe].update(bar.close)
+        if timeframe == '15m':
+            self.rsi_15m = current_rsi
+            self.bullish_15m = self.is_bullish_trend('15m', 5)
+            return
         
-        try:
-            prices = list(self.price_history)
-            gains = []
-            losses = []
-            
-            for i in range(1, len(prices)):
-                change = prices[i] - prices[i-1]
-                gains.append(max(change, 0))
-                losses.append(max(-change, 0))
-            
-            if len(gains) < period:
-                return None
-            
-            avg_gain = sum(gains[-period:]) / period
-            avg_loss = sum(losses[-period:]) / period
-            
-            if avg_loss == 0:
-                return 100
-            
-            rs = avg_gain / avg_loss
-            return 100 - (100 / (1 + rs))
-            
-        except Exception as e:
-            logging.warning(f"RSI calculation: {e}")
-            return None
+        self.rsi_5m = current_rsi
+        self.green_candle_confirmed = bar.green
+        self.bullish_5m = self.is_bullish_trend('5m', 5)
+        if current_rsi is not None:
+            self.last_rsi_values.append(current_rsi)
+            self.calculate_rsi_trend()
+            self.check_oversold_conditions(current_rsi)
 
     def calculate_rsi_trend(self):
         """Calculate RSI trend direction"""
@@ -643,18 +624,12 @@ class BitcoinPredictor:
         self.oversold_zone = current_rsi < 35
         self.approaching_oversold = 30 <= current_rsi <= 40
 
-    def is_green_candle(self):
-        """Check if current candle is green"""
-        if len(self.price_history) < 2:
-            return False
-        return self.price_history[-1] > self.price_history[-2]
-
-    def is_bullish_trend(self, lookback):
-        """Enhanced trend detection"""
-        if len(self.price_history) < lookback + 1:
+    def is_bullish_trend(self, timeframe, lookback):
+        """Enhanced trend detection over the last closed bars of `timeframe`"""
+        prices = self.bars.closes(timeframe)[-lookback:]
+        if len(prices) < lookback:
             return False
         
-        prices = list(self.price_history)[-lookback:]
         sma_short = sum(prices[-3:]) / 3 if len(prices) >= 3 else prices[-1]
         sma_long = sum(prices) / len(prices)
         
@@ -673,7 +648,7 @@ class BitcoinPredictor:
             
             if ema_12 and ema_26:
                 macd_line = ema_12 - ema_26
-                signal_line = self.calculate_ema(9, list(self.price_history))
+                signal_line = self.calculate_ema(9)
                 
                 if signal_line:
                     self.macd_signal = "BULLISH" if macd_line > signal_line else "BEARISH"
@@ -689,6 +664,8 @@ class BitcoinPredictor:
     def calculate_ema(self, period, prices=None):
         """Calculate Exponential Moving Average"""
         if prices is None:
+            if period in self.ema_bank and len(self.price_history) >= period:
+                return self.ema_bank.get(period)
             prices = list(self.price_history)
         
         if len(prices) < period:
@@ -706,6 +683,12 @@ class BitcoinPredictor:
             logging.warning(f"EMA calculation: {e}")
             return None
 
+    def add_price(self, price):
+        """Append a price to the history and advance the streaming indicators"""
+        self.price_history.append(price)
+        self.rolling_stats.update(price)
+        self.ema_bank.update(price)
+    
     def calculate_bollinger_signal(self):
         """Calculate Bollinger Bands signal"""
         if len(self.price_history) < 20:
@@ -713,15 +696,8 @@ class BitcoinPredictor:
             return
         
         try:
-            prices = list(self.price_history)[-20:]
-            sma = sum(prices) / len(prices)
-            
-            variance = sum((price - sma) ** 2 for price in prices) / len(prices)
-            std_dev = math.sqrt(variance)
-            
-            upper_band = sma + (std_dev * 2)
-            lower_band = sma - (std_dev * 2)
-            current_price = prices[-1]
+            upper_band, _, lower_band = self.rolling_stats.bollinger_bands(20)
+            current_price = self.price_history[-1]
             
             if current_price > upper_band:
                 self.bollinger_signal = "OVERBOUGHT"
@@ -1066,39 +1042,97 @@ class BitcoinPredictor:
         """Main data processing loop"""
         previous_price = None
         
-        while self.running:
+        # Seed the bar history first so the bar indicators see bars in order
+        self.seed_bars()
+        self.tick_stream.start()
+        next_sample = clock.monotonic()
+        feed_quiet = False
+        last_live = None
+        
+        while self.running and not clock.finished:
             try:
-                new_price = self.fetch_bitcoin_data()
+                # Sample the newest pushed tick on a fixed 4 s clock so history steps stay even
+                new_price = self.sample_latest_tick()
                 
                 if new_price and self.validate_price_data(new_price):
+                    feed_quiet = False
+                    last_live = datetime.now()
                     self.current_price = new_price
                     
                     if previous_price is not None:
                         self.price_change = new_price - previous_price
                         self.change_percentage = (self.price_change / previous_price) * 100
                     
-                    self.price_history.append(new_price)
+                    self.add_price(new_price)
                     previous_price = new_price
                     
                     # Update UI
                     self.root.after(0, self.update_all_indicators)
                     
                     # Update status
-                    self.status_var.set(f"✅ LIVE @ {datetime.now().strftime('%H:%M:%S')} | UPDATES: {self.successful_updates}")
+                    self.status_var.set(
+                        f"✅ LIVE @ {datetime.now().strftime('%H:%M:%S')} | UPDATES: {self.successful_updates} | "
+                        f"{self.tick_stream.status()} | {self.data_manager.source_health.summary()}"
+                    )
+                elif last_live is not None:
+                    # No real price for 15 s: report the outage instead of filling it with made-up ticks
+                    if not feed_quiet:
+                        feed_quiet = True
+                        self.feed_outages += 1
+                        logging.warning(f"Price feed quiet since {last_live.strftime('%H:%M:%S')}")
+                    self.status_var.set(
+                        f"⚠️ No live price since {last_live.strftime('%H:%M:%S')} | OUTAGES: {self.feed_outages} | "
+                        f"{self.tick_stream.status()}"
+                    )
                 
-                time.sleep(4)  # 4-second updates
+                next_sample += 4
+                clock.sleep(max(0.0, next_sample - clock.monotonic()))
                 
             except Exception as e:
                 logging.error(f"Data loop: {e}")
-                time.sleep(5)
+                clock.sleep(5)
+                next_sample = clock.monotonic()
+        if clock.finished:
+            logging.info("Replay finished")
 
     def validate_price_data(self, price: float) -> bool:
         """Validate price data"""
         return price is not None and self.min_valid_price <= price <= self.max_valid_price
 
+    def on_tick(self, price, timestamp, volume=0.0):
+        """Tick stream callback: build bars, keep the newest price and repaint the price label (at most 4x/s)"""
+        if not self.validate_price_data(price):
+            return
+        self.bars.add_tick(price, timestamp, volume)
+        self.latest_tick = price
+        self.latest_tick_at = clock.time()
+        now = time.monotonic()
+        if now - self.last_price_paint >= 0.25:
+            self.last_price_paint = now
+            self.root.after(0, lambda: self.price_label.config(text=f"${price:,.0f}"))
+
+    def seed_bars(self):
+        """Warm the 5m/15m bars from recent Binance klines before ticks arrive"""
+        for timeframe in self.bar_rsi:
+            try:
+                self.bars.seed(timeframe, fetch_binance_bars(timeframe, limit=100))
+            except Exception as e:
+                logging.warning(f"Seed {timeframe} bars: {e}")
+
+    def sample_latest_tick(self, max_age=15) -> Optional[float]:
+        """Newest streamed or polled price, or None once the feed has gone quiet"""
+        self.tick_stream.catch_up()  # a replay delivers its recorded ticks here
+        if self.latest_tick is None or clock.time() - self.latest_tick_at > max_age:
+            return None
+        return self.latest_tick
+
     def start_data_fetching(self):
         """Start data fetching thread"""
         try:
+            self.tick_stream = TickStream(
+                BINANCE_TRADE_STREAM, parse_binance_trade, self.on_tick,
+                poll=self.fetch_bitcoin_data, poll_interval=4
+            )
             self.data_thread = threading.Thread(target=self.data_loop, daemon=True)
             self.data_thread.start()
             logging.info("Data fetching started")
@@ -1108,11 +1142,16 @@ class BitcoinPredictor:
     def on_closing(self):
         """Clean shutdown"""
         self.running = False
+        if self.tick_stream is not None:
+            self.tick_stream.stop()
         self.root.destroy()
 
 def main():
     """Main application entry"""
     try:
+        replay_mode = configure_record_replay()
+        if replay_mode:
+            logging.info(replay_mode)
         root = tk.Tk()
         app = BitcoinPredictor(root)
         root.protocol("WM_DELETE_WINDOW", app.on_closing)
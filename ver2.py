@@ -1,13 +1,18 @@
-from flask import Flask, render_template_string, request, jsonify
-import requests
+from flask import Flask, request, jsonify
 import pandas as pd
 import numpy as np 
 from datetime import datetime, timedelta
 import os 
 import json
 from collections import deque
+from urllib.parse import urlencode
 import time
 
+from indicators import rsi_series
+from ohlcv_store import MarketChartHistory, local_datetime_index, kline_rows
+from market_data import TTLCache, http_client
+from analysis_snapshot import SnapshotRefresher, FragmentPage, EventBroadcaster, SignalPublisher, parse_scenarios
+
 app = Flask(__name__)
 
 # Enhanced HTML Templates with beginner-friendly explanations
@@ -520,6 +525,7 @@ RESULTS_HTML = '''
                             <h5 class="mb-0"><i class="fas fa-shield-heart me-2"></i>Learning About Risk</h5>
                         </div>
                         <div class="card-body">
+                            {% block position_sizing %}
                             <div class="mb-3">
                                 <small class="text-muted">Learning Position Size</small>
                                 <div class="h4 text-success">${{ analysis.position_sizing.recommended_size }}</div>
@@ -537,6 +543,7 @@ RESULTS_HTML = '''
                                 <div class="h6 text-success">Goal 1: ${{ analysis.position_sizing.take_profit_1 }}</div>
                                 <div class="h6 text-success">Goal 2: ${{ analysis.position_sizing.take_profit_2 }}</div>
                             </div>
+                            {% endblock %}
                             
                             <div class="alert alert-{{ analysis.risk_level.color }} mt-3">
                                 <small><strong>Market Risk:</strong> {{ analysis.risk_level.level }}</small><br>
@@ -657,7 +664,26 @@ class BeginnerFriendlyBitcoinAssistant:
             'https://api.coingecko.com/api/v3/coins/bitcoin/market_chart',
             'https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd'
         ]
+        # Candle history on disk; each request only downloads what is missing
+        self.price_store = MarketChartHistory()
+        # Concurrent fetches of one chart share a download; kept shorter than the snapshot interval
+        # so every background refresh sees a fresh response
+        self.response_cache = TTLCache(ttl=30)
+        
+    def fetch_market_chart(self, days, interval):
+        """Download a CoinGecko market_chart payload; concurrent requests share one call"""
+        def download():
+            url = "https://api.coingecko.com/api/v3/coins/bitcoin/market_chart"
+            params = {
+                'vs_currency': 'usd', 
+                'days': days, 
+                'interval': interval
+            }
+            # Raw body through the pooled client; the candle store decodes it straight into arrays
+            return http_client.get(f"{url}?{urlencode(params)}", timeout=15)
         
+        return self.response_cache.get(('market_chart', days, interval), download)
+    
     def fetch_bitcoin_data_with_fallback(self, days=30):
         """Fetch Bitcoin data with multiple fallback options for better accuracy"""
         print(f"📡 Fetching Bitcoin data for {days} days...")
@@ -666,20 +692,14 @@ class BeginnerFriendlyBitcoinAssistant:
         for attempt in range(3):
             try:
                 if attempt == 0:
-                    # Primary source: CoinGecko market chart
-                    url = "https://api.coingecko.com/api/v3/coins/bitcoin/market_chart"
-                    params = {
-                        'vs_currency': 'usd', 
-                        'days': days, 
-                        'interval': 'daily' if days > 1 else 'hourly'
-                    }
-                    response = requests.get(url, params=params, timeout=15)
-                    response.raise_for_status()
-                    data = response.json()
+                    # Primary source: CoinGecko market chart, topped up into the local candle store
+                    history = self.price_store.history(
+                        days, 'daily' if days > 1 else 'hourly', self.fetch_market_chart
+                    )
                     
                     # Process the data
-                    prices = [price[1] for price in data['prices']]
-                    dates = [datetime.fromtimestamp(price[0] / 1000) for price in data['prices']]
+                    prices = history['close']
+                    dates = local_datetime_index(history['timestamp'])
                     
                     df = pd.DataFrame({
                         'date': dates,
@@ -702,12 +722,15 @@ class BeginnerFriendlyBitcoinAssistant:
                         'interval': interval,
                         'limit': limit
                     }
-                    response = requests.get(url, params=params, timeout=10)
-                    response.raise_for_status()
-                    data = response.json()
+                    def download():
+                        return http_client.get(f"{url}?{urlencode(params)}", timeout=10)
+                    
+                    candles = kline_rows(self.response_cache.get(('klines', interval, limit), download))
                     
-                    prices = [float(candle[4]) for candle in data]  # Closing prices
-                    dates = [datetime.fromtimestamp(candle[6] / 1000) for candle in data]
+                    prices = candles['close']  # Closing prices
+                    # Dated by close time: open time plus the interval, less 1 ms
+                    interval_ms = 86400 * 1000 if interval == '1d' else 3600 * 1000
+                    dates = local_datetime_index(candles['timestamp'] + interval_ms - 1)
                     
                     df = pd.DataFrame({
                         'date': dates,
@@ -1060,55 +1083,153 @@ class BeginnerFriendlyBitcoinAssistant:
 # Initialize the beginner-friendly assistant
 beginner_bot = BeginnerFriendlyBitcoinAssistant()
 
+ANALYSIS_TIMEFRAMES = ('1', '7', '30')
+
+def compute_analysis(time_frame):
+    """Beginner recommendation for one timeframe, for the results page and the JSON API"""
+    df = beginner_bot.fetch_bitcoin_data_with_fallback(days=int(time_frame))
+    analysis = beginner_bot.get_beginner_recommendation(df)
+    prices = df['price'].values
+    rsi = float(rsi_series(prices, 14)[-1]) if len(prices) > 14 else 50
+    return {'analysis': analysis, 'rsi': rsi}
+
+def api_view(payload):
+    """The part of the analysis the JSON API publishes"""
+    analysis = payload['analysis']
+    return {
+        'analysis': {
+            'recommendation': analysis['recommendation'],
+            'confidence': analysis['confidence'],
+            'current_price': analysis['current_price'],
+            'risk_level': analysis['risk_level']
+        }
+    }
+
+# The JSON API only reads these snapshots; the analysis runs on the refresher thread
+analysis_snapshots = SnapshotRefresher(compute_analysis, ANALYSIS_TIMEFRAMES, interval=60, view=api_view)
+
+# Dashboards follow these fields over /api/stream; a refresh that leaves them unchanged sends nothing
+def signal_fields(payload):
+    analysis = payload['analysis']
+    return {
+        'recommendation': analysis['recommendation'],
+        'confidence': analysis['confidence'],
+        'rsi': round(payload['rsi'], 1),
+        'price': round(analysis['current_price'], 2)
+    }
+
+signal_events = EventBroadcaster()
+analysis_snapshots.on_publish(SignalPublisher(signal_events, signal_fields))
+
+# Templates are compiled once; the index page has no variables, so it is rendered once too
+INDEX_PAGE = app.jinja_env.from_string(INDEX_HTML).render()
+results_page = FragmentPage(app.jinja_env, RESULTS_HTML, 'position_sizing')
+
+def render_results(time_frame, account_balance, risk_per_trade):
+    """Results page from the latest snapshot; only the position-sizing block is rendered per request"""
+    snapshot = analysis_snapshots.get(time_frame)
+    if snapshot is None:
+        raise RuntimeError(analysis_snapshots.unavailable_reason(time_frame))
+    analysis = snapshot.payload['analysis']
+    position_sizing = beginner_bot.calculate_simple_position_size(analysis['current_price'], account_balance, risk_per_trade)
+    return results_page.render((time_frame, snapshot.version), lambda: {'analysis': analysis, 'error': None},
+                               {'analysis': {'position_sizing': position_sizing}})
+
 @app.route('/')
 def index():
-    return render_template_string(INDEX_HTML)
+    return INDEX_PAGE
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
     try:
         time_frame = request.form.get('time_frame', '30')
+        if not analysis_snapshots.supports(time_frame):
+            error_msg = f"Unsupported time frame {time_frame!r} - choose {', '.join(ANALYSIS_TIMEFRAMES)} days"
+            return results_page.template.render(error=error_msg), 400
         analysis_type = request.form.get('analysis_type', 'simple')
         account_balance = float(request.form.get('account_balance', 1000))
         risk_per_trade = float(request.form.get('risk_per_trade', 2))
         
-        print(f"🔍 Starting beginner-friendly analysis: {time_frame} days")
-        
-        # Fetch enhanced data
-        df = beginner_bot.fetch_bitcoin_data_with_fallback(days=int(time_frame))
-        
-        # Get beginner-friendly analysis
-        analysis = beginner_bot.get_beginner_recommendation(df, account_balance, risk_per_trade)
+        print(f"🔍 Beginner-friendly analysis: {time_frame} days")
         
-        print(f"✅ Analysis complete: {analysis['recommendation']} with {analysis['confidence']}% confidence")
-        
-        return render_template_string(RESULTS_HTML, 
-                                    analysis=analysis, 
-                                    error=None)
+        # Market analysis comes from the background snapshot for this timeframe
+        return render_results(time_frame, account_balance, risk_per_trade)
                                     
     except Exception as e:
         error_msg = f"Analysis failed: {str(e)}"
         print(f"❌ {error_msg}")
-        return render_template_string(RESULTS_HTML, 
-                                    error=error_msg)
+        return results_page.template.render(error=error_msg)
 
 @app.route('/api/simple_analysis')
 def api_simple_analysis():
-    """Simple JSON API endpoint for beginners"""
+    """Simple JSON API endpoint for beginners, served from the latest background snapshot"""
     try:
-        df = beginner_bot.fetch_bitcoin_data_with_fallback()
-        analysis = beginner_bot.get_beginner_recommendation(df)
+        time_frame = request.args.get('time_frame', '30')
+        if time_frame not in ANALYSIS_TIMEFRAMES:
+            return jsonify({
+                'success': False,
+                'error': f"time_frame must be one of {', '.join(ANALYSIS_TIMEFRAMES)}",
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        snapshot = analysis_snapshots.get(time_frame)
+        if snapshot is None:
+            return jsonify({
+                'success': False,
+                'error': analysis_snapshots.unavailable_reason(time_frame),
+                'timestamp': datetime.now().isoformat()
+            }), 503
         
+        headers = analysis_snapshots.cache_headers(snapshot)
+        if snapshot.matches(request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')):
+            return app.response_class(status=304, headers=headers)  # nothing rendered or serialized
+        
+        body = snapshot.response_body(success=True, timestamp=datetime.now().isoformat(),
+                                      **analysis_snapshots.describe(snapshot))
+        return app.response_class(body, mimetype='application/json', headers=headers)
+    except Exception as e:
         return jsonify({
-            'success': True,
-            'timestamp': datetime.now().isoformat(),
-            'analysis': {
-                'recommendation': analysis['recommendation'],
-                'confidence': analysis['confidence'],
-                'current_price': analysis['current_price'],
-                'risk_level': analysis['risk_level']
-            }
+            'success': False, 
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
         })
+
+@app.route('/api/batch_analysis', methods=['POST'])
+def api_batch_analysis():
+    """Many account scenarios in one call: one snapshot per distinct timeframe, position sizing per scenario"""
+    try:
+        scenarios = parse_scenarios(request.get_json(silent=True), ANALYSIS_TIMEFRAMES, 'simple')
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    try:
+        # The market analysis is shared by every scenario on the same timeframe
+        snapshots = {}
+        for time_frame in sorted({scenario['time_frame'] for scenario in scenarios}, key=int):
+            snapshot = analysis_snapshots.get(time_frame)
+            if snapshot is None:
+                return jsonify({
+                    'success': False,
+                    'error': analysis_snapshots.unavailable_reason(time_frame),
+                    'timestamp': datetime.now().isoformat()
+                }), 503
+            snapshots[time_frame] = snapshot
+        
+        results = []
+        for scenario in scenarios:
+            current_price = snapshots[scenario['time_frame']].payload['analysis']['current_price']
+            position_sizing = beginner_bot.calculate_simple_position_size(
+                current_price, scenario['account_balance'], scenario['risk_per_trade']
+            )
+            results.append({**scenario, 'position_sizing': position_sizing})
+        
+        body = analysis_snapshots.batch_body(snapshots, results, success=True,
+                                             timestamp=datetime.now().isoformat(), scenarios=len(results))
+        return app.response_class(body, mimetype='application/json')
     except Exception as e:
         return jsonify({
             'success': False, 
@@ -1116,6 +1237,24 @@ def api_simple_analysis():
             'timestamp': datetime.now().isoformat()
         })
 
+@app.route('/api/stream')
+def api_stream():
+    """Server-sent events: a compact 'signal' event whenever a timeframe's recommendation, confidence, RSI or price changes"""
+    time_frames = request.args.getlist('time_frame')
+    unsupported = [time_frame for time_frame in time_frames if time_frame not in ANALYSIS_TIMEFRAMES]
+    if unsupported:
+        return jsonify({
+            'success': False,
+            'error': f"unsupported time_frame {', '.join(unsupported)}; use one of {', '.join(ANALYSIS_TIMEFRAMES)}",
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    # Events are produced by the snapshot refresher; a connection only forwards them
+    analysis_snapshots.start()
+    events = signal_events.subscribe(time_frames, request.headers.get('Last-Event-ID'))
+    return app.response_class(events, mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/health')
 def health_check():
     return jsonify({
@@ -1132,6 +1271,7 @@ if __name__ == '__main__':
     print("👋 Welcome to Bitcoin Learning!")
     print("📊 Web Interface: http://localhost:5000")
     print("🔗 Simple API:    http://localhost:5000/api/simple_analysis")
+    print("📡 Live Signals: http://localhost:5000/api/stream")
     print("❤️  Health Check: http://localhost:5000/health")
     print("=" * 60)
     print("💡 IMPORTANT: This is for LEARNING PURPOSES only!")
@@ -1,15 +1,20 @@
-from flask import Flask, render_template_string, request, jsonify
-import requests
+from flask import Flask, request, jsonify
 import pandas as pd
 import numpy as np 
 from datetime import datetime, timedelta
 import os
 import json
 from collections import deque
+from urllib.parse import urlencode
 import time
 import warnings
 warnings.filterwarnings('ignore')
 
+from indicators import rsi_series, macd_series, bollinger_series
+from ohlcv_store import MarketChartHistory, local_datetime_index
+from market_data import TTLCache, http_client
+from analysis_snapshot import SnapshotRefresher, FragmentPage, EventBroadcaster, SignalPublisher, parse_scenarios
+
 app = Flask(__name__)
 
 # Use the same HTML templates as before (they remain unchanged)
@@ -588,6 +593,7 @@ RESULTS_HTML = '''
                             <h5 class="mb-0"><i class="fas fa-calculator me-2"></i>AI Position Sizing</h5>
                         </div>
                         <div class="card-body">
+                            {% block position_sizing %}
                             <div class="mb-3">
                                 <small class="text-muted">AI Recommended Size</small>
                                 <div class="h4 text-success">${{ analysis.position_sizing.recommended_size }}</div>
@@ -605,6 +611,7 @@ RESULTS_HTML = '''
                                 <div class="h6 text-success">Target 1: ${{ analysis.position_sizing.take_profit_1 }}</div>
                                 <div class="h6 text-success">Target 2: ${{ analysis.position_sizing.take_profit_2 }}</div>
                             </div>
+                            {% endblock %}
                             
                             <div class="alert alert-{{ analysis.risk_level.color }} mt-3">
                                 <small><strong>AI Risk Level:</strong> {{ analysis.risk_level.level }}</small><br>
@@ -703,8 +710,27 @@ class BitcoinAIAssistant:
     def __init__(self):
         self.indicators = {}
         self.historical_predictions = deque(maxlen=100)
+        # Candle history on disk; each request only downloads what is missing
+        self.price_store = MarketChartHistory()
+        # Concurrent fetches of one chart share a download; kept shorter than the snapshot interval
+        # so every background refresh sees a fresh response
+        self.response_cache = TTLCache(ttl=30)
         self.model_trained = False
         
+    def fetch_market_chart(self, days, interval):
+        """Download a CoinGecko market_chart payload; concurrent requests share one call"""
+        def download():
+            url = "https://api.coingecko.com/api/v3/coins/bitcoin/market_chart"
+            params = {
+                'vs_currency': 'usd', 
+                'days': days, 
+                'interval': interval
+            }
+            # Raw body through the pooled client; the candle store decodes it straight into arrays
+            return http_client.get(f"{url}?{urlencode(params)}", timeout=15)
+        
+        return self.response_cache.get(('market_chart', days, interval), download)
+    
     def fetch_bitcoin_data(self, days=30):
         """Fetch Bitcoin data with robust error handling for all timeframes"""
         print(f"📡 Fetching Bitcoin data for {days} days...")
@@ -724,20 +750,12 @@ class BitcoinAIAssistant:
                 interval = 'daily'
                 url_days = days
                 
-            url = "https://api.coingecko.com/api/v3/coins/bitcoin/market_chart"
-            params = {
-                'vs_currency': 'usd', 
-                'days': url_days, 
-                'interval': interval
-            }
-            
-            response = requests.get(url, params=params, timeout=15)
-            response.raise_for_status()
-            data = response.json()
+            # Only candles newer than the local store are downloaded
+            history = self.price_store.history(url_days, interval, self.fetch_market_chart)
             
             # Process the data
-            prices = [price[1] for price in data['prices']]
-            dates = [datetime.fromtimestamp(price[0] / 1000) for price in data['prices']]
+            prices = history['close']
+            dates = local_datetime_index(history['timestamp'])
             
             # Create DataFrame
             df = pd.DataFrame({
@@ -875,25 +893,13 @@ class BitcoinAIAssistant:
         """Calculate RSI indicator"""
         if len(prices) < period + 1:
             return 50
-            
-        deltas = np.diff(prices)
-        gains = np.where(deltas > 0, deltas, 0)
-        losses = np.where(deltas < 0, -deltas, 0)
-        
-        avg_gains = np.zeros_like(prices)
-        avg_losses = np.zeros_like(prices)
-        
-        avg_gains[period] = np.mean(gains[:period])
-        avg_losses[period] = np.mean(losses[:period])
-        
-        for i in range(period + 1, len(prices)):
-            avg_gains[i] = (avg_gains[i-1] * (period - 1) + gains[i-1]) / period
-            avg_losses[i] = (avg_losses[i-1] * (period - 1) + losses[i-1]) / period
         
-        rs = avg_gains[period:] / np.where(avg_losses[period:] == 0, 1, avg_losses[period:])
-        rsi = 100 - (100 / (1 + rs))
-        
-        return float(rsi[-1]) if len(rsi) > 0 else 50
+        rsi = rsi_series(prices, period)
+        return float(rsi[-1])
+    
+    def calculate_rsi_series(self, prices, period=14):
+        """Full RSI series (one row per period when several are given)"""
+        return rsi_series(prices, period)
     
     def calculate_bollinger_bands(self, prices, window=20, num_std=2):
         """Calculate Bollinger Bands"""
@@ -909,35 +915,18 @@ class BitcoinAIAssistant:
         
         return upper_band, sma, lower_band
     
+    def calculate_bollinger_series(self, prices, window=20, num_std=2):
+        """Full upper/middle/lower Bollinger Band series for backtests and charts"""
+        return bollinger_series(prices, window, num_std)
+    
     def calculate_macd(self, prices, fast=12, slow=26, signal=9):
         """Calculate MACD indicator"""
-        def ema(data, period):
-            if len(data) < period:
-                return np.mean(data)
-            ema_values = [data[0]]
-            alpha = 2 / (period + 1)
-            for i in range(1, len(data)):
-                ema_values.append(alpha * data[i] + (1 - alpha) * ema_values[i-1])
-            return ema_values[-1]
-        
-        ema_fast = ema(prices, fast)
-        ema_slow = ema(prices, slow)
-        macd_line = ema_fast - ema_slow
-        
-        # Simple signal line calculation
-        macd_values = []
-        for i in range(slow, len(prices)):
-            fast_ema = ema(prices[i-slow:i] if i>=slow else prices[:i], fast)
-            slow_ema = ema(prices[i-slow:i] if i>=slow else prices[:i], slow)
-            macd_values.append(fast_ema - slow_ema)
-        
-        if len(macd_values) >= signal:
-            signal_line = np.mean(macd_values[-signal:])
-        else:
-            signal_line = np.mean(macd_values) if macd_values else 0
-            
-        histogram = macd_line - signal_line
-        return macd_line, signal_line, histogram
+        if len(prices) == 0:
+            return 0.0, 0.0, 0.0
+        
+        # EMAs start at the first price rather than an SMA seed
+        macd = macd_series(prices, fast, slow, signal, sma_seed=False)
+        return float(macd['macd'][-1]), float(macd['signal'][-1]), float(macd['histogram'][-1])
     
     def ml_prediction(self, df):
         """Advanced machine learning prediction without scikit-learn"""
@@ -1407,58 +1396,154 @@ class BitcoinAIAssistant:
 # Initialize the AI assistant
 ai_bot = BitcoinAIAssistant()
 
+ANALYSIS_TIMEFRAMES = ('1', '7', '30', '90')
+
+def compute_analysis(time_frame):
+    """AI analysis for one timeframe, for the results page and the JSON API"""
+    df = ai_bot.fetch_bitcoin_data(days=int(time_frame))
+    analysis = ai_bot.get_ai_analysis(df)
+    return {'analysis': analysis, 'rsi': ai_bot.calculate_rsi(df['price'].values)}
+
+def api_view(payload):
+    """The part of the analysis the JSON API publishes"""
+    analysis = payload['analysis']
+    return {
+        'analysis': {
+            'recommendation': analysis['recommendation'],
+            'confidence': analysis['confidence'],
+            'current_price': analysis['current_price'],
+            'risk_level': analysis['risk_level'],
+            'ml_insights': analysis['ml_insights']
+        }
+    }
+
+# The JSON API only reads these snapshots; the analysis runs on the refresher thread
+analysis_snapshots = SnapshotRefresher(compute_analysis, ANALYSIS_TIMEFRAMES, interval=60, view=api_view)
+
+# Dashboards follow these fields over /api/stream; a refresh that leaves them unchanged sends nothing
+def signal_fields(payload):
+    analysis = payload['analysis']
+    return {
+        'recommendation': analysis['recommendation'],
+        'confidence': analysis['confidence'],
+        'rsi': round(payload['rsi'], 1),
+        'price': round(analysis['current_price'], 2)
+    }
+
+signal_events = EventBroadcaster()
+analysis_snapshots.on_publish(SignalPublisher(signal_events, signal_fields))
+
+# Templates are compiled once; the index page has no variables, so it is rendered once too
+INDEX_PAGE = app.jinja_env.from_string(INDEX_HTML).render()
+results_page = FragmentPage(app.jinja_env, RESULTS_HTML, 'position_sizing')
+
+def render_results(time_frame, account_balance, risk_per_trade):
+    """Results page from the latest snapshot; only the position-sizing block is rendered per request"""
+    snapshot = analysis_snapshots.get(time_frame)
+    if snapshot is None:
+        raise RuntimeError(analysis_snapshots.unavailable_reason(time_frame))
+    analysis = snapshot.payload['analysis']
+    position_sizing = ai_bot.calculate_simple_position_size(analysis['current_price'], account_balance, risk_per_trade)
+    return results_page.render((time_frame, snapshot.version), lambda: {'analysis': analysis, 'error': None},
+                               {'analysis': {'position_sizing': position_sizing}})
+
 @app.route('/')
 def index():
-    return render_template_string(INDEX_HTML)
+    return INDEX_PAGE
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
     try:
         time_frame = request.form.get('time_frame', '30')
+        if not analysis_snapshots.supports(time_frame):
+            error_msg = f"Unsupported time frame {time_frame!r} - choose {', '.join(ANALYSIS_TIMEFRAMES)} days"
+            return results_page.template.render(error=error_msg), 400
         analysis_type = request.form.get('analysis_type', 'ml_simple')
         account_balance = float(request.form.get('account_balance', 1000))
         risk_per_trade = float(request.form.get('risk_per_trade', 2))
         
-        print(f"🤖 Starting AI analysis: {time_frame} days, {analysis_type} mode")
-        
-        # Fetch data for the selected timeframe
-        df = ai_bot.fetch_bitcoin_data(days=int(time_frame))
+        print(f"🤖 AI analysis: {time_frame} days, {analysis_type} mode")
         
-        # Get AI analysis
-        analysis = ai_bot.get_ai_analysis(df, account_balance, risk_per_trade)
-        
-        print(f"✅ AI analysis complete: {analysis['recommendation']} with {analysis['confidence']}% confidence")
-        
-        return render_template_string(RESULTS_HTML, 
-                                    analysis=analysis, 
-                                    error=None)
+        # Market analysis comes from the background snapshot for this timeframe
+        return render_results(time_frame, account_balance, risk_per_trade)
                                     
     except Exception as e:
         error_msg = f"AI analysis failed: {str(e)}"
         print(f"❌ {error_msg}")
         import traceback
         print(f"🔍 Detailed error: {traceback.format_exc()}")
-        return render_template_string(RESULTS_HTML, 
-                                    error=error_msg)
+        return results_page.template.render(error=error_msg)
 
 @app.route('/api/ai_analysis')
 def api_ai_analysis():
-    """AI-powered JSON API endpoint"""
+    """AI-powered JSON API endpoint, served from the latest background snapshot"""
     try:
-        df = ai_bot.fetch_bitcoin_data()
-        analysis = ai_bot.get_ai_analysis(df)
-        
+        time_frame = request.args.get('time_frame', '30')
+        if time_frame not in ANALYSIS_TIMEFRAMES:
+            return jsonify({
+                'success': False,
+                'error': f"time_frame must be one of {', '.join(ANALYSIS_TIMEFRAMES)}",
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        snapshot = analysis_snapshots.get(time_frame)
+        if snapshot is None:
+            return jsonify({
+                'success': False,
+                'error': analysis_snapshots.unavailable_reason(time_frame),
+                'timestamp': datetime.now().isoformat()
+            }), 503
+        
+        headers = analysis_snapshots.cache_headers(snapshot)
+        if snapshot.matches(request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')):
+            return app.response_class(status=304, headers=headers)  # nothing rendered or serialized
+        
+        body = snapshot.response_body(success=True, timestamp=datetime.now().isoformat(),
+                                      **analysis_snapshots.describe(snapshot))
+        return app.response_class(body, mimetype='application/json', headers=headers)
+    except Exception as e:
         return jsonify({
-            'success': True,
-            'timestamp': datetime.now().isoformat(),
-            'analysis': {
-                'recommendation': analysis['recommendation'],
-                'confidence': analysis['confidence'],
-                'current_price': analysis['current_price'],
-                'risk_level': analysis['risk_level'],
-                'ml_insights': analysis['ml_insights']
-            }
+            'success': False, 
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
         })
+
+@app.route('/api/batch_analysis', methods=['POST'])
+def api_batch_analysis():
+    """Many account scenarios in one call: one snapshot per distinct timeframe, position sizing per scenario"""
+    try:
+        scenarios = parse_scenarios(request.get_json(silent=True), ANALYSIS_TIMEFRAMES, 'ml_simple')
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    try:
+        # The market analysis is shared by every scenario on the same timeframe
+        snapshots = {}
+        for time_frame in sorted({scenario['time_frame'] for scenario in scenarios}, key=int):
+            snapshot = analysis_snapshots.get(time_frame)
+            if snapshot is None:
+                return jsonify({
+                    'success': False,
+                    'error': analysis_snapshots.unavailable_reason(time_frame),
+                    'timestamp': datetime.now().isoformat()
+                }), 503
+            snapshots[time_frame] = snapshot
+        
+        results = []
+        for scenario in scenarios:
+            current_price = snapshots[scenario['time_frame']].payload['analysis']['current_price']
+            position_sizing = ai_bot.calculate_simple_position_size(
+                current_price, scenario['account_balance'], scenario['risk_per_trade']
+            )
+            results.append({**scenario, 'position_sizing': position_sizing})
+        
+        body = analysis_snapshots.batch_body(snapshots, results, success=True,
+                                             timestamp=datetime.now().isoformat(), scenarios=len(results))
+        return app.response_class(body, mimetype='application/json')
     except Exception as e:
         return jsonify({
             'success': False, 
@@ -1466,6 +1551,24 @@ def api_ai_analysis():
             'timestamp': datetime.now().isoformat()
         })
 
+@app.route('/api/stream')
+def api_stream():
+    """Server-sent events: a compact 'signal' event whenever a timeframe's recommendation, confidence, RSI or price changes"""
+    time_frames = request.args.getlist('time_frame')
+    unsupported = [time_frame for time_frame in time_frames if time_frame not in ANALYSIS_TIMEFRAMES]
+    if unsupported:
+        return jsonify({
+            'success': False,
+            'error': f"unsupported time_frame {', '.join(unsupported)}; use one of {', '.join(ANALYSIS_TIMEFRAMES)}",
+            'timestamp': datetime.now().isoformat()
+        }), 400
+    
+    # Events are produced by the snapshot refresher; a connection only forwards them
+    analysis_snapshots.start()
+    events = signal_events.subscribe(time_frames, request.headers.get('Last-Event-ID'))
+    return app.response_class(events, mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/health')
 def health_check():
     return jsonify({
@@ -1482,6 +1585,7 @@ if __name__ == '__main__':
     print("🤖 AI-Powered with Machine Learning")
     print("📊 Web Interface: http://localhost:5000")
     print("🔗 AI API: http://localhost:5000/api/ai_analysis")
+    print("📡 Live Signals: http://localhost:5000/api/stream")
     print("❤️  Health Check: http://localhost:5000/health")
     print("=" * 60)
     print("💡 IMPORTANT: This is for EDUCATIONAL PURPOSES only!")
@@ -1,12 +1,10 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
-import time
-import json
 from datetime import datetime
 from collections import deque
-import urllib.request
-import urllib.error   
+
+from market_data import http_client, clock, configure_record_replay
 
 class BitcoinPredictor:
     def __init__(self, root):
@@ -107,7 +105,7 @@ class BitcoinPredictor:
         disclaimer_label.pack(pady=5)
     
     def fetch_bitcoin_data(self):
-        """Fetch Bitcoin data using urllib (no external packages needed)"""
+        """Fetch Bitcoin data over pooled keep-alive connections (no external packages needed)"""
         sources = [
             self.get_binance_data,
             self.get_coingecko_data,
@@ -133,9 +131,8 @@ class BitcoinPredictor:
         """Get Bitcoin data from Binance"""
         try:
             url = "https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT"
-            with urllib.request.urlopen(url, timeout=10) as response:
-                data = json.loads(response.read().decode())
-                return float(data['price'])
+            data = http_client.get_json(url, timeout=10)
+            return float(data['price'])
         except:
             return None
     
@@ -143,9 +140,8 @@ class BitcoinPredictor:
         """Get Bitcoin data from CoinGecko"""
         try:
             url = "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd"
-            with urllib.request.urlopen(url, timeout=10) as response:
-                data = json.loads(response.read().decode())
-                return data['bitcoin']['usd']
+            data = http_client.get_json(url, timeout=10)
+            return data['bitcoin']['usd']
         except:
             return None
     
@@ -153,9 +149,8 @@ class BitcoinPredictor:
         """Get Bitcoin data from CryptoCompare"""
         try:
             url = "https://min-api.cryptocompare.com/data/price?fsym=BTC&tsyms=USD"
-            with urllib.request.urlopen(url, timeout=10) as response:
-                data = json.loads(response.read().decode())
-                return data['USD']
+            data = http_client.get_json(url, timeout=10)
+            return data['USD']
         except:
             return None
     
@@ -337,7 +332,7 @@ class BitcoinPredictor:
         previous_price = None
         error_count = 0
         
-        while self.running:
+        while self.running and not clock.finished:
             try:
                 # Fetch new price
                 new_price = self.fetch_bitcoin_data()
@@ -364,12 +359,14 @@ class BitcoinPredictor:
                         self.status_var.set("Error: Unable to fetch Bitcoin prices. Check internet connection.")
                 
                 # Wait 2 seconds before next update (slower to avoid rate limits)
-                time.sleep(2)
+                clock.sleep(2)
                 
             except Exception as e:
                 error_count += 1
                 print(f"Error in data loop: {e}")
-                time.sleep(5)  # Wait longer if there's an error
+                clock.sleep(5)  # Wait longer if there's an error
+        if clock.finished:
+            print("Replay finished")
     
     def start_data_fetching(self):
         """Start the data fetching in a separate thread"""
@@ -382,6 +379,9 @@ class BitcoinPredictor:
         self.root.destroy()
 
 def main():
+    replay_mode = configure_record_replay()
+    if replay_mode:
+        print(replay_mode)
     root = tk.Tk()
     app = BitcoinPredictor(root)
     
@@ -1,15 +1,14 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
-import time
-import json
 from datetime import datetime, timedelta
 from collections import deque
-import urllib.request
-import urllib.error
 import math
 import random
 
+from market_data import http_client, clock, configure_record_replay
+from indicators import RollingWindowStats, RollingExtremum
+
 class BitcoinPredictor:
     def __init__(self, root):
         self.root = root
@@ -21,6 +20,10 @@ class BitcoinPredictor:
         
         # Data storage
         self.price_history = deque(maxlen=100)
+        # Rolling mean/variance shared by the SMA and Bollinger calculations
+        self.rolling_stats = RollingWindowStats((10, 20, 30, 50))
+        # 20-price high/low window behind the support/resistance levels
+        self.price_range = RollingExtremum(20)
         self.volume_history = deque(maxlen=100)
         self.current_price = 0
         self.price_change = 0
@@ -266,7 +269,7 @@ class BitcoinPredictor:
             self.position_size_label.config(text="Position Size: Enter valid numbers")
     
     def fetch_bitcoin_data(self):
-        """Fetch Bitcoin data using urllib"""
+        """Fetch Bitcoin data over pooled keep-alive connections"""
         sources = [
             self.get_binance_data,
             self.get_coingecko_data,
@@ -293,9 +296,8 @@ class BitcoinPredictor:
         """Get Bitcoin data from Binance"""
         try:
             url = "https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT"
-            with urllib.request.urlopen(url, timeout=10) as response:
-                data = json.loads(response.read().decode())
-                return float(data['price'])
+            data = http_client.get_json(url, timeout=10)
+            return float(data['price'])
         except:
             return None
     
@@ -303,9 +305,8 @@ class BitcoinPredictor:
         """Get Bitcoin data from CoinGecko"""
         try:
             url = "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd"
-            with urllib.request.urlopen(url, timeout=10) as response:
-                data = json.loads(response.read().decode())
-                return data['bitcoin']['usd']
+            data = http_client.get_json(url, timeout=10)
+            return data['bitcoin']['usd']
         except:
             return None
     
@@ -313,17 +314,22 @@ class BitcoinPredictor:
         """Get Bitcoin data from CryptoCompare"""
         try:
             url = "https://min-api.cryptocompare.com/data/price?fsym=BTC&tsyms=USD"
-            with urllib.request.urlopen(url, timeout=10) as response:
-                data = json.loads(response.read().decode())
-                return data['USD']
+            data = http_client.get_json(url, timeout=10)
+            return data['USD']
         except:
             return None
     
+    def add_price(self, price):
+        """Append a price to the history and advance the streaming indicators"""
+        self.price_history.append(price)
+        self.rolling_stats.update(price)
+        self.price_range.update(price)
+    
     def calculate_sma(self, period):
         """Calculate Simple Moving Average"""
         if len(self.price_history) < period:
             return None
-        return sum(list(self.price_history)[-period:]) / period
+        return self.rolling_stats.mean(period)
     
     def calculate_ema(self, period):
         """Calculate Exponential Moving Average"""
@@ -392,29 +398,17 @@ class BitcoinPredictor:
         if len(self.price_history) < period:
             return None, None, None
         
-        prices = list(self.price_history)[-period:]
-        middle_band = sum(prices) / period
-        
-        # Calculate standard deviation
-        variance = sum((x - middle_band) ** 2 for x in prices) / period
-        std_dev = math.sqrt(variance)
-        
-        upper_band = middle_band + (std_dev * 2)
-        lower_band = middle_band - (std_dev * 2)
-        
-        return upper_band, middle_band, lower_band
+        return self.rolling_stats.bollinger_bands(period)
     
     def calculate_support_resistance(self):
         """Calculate support and resistance levels"""
         if len(self.price_history) < 20:
             return [], []
         
-        prices = list(self.price_history)
-        
         # Simple method: use recent highs and lows
-        recent_high = max(prices[-20:])
-        recent_low = min(prices[-20:])
-        current_price = prices[-1]
+        recent_high = self.price_range.max
+        recent_low = self.price_range.min
+        current_price = self.price_history[-1]
         
         # Calculate support levels (below current price)
         support1 = recent_low
@@ -789,7 +783,7 @@ class BitcoinPredictor:
         previous_price = None
         error_count = 0
         
-        while self.running:
+        while self.running and not clock.finished:
             try:
                 # Fetch new price
                 new_price = self.fetch_bitcoin_data()
@@ -803,7 +797,7 @@ class BitcoinPredictor:
                         self.change_percentage = (self.price_change / previous_price) * 100
                     
                     # Update history
-                    self.price_history.append(new_price)
+                    self.add_price(new_price)
                     self.volume_history.append(self.volume)
                     
                     previous_price = new_price
@@ -817,12 +811,14 @@ class BitcoinPredictor:
                         self.status_var.set("Error: Unable to fetch Bitcoin prices. Check internet connection.")
                 
                 # Wait 3 seconds before next update
-                time.sleep(3)
+                clock.sleep(3)
                 
             except Exception as e:
                 error_count += 1
                 print(f"Error in data loop: {e}")
-                time.sleep(5)
+                clock.sleep(5)
+        if clock.finished:
+            print("Replay finished")
     
     def start_data_fetching(self):
         """Start the data fetching in a separate thread"""
@@ -835,6 +831,9 @@ class BitcoinPredictor:
         self.root.destroy()
 
 def main():
+    replay_mode = configure_record_replay()
+    if replay_mode:
+        print(replay_mode)
     root = tk.Tk()
     app = BitcoinPredictor(root)
     
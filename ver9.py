@@ -1,15 +1,14 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
-import time
-import json
 from datetime import datetime, timedelta
 from collections import deque
-import urllib.request
-import urllib.error
 import math
 import random
 
+from market_data import http_client, clock, configure_record_replay
+from indicators import RollingWindowStats, RollingExtremum
+
 class BitcoinPredictor:
     def __init__(self, root):
         self.root = root
@@ -25,6 +24,10 @@ class BitcoinPredictor:
         
         # Data storage
         self.price_history = deque(maxlen=100)
+        # Rolling mean/variance shared by the SMA and Bollinger calculations
+        self.rolling_stats = RollingWindowStats((10, 20, 30, 50))
+        # 20-price high/low window behind the support/resistance levels
+        self.price_range = RollingExtremum(20)
         self.volume_history = deque(maxlen=100)
         self.current_price = 0
         self.price_change = 0
@@ -542,34 +545,37 @@ class BitcoinPredictor:
     def get_binance_data(self):
         try:
             url = "https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT"
-            with urllib.request.urlopen(url, timeout=10) as response:
-                data = json.loads(response.read().decode())
-                return float(data['price'])
+            data = http_client.get_json(url, timeout=10)
+            return float(data['price'])
         except:
             return None
     
     def get_coingecko_data(self):
         try:
             url = "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd"
-            with urllib.request.urlopen(url, timeout=10) as response:
-                data = json.loads(response.read().decode())
-                return data['bitcoin']['usd']
+            data = http_client.get_json(url, timeout=10)
+            return data['bitcoin']['usd']
         except:
             return None
     
     def get_cryptocompare_data(self):
         try:
             url = "https://min-api.cryptocompare.com/data/price?fsym=BTC&tsyms=USD"
-            with urllib.request.urlopen(url, timeout=10) as response:
-                data = json.loads(response.read().decode())
-                return data['USD']
+            data = http_client.get_json(url, timeout=10)
+            return data['USD']
         except:
             return None
     
+    def add_price(self, price):
+        """Append a price to the history and advance the streaming indicators"""
+        self.price_history.append(price)
+        self.rolling_stats.update(price)
+        self.price_range.update(price)
+    
     def calculate_sma(self, period):
         if len(self.price_history) < period:
             return None
-        return sum(list(self.price_history)[-period:]) / period
+        return self.rolling_stats.mean(period)
     
     def calculate_ema(self, period):
         if len(self.price_history) < period:
@@ -631,25 +637,15 @@ class BitcoinPredictor:
         if len(self.price_history) < period:
             return None, None, None
         
-        prices = list(self.price_history)[-period:]
-        middle_band = sum(prices) / period
-        
-        variance = sum((x - middle_band) ** 2 for x in prices) / period
-        std_dev = math.sqrt(variance)
-        
-        upper_band = middle_band + (std_dev * 2)
-        lower_band = middle_band - (std_dev * 2)
-        
-        return upper_band, middle_band, lower_band
+        return self.rolling_stats.bollinger_bands(period)
     
     def calculate_support_resistance(self):
         if len(self.price_history) < 20:
             return [], []
         
-        prices = list(self.price_history)
-        recent_high = max(prices[-20:])
-        recent_low = min(prices[-20:])
-        current_price = prices[-1]
+        recent_high = self.price_range.max
+        recent_low = self.price_range.min
+        current_price = self.price_history[-1]
         
         support1 = recent_low
         support2 = recent_low - (recent_high - recent_low) * 0.1
@@ -1009,7 +1005,7 @@ class BitcoinPredictor:
         previous_price = None
         error_count = 0
         
-        while self.running:
+        while self.running and not clock.finished:
             try:
                 new_price = self.fetch_bitcoin_data()
                 
@@ -1020,7 +1016,7 @@ class BitcoinPredictor:
                         self.price_change = new_price - previous_price
                         self.change_percentage = (self.price_change / previous_price) * 100
                     
-                    self.price_history.append(new_price)
+                    self.add_price(new_price)
                     previous_price = new_price
                     error_count = 0
                     
@@ -1030,11 +1026,13 @@ class BitcoinPredictor:
                     if error_count > 5:
                         self.status_var.set("❌ Check internet connection")
                 
-                time.sleep(3)
+                clock.sleep(3)
                 
             except Exception as e:
                 error_count += 1
-                time.sleep(5)
+                clock.sleep(5)
+        if clock.finished:
+            print("Replay finished")
     
     def start_data_fetching(self):
         self.data_thread = threading.Thread(target=self.data_loop, daemon=True)
@@ -1045,6 +1043,9 @@ class BitcoinPredictor:
         self.root.destroy()
 
 def main():
+    replay_mode = configure_record_replay()
+    if replay_mode:
+        print(replay_mode)
     root = tk.Tk()
     app = BitcoinPredictor(root)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)